@@ -0,0 +1,303 @@
+# benchmarks.py
+
+"""
+Benchmark suite for the hot paths of the simulation: saturation_main in both models and every run mode,
+find_neighbor_status, calc_infest, County.hatch_eggs, set_up and the recording of the results into a dataframe.
+Every benchmark draws from a fixed seed and is timed over a few repeats with time.perf_counter, with any setup kept
+out of the timing. They run on the Illinois network and on synthetic networks of increasing size from
+synthetic_network.py.
+
+Reports are written as JSON along with the versions and machine they ran on, and compare_benchmarks puts two of them
+side by side, so a run before and after a change shows what got faster or slower:
+    python benchmarks.py before.json
+    python benchmarks.py after.json
+An optional second argument picks the topology of the synthetic networks, 'grid', 'geometric' or 'national'.
+"""
+
+import json
+import platform
+import sys
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from my_classes import EdgeWeights, MonthQueue, SaturationRecord
+from run_modes import get_run_mode_names
+from run_simulation import (ENGINES, calc_infest, find_neighbor_status, iterate_through_timeframe, load_network,
+                            saturation_main, set_up)
+from synthetic_network import make_network
+
+SEED = 42
+SIZES = (100, 400, 1600)
+
+
+def time_call(function, setup=None, repeat=3) -> dict:
+    """
+    Times a function over a number of repeats.
+    :param function: function to time
+    :param setup: function run before every repeat, outside the timing, whose return value is a tuple of the
+    arguments of function. Defaults to calling function without arguments.
+    :param repeat: number of timed calls
+    :return: dict of the 'best', 'median', 'mean' and 'std' seconds of a call and the 'repeat' count
+
+    >>> timing = time_call(sum, setup=lambda: (range(1000),), repeat=2)
+    >>> sorted(timing), timing['repeat']
+    (['best', 'mean', 'median', 'repeat', 'std'], 2)
+    """
+    times = []
+    for _ in range(repeat):
+        args = () if setup is None else setup()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    times = np.array(times)
+    return {'best': float(times.min()), 'median': float(np.median(times)), 'mean': float(times.mean()),
+            'std': float(times.std()), 'repeat': repeat}
+
+
+def get_networks(sizes=SIZES, topology='grid') -> dict:
+    """
+    Utility function.
+    Collects the networks the benchmarks run on: Illinois and a synthetic network of every size.
+    :param sizes: numbers of counties of the synthetic networks
+    :param topology: topology of the synthetic networks, see synthetic_network.make_network
+    :return: dict of network labels and (CG, schema) pairs
+    """
+    CG, schema, neighbor_schema = load_network()
+    networks = {'IL': (CG, schema)}
+    for size in sizes:
+        CG, schema, neighbor_schema = make_network(size, topology, seed=SEED)
+        networks[f'{topology} {size}'] = (CG, schema)
+    return networks
+
+
+def clone_schema(schema: dict) -> dict:
+    """
+    Utility function.
+    Copies every county of a schema, so each repeat of a benchmark starts from the same state.
+    :param schema: a dict of county names and their objects
+    :return: a dict of the same names and copies of the objects
+    """
+    return {name: county.clone() for name, county in schema.items()}
+
+
+def make_result(benchmark: str, network: str, case: str, timing: dict, CG=None) -> dict:
+    """
+    Utility function.
+    Labels the timing of one benchmark case.
+    :param benchmark: name of the timed function
+    :param network: label of the network it ran on
+    :param case: description of the arguments
+    :param timing: dict from time_call
+    :param CG: graph of the network, to record its size
+    :return: dict of the labels, network size and timing
+    """
+    size = {} if CG is None else {'counties': CG.number_of_nodes(), 'edges': CG.number_of_edges()}
+    return dict({'benchmark': benchmark, 'network': network, 'case': case}, **size, **timing)
+
+
+def bench_set_up(repeat=3) -> list:
+    """
+    Times reading the Illinois networks from disk.
+    :param repeat: number of timed calls
+    :return: list of results
+    """
+    return [make_result('set_up', 'IL', f"prefix='{prefix}'", time_call(set_up, setup=lambda: (prefix,),
+                                                                        repeat=repeat))
+            for prefix in ('', 'fast_')]
+
+
+def bench_find_neighbor_status(networks: dict, repeat=3) -> list:
+    """
+    Times building the neighbor lists of every network.
+    :param networks: dict from get_networks
+    :param repeat: number of timed calls
+    :return: list of results
+    """
+    return [make_result('find_neighbor_status', label, '', time_call(find_neighbor_status,
+                                                                     setup=lambda: (CG, schema), repeat=repeat), CG)
+            for label, (CG, schema) in networks.items()]
+
+
+def bench_calc_infest(networks: dict, run_modes: list, repeat=3) -> list:
+    """
+    Times one September of calc_infest, when spread also carries eggs, in every run mode and network.
+    :param networks: dict from get_networks
+    :param run_modes: names of the run modes
+    :param repeat: number of timed calls
+    :return: list of results
+    """
+    months_queue = MonthQueue()
+    september = [months_queue.rotate() for _ in range(9)][-1]
+    results = []
+    for label, (CG, schema) in networks.items():
+        for run_mode in run_modes:
+            def setup():
+                fresh = clone_schema(schema)
+                record = SaturationRecord.from_schema(fresh, 2, time_frame='month')
+                return (CG, find_neighbor_status(CG, fresh), fresh, record, 2, september, run_mode,
+                        np.random.default_rng(SEED), EdgeWeights.of(CG))
+            results.append(make_result('calc_infest', label, run_mode, time_call(calc_infest, setup=setup,
+                                                                                 repeat=repeat), CG))
+    return results
+
+
+def bench_hatch_eggs(networks: dict, repeat=3) -> list:
+    """
+    Times County.hatch_eggs for every county of every network.
+    :param networks: dict from get_networks
+    :param repeat: number of timed calls
+    :return: list of results
+    """
+    def hatch_all(counties, rng):
+        for county in counties:
+            county.hatch_eggs(rng=rng)
+
+    def setup(schema):
+        counties = list(clone_schema(schema).values())
+        for county in counties:
+            county.egg_pop = 0.25
+        return counties, np.random.default_rng(SEED)
+
+    return [make_result('County.hatch_eggs', label, 'every county', time_call(hatch_all, setup=lambda: setup(schema),
+                                                                              repeat=repeat), CG)
+            for label, (CG, schema) in networks.items()]
+
+
+def bench_recording(networks: dict, iterations=120, repeat=3) -> list:
+    """
+    Times recording the saturations of every county for a number of timesteps and building the cumulative_df.
+    :param networks: dict from get_networks
+    :param iterations: number of timesteps recorded
+    :param repeat: number of timed calls
+    :return: list of results
+    """
+    def record_all(schema, saturations):
+        record = SaturationRecord.from_schema(schema, iterations + 1, time_frame='month')
+        for time_tracker in range(2, iterations + 2):
+            record.record(time_tracker, saturations)
+        return record.to_dataframe()
+
+    return [make_result('SaturationRecord', label, f'{iterations} timesteps',
+                        time_call(record_all, setup=lambda: (schema, [0.5] * len(schema)), repeat=repeat), CG)
+            for label, (CG, schema) in networks.items()]
+
+
+def bench_saturation_main(run_modes: list, iterations: dict, engines=ENGINES, repeat=3) -> list:
+    """
+    Times saturation_main on the Illinois network in both models, every run mode and every engine.
+    :param run_modes: names of the run modes
+    :param iterations: dict of the number of timesteps of the 'annual' and 'life cycle' models
+    :param engines: engines to time
+    :param repeat: number of timed calls
+    :return: list of results
+    """
+    results = []
+    for model, life_cycle in (('annual', False), ('life cycle', True)):
+        for engine in engines:
+            for run_mode in run_modes:
+                def run(rng):
+                    return saturation_main(run_mode, iterations[model], life_cycle=life_cycle, engine=engine,
+                                           rng=rng)
+                timing = time_call(run, setup=lambda: (np.random.default_rng(SEED),), repeat=repeat)
+                results.append(make_result('saturation_main', 'IL',
+                                           f'{run_mode}, {model}, {iterations[model]} steps, {engine}', timing))
+    return results
+
+
+def bench_iterate(networks: dict, iterations: dict, run_mode='All', repeat=3) -> list:
+    """
+    Times whole runs of the object model on every network, the way saturation_main runs them.
+    :param networks: dict from get_networks
+    :param iterations: dict of the number of timesteps of the 'annual' and 'life cycle' models
+    :param run_mode: name of the run mode
+    :param repeat: number of timed calls
+    :return: list of results
+    """
+    results = []
+    for label, (CG, schema) in networks.items():
+        for model, life_cycle in (('annual', False), ('life cycle', True)):
+            def run(fresh, rng):
+                return iterate_through_timeframe(CG, fresh, iterations[model], run_mode, life_cycle=life_cycle,
+                                                 rng=rng)
+            timing = time_call(run, setup=lambda: (clone_schema(schema), np.random.default_rng(SEED)),
+                               repeat=repeat)
+            results.append(make_result('iterate_through_timeframe', label,
+                                       f'{run_mode}, {model}, {iterations[model]} steps', timing, CG))
+    return results
+
+
+def run_benchmarks(sizes=SIZES, topology='grid', run_modes=None, iterations=None, engines=ENGINES, repeat=3) -> dict:
+    """
+    Runs the whole suite.
+    :param sizes: numbers of counties of the synthetic networks
+    :param topology: topology of the synthetic networks, 'grid', 'geometric' or 'national'
+    :param run_modes: names of the run modes, defaults to every registered one
+    :param iterations: dict of the number of timesteps of the 'annual' and 'life cycle' models, defaults to 10 years
+    and 24 months
+    :param engines: engines saturation_main is timed with
+    :param repeat: number of timed calls of every case
+    :return: dict of the 'meta' data of the run and the list of 'results'
+
+    >>> report = run_benchmarks(sizes=(16,), run_modes=['Baseline'], iterations={'annual': 2, 'life cycle': 2},
+    ...                         repeat=1)
+    >>> sorted({result['benchmark'] for result in report['results']})[:3]
+    ['County.hatch_eggs', 'SaturationRecord', 'calc_infest']
+    >>> report['meta']['seed']
+    42
+    """
+    run_modes = get_run_mode_names() if run_modes is None else run_modes
+    iterations = {'annual': 10, 'life cycle': 24} if iterations is None else iterations
+    networks = get_networks(sizes, topology)
+    meta = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'seed': SEED, 'repeat': repeat, 'topology': topology,
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'networkx': nx.__version__, 'platform': platform.platform(), 'processor': platform.processor()}
+    results = (bench_set_up(repeat=repeat) + bench_find_neighbor_status(networks, repeat=repeat)
+               + bench_calc_infest(networks, run_modes, repeat=repeat) + bench_hatch_eggs(networks, repeat=repeat)
+               + bench_recording(networks, repeat=repeat)
+               + bench_saturation_main(run_modes, iterations, engines=engines, repeat=repeat)
+               + bench_iterate(networks, iterations, repeat=repeat))
+    return {'meta': meta, 'results': results}
+
+
+def write_benchmarks(report: dict, path: str):
+    """
+    Writes a report from run_benchmarks to a JSON file.
+    :param report: dict from run_benchmarks
+    :param path: JSON file to write
+    """
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=1)
+
+
+def compare_benchmarks(before: str, after: str) -> pd.DataFrame:
+    """
+    Puts the best times of two reports side by side.
+    :param before: JSON file of the earlier report
+    :param after: JSON file of the later report
+    :return: dataframe with one row per case found in both reports, its 'before' and 'after' best seconds and the
+    'speedup' of after over before, so values below 1 are regressions
+
+    >>> import os, tempfile
+    >>> report = {'meta': {}, 'results': [make_result('set_up', 'IL', '', {'best': 0.02})]}
+    >>> with tempfile.TemporaryDirectory() as path:
+    ...     write_benchmarks(report, f'{path}/before.json')
+    ...     report['results'][0]['best'] = 0.01
+    ...     write_benchmarks(report, f'{path}/after.json')
+    ...     compare_benchmarks(f'{path}/before.json', f'{path}/after.json')['speedup'].tolist()
+    [2.0]
+    """
+    tables = []
+    for path in (before, after):
+        with open(path) as report_file:
+            tables.append(pd.DataFrame(json.load(report_file)['results'])[['benchmark', 'network', 'case', 'best']])
+    comparison_df = tables[0].merge(tables[1], on=['benchmark', 'network', 'case'], suffixes=('_before', '_after'))
+    comparison_df = comparison_df.rename(columns={'best_before': 'before', 'best_after': 'after'})
+    comparison_df['speedup'] = comparison_df['before'] / comparison_df['after']
+    return comparison_df
+
+
+if __name__ == '__main__':
+    write_benchmarks(run_benchmarks(topology=sys.argv[2] if len(sys.argv) > 2 else 'grid'),
+                     sys.argv[1] if len(sys.argv) > 1 else 'benchmarks.json')
@@ -0,0 +1,177 @@
+# checkpoint.py
+
+"""
+Checkpoints of a run in progress. The engines save their full state to a Checkpoint every few timesteps and can
+resume from one, finishing exactly as the uninterrupted run would have. The rng state helpers are also what
+result_cache.py uses to key and restore runs.
+"""
+
+import json
+import os
+
+import numpy as np
+from numpy import random
+from my_classes import BlockSampler
+
+
+class Checkpoint:
+    """
+    Saves the full state of a run every few timesteps to one compressed .npz file, so a run that is stopped part way
+    can be resumed and finish exactly as it would have without stopping. The file holds the county attributes a run
+    changes, the edge weight overlay, the month position, the saturations recorded so far and the state of the rng,
+    with the settings of the run in a json 'meta' entry. Each save replaces the file in one step, so a run that stops
+    mid save leaves the previous checkpoint intact.
+
+    :param path: file the checkpoint is written to
+    :param every: number of timesteps between checkpoints
+    """
+    FORMAT_NAME = 'slf-checkpoint'
+    FORMAT_VERSION = 1
+    COLUMNS = ('saturation', 'slf_pop', 'mated', 'laid_eggs', 'egg_pop', 'toh_density', 'traffic_level',
+               'quarantine', 'public_awareness', 'toh_trigger')  # the County attributes that change during a run
+
+    def __init__(self, path: str, every=1):
+        if not (type(every) == int and every > 0):
+            raise ValueError('Please use an integer greater than zero.')
+        self.path = path
+        self.every = every
+
+    def due(self, time_tracker: int) -> bool:
+        """
+        checks if a checkpoint should be saved once a timestep has been simulated.
+        :param time_tracker: count of the current year or month, starting at 1
+        :return: True every `every` simulated timesteps
+        """
+        return (time_tracker - 1) % self.every == 0
+
+    def save(self, run: dict, time_tracker: int, columns: dict, results: np.ndarray, rng, weights=None,
+             month_position=0, steady_state=None):
+        """
+        writes the state of a run at the end of a timestep.
+        :param run: json-able settings that identify the run, checked again when it is resumed
+        :param time_tracker: count of the last simulated year or month, starting at 1
+        :param columns: dict of county attribute names and arrays
+        :param results: saturations recorded so far, ([replicate,] county, time)
+        :param rng: numpy Generator, BlockSampler or the numpy.random module the run draws from
+        :param weights: current edge weights, if the run changes them
+        :param month_position: position of the MonthQueue
+        :param steady_state: SteadyState of the run
+        """
+        rng_state, arrays = Checkpoint.get_rng_state(rng)
+        arrays.update({f'column_{atr}': column for atr, column in columns.items()})
+        arrays['results'] = results[..., :time_tracker]
+        if weights is not None:
+            arrays['weights'] = weights
+        if steady_state is not None and steady_state.previous is not None:
+            arrays['previous'] = steady_state.previous
+        meta = {'format': self.FORMAT_NAME, 'version': self.FORMAT_VERSION, 'run': run, 'time_tracker': time_tracker,
+                'month_position': month_position, 'rng': rng_state,
+                'unchanged': 0 if steady_state is None else steady_state.unchanged}
+        with open(f'{self.path}.tmp', 'wb') as checkpoint_file:
+            np.savez_compressed(checkpoint_file, meta=np.array(json.dumps(meta)), **arrays)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    @staticmethod
+    def load(path: str, run=None) -> dict:
+        """
+        reads a checkpoint.
+        :param path: file of the checkpoint
+        :param run: settings of the run being resumed, which have to match the ones the checkpoint was saved with
+        :return: dict of the saved state, with the meta entries, 'columns', 'results', 'weights' (None if not saved),
+        'previous' and 'arrays' holding every saved array
+
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as folder:
+        ...     checkpoint = Checkpoint(f'{folder}/run.npz')
+        ...     checkpoint.save({'iterations': 4}, 2, {'saturation': np.array([0.5])}, np.array([[0.0, 0.5, 0.0]]),
+        ...                     np.random.default_rng(1))
+        ...     state = Checkpoint.load(f'{folder}/run.npz', run={'iterations': 4})
+        ...     Checkpoint.load(f'{folder}/run.npz', run={'iterations': 5})
+        Traceback (most recent call last):
+        ...
+        ValueError: This checkpoint does not belong to this run.
+        >>> state['time_tracker'], state['results'].tolist(), state['columns']['saturation'].tolist()
+        (2, [[0.0, 0.5]], [0.5])
+        """
+        with np.load(path, allow_pickle=False) as checkpoint_file:
+            arrays = {name: checkpoint_file[name] for name in checkpoint_file.files}
+        state = json.loads(arrays.pop('meta').item())
+        if state.get('format') != Checkpoint.FORMAT_NAME or state.get('version') != Checkpoint.FORMAT_VERSION:
+            raise ValueError('This checkpoint version is not supported.')
+        if run is not None and state['run'] != run:
+            raise ValueError('This checkpoint does not belong to this run.')
+        state['columns'] = {name[len('column_'):]: column for name, column in arrays.items()
+                            if name.startswith('column_')}
+        state['results'] = arrays['results']
+        state['weights'] = arrays.get('weights')
+        state['previous'] = arrays.get('previous')
+        state['arrays'] = arrays
+        return state
+
+    @staticmethod
+    def get_rng_state(rng) -> (dict, dict):
+        """
+        captures the state of an rng. Arrays in the state, like the key of MT19937, are kept apart so they can be
+        stored as arrays.
+        :param rng: numpy Generator, BlockSampler or the numpy.random module
+        :return: json-able state and a dict of the arrays it refers to
+        """
+        arrays = {}
+
+        def pack(value, name):
+            if isinstance(value, dict):
+                return {key: pack(item, f'{name}_{key}') for key, item in value.items()}
+            if isinstance(value, np.ndarray):
+                arrays[name] = value
+                return {'array': name}
+            return value
+
+        if isinstance(rng, BlockSampler):
+            inner, arrays = Checkpoint.get_rng_state(rng.rng)
+            arrays.update({f'block_{kind}': np.array(block[rng.positions[kind]:], dtype=float)
+                           for kind, block in rng.blocks.items()})
+            return {'kind': 'BlockSampler', 'block_size': rng.block_size, 'rng': inner}, arrays
+        if rng is random:
+            return {'kind': 'global', 'state': pack(random.get_state(legacy=False), 'rng')}, arrays
+        return {'kind': 'Generator', 'state': pack(rng.bit_generator.state, 'rng')}, arrays
+
+    @staticmethod
+    def set_rng_state(rng, state: dict, arrays: dict):
+        """
+        puts an rng back into a state from get_rng_state.
+        :param rng: numpy Generator, BlockSampler or the numpy.random module, of the same kind the state came from
+        :param state: json-able state from get_rng_state
+        :param arrays: the arrays the state refers to
+
+        >>> rng = np.random.default_rng(4)
+        >>> sampler = BlockSampler(rng, block_size=8)
+        >>> first = sampler.normal()
+        >>> state, arrays = Checkpoint.get_rng_state(sampler)
+        >>> expected = [sampler.normal() for _ in range(10)]
+        >>> other = BlockSampler(np.random.default_rng(0))
+        >>> Checkpoint.set_rng_state(other, state, arrays)
+        >>> [other.normal() for _ in range(10)] == expected
+        True
+        >>> Checkpoint.set_rng_state(rng, state, arrays)
+        Traceback (most recent call last):
+        ...
+        ValueError: This checkpoint was saved with a different kind of rng.
+        """
+        def unpack(value):
+            if isinstance(value, dict):
+                return arrays[value['array']] if set(value) == {'array'} else {key: unpack(item)
+                                                                                for key, item in value.items()}
+            return value
+
+        kind = 'BlockSampler' if isinstance(rng, BlockSampler) else 'global' if rng is random else 'Generator'
+        if kind != state['kind']:
+            raise ValueError('This checkpoint was saved with a different kind of rng.')
+        if kind == 'BlockSampler':
+            Checkpoint.set_rng_state(rng.rng, state['rng'], arrays)
+            rng.block_size = state['block_size']
+            rng.blocks = {block: arrays[f'block_{block}'].tolist() for block in rng.blocks}
+            rng.positions = {block: 0 for block in rng.blocks}
+        elif kind == 'global':
+            random.set_state(unpack(state['state']))
+        else:
+            rng.bit_generator.state = unpack(state['state'])
@@ -8,6 +8,7 @@
 This file is for the creation of county network
 It constructs a network with nodes and edges
 outputs three binary files: the NX network, a county handler, and a neighbor handler.
+The network is also saved in the array format of network_format.py, with the county geometries in a side file.
 
 TODO: doctests for get_neighbor_handler, calc_toh_density_coef, add_tree_density?
 """
@@ -20,7 +21,8 @@ import numpy as np
 import networkx as nx
 import osmnx as ox
 from collections import Counter
-from my_classes import County
+from my_classes import County, NeighborIndex
+from network_format import write_network
 
 
 def get_lower_and_upper_bounds(df: pd.DataFrame, col_name: str) -> tuple:
@@ -140,13 +142,10 @@ def get_neighbor_handler(CG: nx.Graph, handler: dict) -> dict:
                                 list of neighboring county nodes for values
 
     """
+    index = NeighborIndex(CG)
     neighbor_handle = {}
     for county in handler:
-        all_neighbors = []
-        for neighbor in handler[county].get_neighbor_objects(CG):
-            neighbor = handler[neighbor.name]
-            all_neighbors.append(neighbor)
-        neighbor_handle[county] = all_neighbors
+        neighbor_handle[county] = [handler[neighbor] for neighbor in index.neighbor_names(county)]
     return neighbor_handle
 
 
@@ -266,7 +265,8 @@ def construct_graph_and_handlers(CG: nx.Graph, county_df: pd.DataFrame, edge_df:
 
 def dump_graph_and_handler(CG: nx.Graph, county_handler: pd.DataFrame, neighbor_handler: pd.DataFrame, prefix=None):
     """
-    Pickles Illinois network graph, county handler, and neighbor handler.
+    Pickles Illinois network graph, county handler, and neighbor handler, and saves the network in the array format
+    run_simulation.set_up loads, see network_format.py.
     :param CG: NetworkX graph
     :param county_handler: handler for nodes of NetworkX graph
     :param neighbor_handler: handler for nodes and nodes connected to them.
@@ -276,6 +276,7 @@ def dump_graph_and_handler(CG: nx.Graph, county_handler: pd.DataFrame, neighbor_
     pickle.dump(CG, open(f'{path}/{prefix}IL_graph.dat', 'wb'))
     pickle.dump(county_handler, open(f'{path}/{prefix}graph_handler_counties.dat', 'wb'))
     pickle.dump(neighbor_handler, open(f'{path}/{prefix}graph_handler_neighbors.dat', 'wb'))
+    write_network(CG, county_handler, prefix=prefix, path=path)
 
 
 if __name__ == '__main__':
@@ -4,9 +4,76 @@
 This file will contain the classes to be used in the MC simulation
 """
 
-from queue import Queue
+import numbers
+import weakref
+
+import numpy as np
 from numpy import random
 import networkx as nx
+import pandas as pd
+
+def batch_hatch(egg_pop: np.ndarray, hatch_chance, rng=None) -> (np.ndarray, np.ndarray):
+    """
+    Hatches eggs for any number of counties and replicates at once. Every 0.01 of hatched egg_pop adds a
+    uniform 0.035 to 0.045 to slf_pop, so a county's gain is a sum of uniforms. All of the uniforms every county needs
+    are drawn in one call and summed per county, which keeps the distribution of the 0.01 step loop exactly.
+    :param egg_pop: array of egg populations
+    :param hatch_chance: array or scalar share of the eggs that hatch
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+    :return new_slf: slf_pop gained by every county
+    :return hatched: egg_pop hatched by every county
+
+    >>> new_slf, hatched = batch_hatch(np.array([[0.0, 0.25], [1.0, 0.1]]), 1.0)
+    >>> hatched.round(8).tolist()
+    [[0.0, 0.25], [1.0, 0.1]]
+    >>> bool(((new_slf >= hatched * 3.5) & (new_slf <= hatched * 4.5)).all())
+    True
+    """
+    rng = random if rng is None else rng
+    steps = np.maximum(np.rint(np.round(egg_pop * hatch_chance, 2) * 100), 0).astype(np.intp)
+    new_slf = np.zeros(steps.size)
+    hatching = steps.ravel() > 0
+    if hatching.any():
+        egg_coefs = rng.uniform(0.035, 0.045, size=int(steps.sum()))
+        starts = np.cumsum(steps.ravel()) - steps.ravel()
+        new_slf[hatching] = np.add.reduceat(egg_coefs, starts[hatching])
+    return new_slf.reshape(steps.shape), steps * .01
+
+
+def get_moments(values: np.ndarray) -> (int, np.ndarray, np.ndarray):
+    """
+    Returns the count, mean and sum of squared differences from the mean of a group of values, along the first axis.
+    :param values: array shaped (member, ...)
+    :return count: number of members
+    :return mean: mean of the members
+    :return m2: sum of squared differences from the mean
+
+    >>> get_moments(np.array([1.0, 2.0, 3.0]))
+    (3, 2.0, 2.0)
+    """
+    mean = values.mean(axis=0)
+    return len(values), mean, ((values - mean) ** 2).sum(axis=0)
+
+
+def merge_moments(count_a: int, mean_a, m2_a, count_b: int, mean_b, m2_b) -> (np.ndarray, np.ndarray):
+    """
+    Merges the moments of two groups with Chan's formula, the parallel form of Welford's online update.
+    :param count_a: number of members of the first group
+    :param mean_a: mean of the first group
+    :param m2_a: sum of squared differences from the mean of the first group
+    :param count_b: number of members of the second group
+    :param mean_b: mean of the second group
+    :param m2_b: sum of squared differences from the mean of the second group
+    :return mean: mean of both groups
+    :return m2: sum of squared differences from the mean of both groups
+
+    >>> merge_moments(*get_moments(np.array([1.0, 2.0])), *get_moments(np.array([3.0])))
+    (2.0, 2.0)
+    """
+    total = count_a + count_b
+    delta = mean_b - mean_a
+    return mean_a + delta * count_b / total, m2_a + m2_b + delta ** 2 * count_a * count_b / total
+
 
 class County:
     """
@@ -30,14 +97,23 @@ class County:
     :param public_awareness: Boolean indicating if people in the county has become aware of the saturation.
     :param toh_trigger: Boolean which activates once a county has become publicly aware at least once.
     Used for poisoning ToH.
+
+    Counties loaded by network_format.read_network do not hold their geometry and centroid. They are read from the
+    network's GeometryStore the first time they are accessed, so simulations never load them.
     """
 
+    GEOMETRY_DEFAULTS = {'geometry': None, 'centroid': False}
+
     def __init__(self, name: str, lat=None, lon=None, geometry=None, centroid=False, pop=None, popdense_sqmi=None,
                  saturation=0.0, slf_pop=1.0, mated=0.0, laid_eggs=0.0, egg_pop=0.0,
                  tree_density=0.0, toh_density=0.0, traffic_level=1.0, quarantine=False, public_awareness=False,
                  toh_trigger=False):
         self.name = name
-        self.lat, self.lon, self.geometry, self.centroid = lat, lon, geometry, centroid
+        self.lat, self.lon = lat, lon
+        if geometry is not None:
+            self.geometry = geometry
+        if centroid is not False:
+            self.centroid = centroid
         self.pop, self.popdense_sqmi = pop, popdense_sqmi
         self.saturation = saturation
         self.slf_pop = slf_pop
@@ -67,11 +143,8 @@ class County:
         >>> print(neighbors[0].name)
         Neighbor 0
         """
-        neighbors = []
-        for node in graph.nodes():
-            if hasattr(node, 'name') and node.name == self.name:
-                neighbors = [neighbor for neighbor in graph.neighbors(node)]
-        return neighbors
+        index = NeighborIndex.of(graph)
+        return index.neighbor_nodes(self.name) if self.name in index.ids else []
 
     def stabilize_levels(self):
         """
@@ -90,9 +163,11 @@ class County:
         self.egg_pop = max(0.0, min(self.egg_pop, 1.0))  # caps the value at 100%
         self.saturation = max(0.0, min(self.saturation, 1.0))  # caps the value at 100%
 
-    def mate(self, mating_chance=None):
+    def mate(self, mating_chance=None, rng=None):
         """
         Simulate the mating process, updating the proportion of mated flies in the saturation
+        :param mating_chance: chance of mating. If not provided, drawn from a normal distribution
+        :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
 
         >>> county = County('Butts County', slf_pop=0.7)
         >>> old_mate = county.mate()
@@ -100,18 +175,20 @@ class County:
         >>> new_mate > old_mate
         True
         """
+        rng = random if rng is None else rng
         if mating_chance is None:
-            mating_chance = random.normal(0.25, 0.10)
+            mating_chance = rng.normal(0.25, 0.10)
         newly_mated = self.slf_pop * mating_chance * (1.0 - self.mated)
         self.mated += newly_mated
         self.stabilize_levels()  # caps the value at 100%
         return self.mated
 
-    def lay_eggs(self, extra_eggmass_chance=None):
+    def lay_eggs(self, extra_eggmass_chance=None, rng=None):
         """
         Simulates the laying of eggs based on the porportion of mated SLFs.
 
         :param extra_eggmass_chance: Chance of laying an additional egg mass.
+        :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
         :return self.eggcount: Total number of egg masses after laying.
 
         >>> loc = County("Matt's County", saturation=0.37, slf_pop=.5, egg_pop=0.0, toh_density=1.0, tree_density=0.2, mated=.7)
@@ -120,26 +197,29 @@ class County:
         >>> current_eggs > old_eggs
         True
         """
-        extra_eggmass_chance = random.normal(0.12, 0.4) if extra_eggmass_chance is None else extra_eggmass_chance
-        prob = random.normal(0.50, 0.20)
+        rng = random if rng is None else rng
+        extra_eggmass_chance = rng.normal(0.12, 0.4) if extra_eggmass_chance is None else extra_eggmass_chance
+        prob = rng.normal(0.50, 0.20)
         new_egg_masses = prob * self.mated * (self.toh_density + self.tree_density)
         additional_egg_masses = new_egg_masses * extra_eggmass_chance
         self.egg_pop += new_egg_masses + additional_egg_masses
         self.stabilize_levels()
         return self.egg_pop
 
-    def die_off(self, mortality_rate=None):
+    def die_off(self, mortality_rate=None, rng=None):
         """
         Simulates the natural death of SLF during the winter.
         :param mortality_rate: percent of flies killed off. If not provided, somewhere between .75 and 1.0
+        :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
         :return self.saturation: current saturation level of Location
         >>> county = County("Justin's County", saturation=0.37)
         >>> current_infest = county.die_off(mortality_rate=1.0)
         >>> current_infest
         0.0
         """
+        rng = random if rng is None else rng
         if mortality_rate is None:
-            mortality_rate = random.uniform(0.85, 1.0)
+            mortality_rate = rng.uniform(0.85, 1.0)
         die_off_number = self.slf_pop * mortality_rate
         self.slf_pop -= die_off_number
         self.mated = 0.0
@@ -147,9 +227,11 @@ class County:
         self.stabilize_levels()
         return self.slf_pop
 
-    def hatch_eggs(self, hatch_chance=None):
+    def hatch_eggs(self, hatch_chance=None, rng=None):
         """
         Simulates the hatching of eggs and increases the saturation accordingly.
+        :param hatch_chance: share of the eggs that hatch. If not provided, somewhere between .75 and 1.0
+        :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
 
         :return: saturation level after hatching eggs.
 
@@ -160,18 +242,39 @@ class County:
         True
 
         """
+        rng = random if rng is None else rng
         if hatch_chance is None:
-            hatch_chance = random.uniform(.75, 1.0)
-        hatched_eggs = round(self.egg_pop * hatch_chance, 2)
-        while hatched_eggs > 0.0:
-            egg_coef = random.uniform(0.035, 0.045)
-            self.slf_pop += egg_coef
-            self.egg_pop -= .01
-            hatched_eggs -= .01
-            hatched_eggs = round(hatched_eggs, 2)
+            hatch_chance = rng.uniform(.75, 1.0)
+        new_slf, hatched = batch_hatch(np.array([self.egg_pop]), hatch_chance, rng=rng)
+        self.slf_pop += new_slf.item()
+        self.egg_pop -= hatched.item()
         self.stabilize_levels()
         return self.slf_pop
 
+    def __getattr__(self, atr: str):  # only called for attributes the county does not hold
+        if atr not in County.GEOMETRY_DEFAULTS:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{atr}'")
+        store = self.__dict__.get('geometry_store')
+        if store is None:
+            return County.GEOMETRY_DEFAULTS[atr]
+        return store.get_geometry(self.name) if atr == 'geometry' else store.get_centroid(self.name)
+
+    def clone(self):
+        """
+        returns a shallow copy of the county. Simulation attributes are independent of the original,
+        geometry and centroid are shared rather than copied.
+        :return: new County with the same attributes
+
+        >>> county = County('Cook', saturation=0.2)
+        >>> copy = county.clone()
+        >>> copy.saturation = 0.9
+        >>> county.saturation, copy == county
+        (0.2, True)
+        """
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        return clone
+
     def __hash__(self):
         return hash((self.name, type(self)))
 
@@ -179,25 +282,923 @@ class County:
         return self.name == other.name and type(self) == type(other)
 
 
-class MonthQueue(Queue):
+class CountyTable:
     """
-    A Queue which keeps track of which month it is. Each item in Queue is a dictionary correspond to the month and
-    attributes associated with it. Begins with traffic levels inserted
+    Struct-of-arrays form of a group of County objects. Every attribute is one typed NumPy column indexed by integer
+    county id, optionally with a leading replicate axis, so the batch methods update every county (and replicate)
+    with a handful of array operations. Columns are read and written like dict items: table['slf_pop'].
+
+    Geometry and centroid stay on the County objects, to_counties writes the columns back into them.
+
+    :param names: county names, in id order
+    :param columns: dict of attribute names and arrays whose last axis is the county id
     """
+    FLOAT_COLUMNS = ('saturation', 'slf_pop', 'mated', 'laid_eggs', 'egg_pop', 'tree_density', 'toh_density',
+                     'traffic_level', 'pop', 'popdense_sqmi', 'lat', 'lon')
+    BOOL_COLUMNS = ('quarantine', 'public_awareness', 'toh_trigger')
+    OPTIONAL_COLUMNS = ('pop', 'popdense_sqmi', 'lat', 'lon')  # None on a County is stored as nan
+
+    def __init__(self, names: list, columns: dict):
+        self.names = list(names)
+        self.ids = {name: county_id for county_id, name in enumerate(self.names)}
+        self.columns = dict(columns)
+
+    @classmethod
+    def from_counties(cls, counties, attributes=None, replicates=None):
+        """
+        copies county attributes into typed columns.
+        :param counties: County objects in id order, e.g. schema.values()
+        :param attributes: names of the attributes to be copied, defaults to every float and boolean attribute
+        :param replicates: adds a leading replicate axis of this length, every replicate starting from the counties
+        :return: CountyTable of the counties
+
+        >>> table = CountyTable.from_counties([County('Cook', saturation=0.2), County('Pope', quarantine=True)])
+        >>> table['saturation'].tolist(), table['quarantine'].tolist(), table['pop'].tolist()
+        ([0.2, 0.0], [False, True], [nan, nan])
+        >>> CountyTable.from_counties([County('Cook')], ('slf_pop',), replicates=3)['slf_pop'].shape
+        (3, 1)
+        """
+        counties = list(counties)
+        attributes = cls.FLOAT_COLUMNS + cls.BOOL_COLUMNS if attributes is None else attributes
+        lead = () if replicates is None else (replicates,)
+        columns = {}
+        for atr in attributes:
+            if atr in cls.BOOL_COLUMNS:
+                column = np.array([bool(getattr(county, atr)) for county in counties], dtype=bool)
+            else:
+                column = np.array([getattr(county, atr) for county in counties], dtype=float)
+            columns[atr] = np.broadcast_to(column, lead + column.shape).copy()
+        return cls([county.name for county in counties], columns)
+
+    def to_counties(self, counties=None, replicate=None) -> list:
+        """
+        writes the columns back into County objects.
+        :param counties: County objects in id order to update, defaults to new County objects
+        :param replicate: replicate to write out, needed when the table has a replicate axis
+        :return: list of the updated County objects
+
+        >>> table = CountyTable.from_counties([County('Cook'), County('Pope', lat=37.4)], replicates=2)
+        >>> table['saturation'][1] = [0.5, 0.25]
+        >>> pope = table.to_counties(replicate=1)[1]
+        >>> pope.name, pope.saturation, pope.lat, pope.pop
+        ('Pope', 0.25, 37.4, None)
+        """
+        counties = [County(name) for name in self.names] if counties is None else list(counties)
+        for atr, column in self.columns.items():
+            values = column if replicate is None else column[replicate]
+            values = values.tolist()
+            if atr in self.OPTIONAL_COLUMNS:
+                values = [None if value != value else value for value in values]  # nan back to None
+            for county, value in zip(counties, values):
+                setattr(county, atr, value)
+        return counties
+
+    def __getitem__(self, atr: str) -> np.ndarray:
+        return self.columns[atr]
+
+    def __setitem__(self, atr: str, column: np.ndarray):
+        self.columns[atr] = column
+
+    def __contains__(self, atr: str) -> bool:
+        return atr in self.columns
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def stabilize_levels(self):
+        """
+        batch County.stabilize_levels: keeps slf_pop, egg_pop and saturation between 0.0 and 1.0, in place.
+
+        >>> table = CountyTable.from_counties([County('Butts County', saturation=1.5, slf_pop=-0.7, egg_pop=0.5)])
+        >>> table.stabilize_levels()
+        >>> table['saturation'].tolist(), table['slf_pop'].tolist(), table['egg_pop'].tolist()
+        ([1.0], [0.0], [0.5])
+        """
+        for atr in ('slf_pop', 'egg_pop', 'saturation'):
+            np.clip(self.columns[atr], 0.0, 1.0, out=self.columns[atr])
+
+    def mate(self, mating_chance=None, rng=None) -> np.ndarray:
+        """
+        batch County.mate for every county.
+        :param mating_chance: array or scalar chance of mating, drawn per county if not provided
+        :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+        :return: the mated column
+
+        >>> table = CountyTable.from_counties([County('Butts County', slf_pop=0.7)] * 2)
+        >>> table.mate(mating_chance=np.array([0.5, 0.0])).tolist()
+        [0.35, 0.0]
+        """
+        rng = random if rng is None else rng
+        mated = self.columns['mated']
+        if mating_chance is None:
+            mating_chance = rng.normal(0.25, 0.10, size=mated.shape)
+        mated += self.columns['slf_pop'] * mating_chance * (1.0 - mated)
+        self.stabilize_levels()
+        return mated
+
+    def lay_eggs(self, extra_eggmass_chance=None, rng=None) -> np.ndarray:
+        """
+        batch County.lay_eggs for every county.
+        :param extra_eggmass_chance: array or scalar chance of laying an additional egg mass, drawn if not provided
+        :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+        :return: the egg_pop column
+
+        >>> table = CountyTable.from_counties([County('Cook', mated=0.5, toh_density=0.5, tree_density=0.5)])
+        >>> bool(table.lay_eggs(extra_eggmass_chance=0.0)[0] >= 0.0)
+        True
+        """
+        rng = random if rng is None else rng
+        egg_pop = self.columns['egg_pop']
+        if extra_eggmass_chance is None:
+            extra_eggmass_chance = rng.normal(0.12, 0.4, size=egg_pop.shape)
+        prob = rng.normal(0.50, 0.20, size=egg_pop.shape)
+        new_egg_masses = prob * self.columns['mated'] * (self.columns['toh_density'] + self.columns['tree_density'])
+        egg_pop += new_egg_masses + new_egg_masses * extra_eggmass_chance
+        self.stabilize_levels()
+        return egg_pop
+
+    def die_off(self, mortality_rate=None, rng=None) -> np.ndarray:
+        """
+        batch County.die_off for every county.
+        :param mortality_rate: array or scalar percent of flies killed off, between .85 and 1.0 if not provided
+        :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+        :return: the slf_pop column
+
+        >>> table = CountyTable.from_counties([County('Cook', slf_pop=0.4, mated=0.3)] * 2)
+        >>> table.die_off(mortality_rate=np.array([1.0, 0.5])).tolist(), table['mated'].tolist()
+        ([0.0, 0.2], [0.0, 0.0])
+        """
+        rng = random if rng is None else rng
+        slf_pop = self.columns['slf_pop']
+        if mortality_rate is None:
+            mortality_rate = rng.uniform(0.85, 1.0, size=slf_pop.shape)
+        slf_pop -= slf_pop * mortality_rate
+        self.columns['mated'][...] = 0.0
+        self.columns['laid_eggs'][...] = 0.0
+        self.stabilize_levels()
+        return slf_pop
+
+    def hatch_eggs(self, hatch_chance=None, rng=None) -> np.ndarray:
+        """
+        batch County.hatch_eggs for every county, see batch_hatch.
+        :param hatch_chance: array or scalar share of eggs that hatch, between .75 and 1.0 if not provided
+        :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+        :return: the slf_pop column
+
+        >>> table = CountyTable.from_counties([County('Cook', slf_pop=0.0, egg_pop=0.0),
+        ...                                    County('Pope', slf_pop=0.0, egg_pop=0.25)])
+        >>> slf_pop = table.hatch_eggs(hatch_chance=1.0)
+        >>> slf_pop[0], bool(0.25 * 3.5 <= slf_pop[1] <= 0.25 * 4.5), table['egg_pop'].round(8).tolist()
+        (0.0, True, [0.0, 0.0])
+        """
+        rng = random if rng is None else rng
+        egg_pop = self.columns['egg_pop']
+        if hatch_chance is None:
+            hatch_chance = rng.uniform(.75, 1.0, size=egg_pop.shape)
+        new_slf, hatched = batch_hatch(egg_pop, hatch_chance, rng=rng)
+        self.columns['slf_pop'] += new_slf
+        egg_pop -= hatched
+        self.stabilize_levels()
+        return self.columns['slf_pop']
+
+
+class NeighborIndex:
+    """
+    Adjacency index of a county network, built once per graph. Nodes get integer ids in graph order,
+    neighbors are stored CSR-style: the neighbors of node i are neighbors[offsets[i]:offsets[i + 1]], in the same
+    order graph.neighbors returns them. Names map to ids in O(1).
+
+    NeighborIndex.of caches the index by graph outside the graph itself, so pickles of the graph never carry it. The
+    index is rebuilt when the number of nodes or edges changes. Frozen graphs, like the ones NetworkTemplate shares,
+    cannot change and are not checked. Call NeighborIndex.of(graph, rebuild=True) after rewiring edges of an indexed
+    graph without changing their number.
+
+    :param graph: networkx graph whose nodes have a name attribute
+    """
+
+    _cache = weakref.WeakKeyDictionary()  # graph: ((number of nodes, number of edges) or None if frozen, index)
+
+    def __init__(self, graph: nx.Graph):
+        self.nodes = list(graph.nodes())
+        self.names = [node.name for node in self.nodes]
+        self.ids = {name: node_id for node_id, name in enumerate(self.names)}
+        node_ids = {node: node_id for node_id, node in enumerate(self.nodes)}
+        offsets, neighbors = [0], []
+        for node in self.nodes:
+            neighbors.extend(node_ids[neighbor] for neighbor in graph.neighbors(node))
+            offsets.append(len(neighbors))
+        self.offsets = np.array(offsets, dtype=np.intp)
+        self.neighbors = np.array(neighbors, dtype=np.intp)
+        self._neighbor_lists = [neighbors[offsets[i]:offsets[i + 1]] for i in range(len(self.nodes))]
+
+    @classmethod
+    def of(cls, graph: nx.Graph, rebuild=False):
+        """
+        returns the cached index of the graph, building it the first time and again after its nodes or edges change.
+        :param graph: networkx graph whose nodes have a name attribute
+        :param rebuild: forces the index to be built again
+        :return: NeighborIndex of the graph
+
+        >>> a, b, c = County('A'), County('B'), County('C')
+        >>> CG = nx.Graph()
+        >>> CG.add_edge(a, b)
+        >>> NeighborIndex.of(CG) is NeighborIndex.of(CG), CG.graph
+        (True, {})
+        >>> CG.add_edge(b, c)
+        >>> NeighborIndex.of(CG).neighbor_names('B')
+        ['A', 'C']
+        >>> CG.add_edge(a, c)
+        >>> NeighborIndex.of(CG).neighbor_names('A')
+        ['B', 'C']
+        """
+        size = None if nx.is_frozen(graph) else (graph.number_of_nodes(), graph.number_of_edges())
+        cached = cls._cache.get(graph)
+        if rebuild or cached is None or cached[0] != size:
+            cached = size, cls(graph)
+            cls._cache[graph] = cached
+        return cached[1]
+
+    def get_id(self, name: str) -> int:
+        """
+        returns the integer id of a node.
+        :param name: name of the node
+        :return: integer id of the node
+        """
+        return self.ids[name]
+
+    def neighbor_ids(self, node_id: int) -> np.ndarray:
+        """
+        returns the ids of the neighbors of a node.
+        :param node_id: integer id of the node
+        :return: array of neighbor ids
+        """
+        return self.neighbors[self.offsets[node_id]:self.offsets[node_id + 1]]
+
+    def neighbor_names(self, name: str) -> list:
+        """
+        returns the names of the neighbors of a node.
+        :param name: name of the node
+        :return: list of neighbor names
+
+        >>> CG = nx.Graph()
+        >>> CG.add_edges_from([(County('Cook'), County('Lake')), (County('Cook'), County('Will'))])
+        >>> index = NeighborIndex(CG)
+        >>> index.neighbor_names('Cook'), index.neighbor_ids(index.get_id('Lake')).tolist()
+        (['Lake', 'Will'], [0])
+        """
+        return [self.names[neighbor] for neighbor in self._neighbor_lists[self.ids[name]]]
+
+    def neighbor_nodes(self, name: str) -> list:
+        """
+        returns the node objects of the neighbors of a node.
+        :param name: name of the node
+        :return: list of neighbor nodes
+        """
+        return [self.nodes[neighbor] for neighbor in self._neighbor_lists[self.ids[name]]]
+
+
+class EdgeWeights:
+    """
+    Per-run edge weight overlay of a county network. The graph keeps the topology and the base weights and is never
+    written during a run, quarantine changes the overlay instead and calculate_spread_prob reads it, so one graph can be
+    shared by any number of runs. Both directions of an undirected edge share one weight, as they do in the graph.
+
+    The base weights are read-only and shared by every overlay of a graph. An overlay only copies them on its first
+    write, so copy is at most O(E) and reset is O(1). EdgeWeights.of caches the base weights by graph outside the
+    graph itself, so pickles of the graph never carry them.
+
+    :param graph: networkx graph whose nodes have a name attribute and whose edges have a weight
+    """
+
+    _cache = weakref.WeakKeyDictionary()  # graph: EdgeWeights holding its base weights
+
+    def __init__(self, graph: nx.Graph):
+        self.edge_ids = {}
+        base, interstate = [], []
+        for county_1, county_2, data in graph.edges(data=True):
+            self.edge_ids[county_1.name, county_2.name] = self.edge_ids[county_2.name, county_1.name] = len(base)
+            base.append(data['weight'])
+            interstate.append(data.get('rel') == 'interstate')
+        self.base = np.array(base, dtype=float)
+        self.base.flags.writeable = False
+        self.interstate = np.array(interstate, dtype=bool)
+        self.weights = self.base
+
+    @classmethod
+    def of(cls, graph: nx.Graph, rebuild=False):
+        """
+        returns a fresh overlay of the graph. The cached base weights are checked against the weights of the graph
+        and read again when any of them changed. Call EdgeWeights.of(graph, rebuild=True) after rewiring edges of the
+        graph without changing their number or weights.
+        :param graph: networkx graph whose nodes have a name attribute and whose edges have a weight
+        :param rebuild: forces the base weights to be read again
+        :return: EdgeWeights holding the base weights
+
+        >>> a, b = County('A'), County('B')
+        >>> CG = nx.Graph()
+        >>> CG.add_edge(a, b, weight=1.0)
+        >>> first, second = EdgeWeights.of(CG), EdgeWeights.of(CG)
+        >>> first[a, b] = 0.5
+        >>> first[b, a], second[a, b], CG[a][b]['weight'], CG.graph
+        (0.5, 1.0, 1.0, {})
+        >>> CG[a][b]['weight'] = 2.0
+        >>> EdgeWeights.of(CG)[a, b]
+        2.0
+        """
+        weights = np.fromiter((weight for *_, weight in graph.edges(data='weight')), dtype=float,
+                              count=graph.number_of_edges())
+        base = cls._cache.get(graph)
+        if rebuild or base is None or not np.array_equal(base.base, weights):
+            base = cls(graph)
+            cls._cache[graph] = base
+        return base.copy()
+
+    def __getitem__(self, edge) -> float:
+        county, neighbor = edge
+        return float(self.weights[self.edge_ids[county.name, neighbor.name]])
+
+    def __setitem__(self, edge, weight: float):
+        county, neighbor = edge
+        if self.weights is self.base:  # copy on the first write, the base is shared
+            self.weights = self.base.copy()
+        self.weights[self.edge_ids[county.name, neighbor.name]] = weight
+
+    def __len__(self):
+        return len(self.base)
+
+    def is_interstate(self, county, neighbor) -> bool:
+        """
+        checks if the edge between two counties is an interstate.
+        :param county: node on one end of the edge
+        :param neighbor: node on the other end of the edge
+        :return: True for interstate edges
+        """
+        return bool(self.interstate[self.edge_ids[county.name, neighbor.name]])
+
+    def copy(self):
+        """
+        returns an overlay with the same current weights that can be changed independently, in O(E) at most.
+        :return: EdgeWeights sharing the edge numbering and base weights
+
+        >>> CG = nx.Graph()
+        >>> CG.add_edge(County('A'), County('B'), weight=1.0)
+        >>> weights = EdgeWeights(CG)
+        >>> weights[County('A'), County('B')] = 0.5
+        >>> other = weights.copy()
+        >>> other[County('A'), County('B')] = 0.25
+        >>> weights[County('A'), County('B')], other[County('A'), County('B')]
+        (0.5, 0.25)
+        """
+        overlay = EdgeWeights.__new__(EdgeWeights)
+        overlay.__dict__.update(self.__dict__)
+        if self.weights is not self.base:
+            overlay.weights = self.weights.copy()
+        return overlay
+
+    def reset(self):
+        """
+        drops every change, in O(1).
+
+        >>> CG = nx.Graph()
+        >>> CG.add_edge(County('A'), County('B'), weight=1.0)
+        >>> weights = EdgeWeights(CG)
+        >>> weights[County('A'), County('B')] = 0.5
+        >>> weights.reset()
+        >>> weights[County('A'), County('B')]
+        1.0
+        """
+        self.weights = self.base
+
+
+class GeometryStore:
+    """
+    County geometries of a network, kept out of the County objects. The geometry side file written by network_format
+    holds every geometry as WKB bytes, keyed by county id, and the centroids as a (county, 2) float array.
+    Nothing is read until it is first needed: the centroids array is loaded on its own, shapely is only imported and
+    the WKB only parsed when a geometry or a centroid point is asked for.
+
+    :param names: county names, in id order
+    :param path: path of the geometry side file
+    """
+
+    def __init__(self, names: list, path: str):
+        self.names = list(names)
+        self.ids = {name: county_id for county_id, name in enumerate(self.names)}
+        self.path = path
+        self._centroids = None
+        self._geometries = None
+        self._centroid_points = None
+
+    @property
+    def centroids(self) -> np.ndarray:
+        """
+        centroid x and y of every county, in id order, without loading any geometry.
+        """
+        if self._centroids is None:
+            with np.load(self.path) as geometry_file:
+                self._centroids = geometry_file['centroids']
+        return self._centroids
+
+    def attach(self, counties):
+        """
+        makes the counties read their geometry and centroid from the store.
+        :param counties: County objects of the store's network
+
+        >>> cook = County('Cook')
+        >>> store = GeometryStore(['Cook'], 'data/location/IL_geometry.npz')
+        >>> store.attach([cook])
+        >>> store.centroids.shape, cook.geometry.geom_type, cook.clone().centroid is cook.centroid
+        ((102, 2), 'Polygon', True)
+        """
+        for county in counties:
+            county.geometry_store = self
+
+    def get_geometry(self, name: str):
+        """
+        returns the geometry of a county, parsing every geometry of the store on the first call.
+        :param name: name of the county
+        :return: shapely geometry
+        """
+        if self._geometries is None:
+            import shapely  # the simulation never needs geometries, so shapely is only imported here
+
+            with np.load(self.path) as geometry_file:
+                wkb, offsets = geometry_file['wkb'].tobytes(), geometry_file['offsets'].tolist()
+            self._geometries = shapely.from_wkb([wkb[start:end] for start, end in zip(offsets[:-1], offsets[1:])])
+        return self._geometries[self.ids[name]]
+
+    def get_centroid(self, name: str):
+        """
+        returns the centroid of a county as a shapely Point, made from the precomputed centroids.
+        :param name: name of the county
+        :return: shapely Point
+        """
+        if self._centroid_points is None:
+            import shapely
+
+            self._centroid_points = shapely.points(self.centroids)
+        return self._centroid_points[self.ids[name]]
+
+
+class NetworkTemplate:
+    """
+    Frozen copy of a loaded network that hands out independent simulation states. The template is never simulated
+    on, every call to new_state clones the counties. The graph only holds the topology and the base edge weights, it
+    is frozen and shared by every state, runs change edge weights in their own EdgeWeights overlay.
+    Node objects and county geometries are shared between the template and its states.
+
+    :param CG: graph of the county network, frozen by the template
+    :param schema: a dict of county names and their objects, with coefficients already set
+    :param neighbor_schema: a dict of county names and the objects of their adjacent counties
+    """
+
+    def __init__(self, CG: nx.Graph, schema: dict, neighbor_schema: dict):
+        self.graph = nx.freeze(CG)
+        self.schema = schema
+        self.neighbor_names = {county: [neighbor.name for neighbor in neighbor_schema[county]]
+                               for county in neighbor_schema}
+
+    def new_state(self) -> (nx.Graph, dict, dict):
+        """
+        builds a fresh schema and neighbor_schema from the template.
+        :return CG: the shared, frozen graph
+        :return schema: a dict of county names and cloned county objects
+        :return neighbor_schema: a dict of county names and the cloned objects of their adjacent counties
+
+        >>> CG = nx.Graph()
+        >>> CG.add_edge(County('A'), County('B'), weight=1.0)
+        >>> template = NetworkTemplate(CG, {'A': County('A'), 'B': County('B')}, {'A': [County('B')]})
+        >>> first_CG, first_schema, first_neighbors = template.new_state()
+        >>> first_schema['A'].saturation = 1.0
+        >>> second_CG, second_schema, second_neighbors = template.new_state()
+        >>> second_CG is first_CG, nx.is_frozen(first_CG), second_schema['A'].saturation
+        (True, True, 0.0)
+        >>> first_neighbors['A'][0] is first_schema['B']
+        True
+        """
+        schema = {county: self.schema[county].clone() for county in self.schema}
+        neighbor_schema = {county: [schema[name] for name in self.neighbor_names[county]]
+                           for county in self.neighbor_names}
+        return self.graph, schema, neighbor_schema
+
+
+class BlockSampler:
+    """
+    Drop-in replacement for a numpy Generator in the model functions that draws its random numbers in blocks.
+    Standard normals, standard exponentials and uniforms are each drawn block_size at a time with one array call,
+    then handed out one by one and scaled to the parameters of each call, so a timestep of the Illinois network
+    needs a few large draws instead of thousands of scalar ones. Runs are replayable for a given seed and block_size.
+
+    :param rng: numpy Generator the blocks are drawn from, defaults to the global numpy.random state
+    :param block_size: number of values drawn per block of each kind
+    """
+
+    def __init__(self, rng=None, block_size=4096):
+        self.rng = random if rng is None else rng
+        self.block_size = block_size
+        self.blocks = {'normal': [], 'exponential': [], 'random': []}
+        self.positions = {'normal': 0, 'exponential': 0, 'random': 0}
+
+    def refill(self, kind: str, count: int) -> list:
+        """
+        draws a new block of one kind, keeping the values of the old block that have not been used yet.
+        :param kind: 'normal', 'exponential' or 'random'
+        :param count: number of values that are needed right away
+        :return: the new block
+        """
+        remaining = self.blocks[kind][self.positions[kind]:]
+        size = max(self.block_size, count - len(remaining))
+        if kind == 'normal':
+            values = self.rng.standard_normal(size)
+        elif kind == 'exponential':
+            values = self.rng.standard_exponential(size)
+        else:
+            values = self.rng.random(size)
+        self.blocks[kind] = remaining + values.tolist()
+        self.positions[kind] = 0
+        return self.blocks[kind]
+
+    def take(self, kind: str, size=None):
+        """
+        hands out the next values of a block.
+        :param kind: 'normal', 'exponential' or 'random'
+        :param size: shape of the array to return, a single float if not provided
+        :return: float or array of standard values
+
+        >>> sampler = BlockSampler(np.random.default_rng(3), block_size=4)
+        >>> first = sampler.take('random', size=3)
+        >>> second = sampler.take('random', size=(2, 2))
+        >>> bool((np.concatenate([first, second.ravel()]) == np.random.default_rng(3).random(7)).all())
+        True
+        """
+        block, position = self.blocks[kind], self.positions[kind]
+        count = 1 if size is None else int(np.prod(size))
+        if position + count > len(block):
+            block, position = self.refill(kind, count), 0
+        self.positions[kind] = position + count
+        if size is None:
+            return block[position]
+        return np.array(block[position:position + count]).reshape(size)
+
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        """
+        :return: normal values, as Generator.normal
+
+        >>> sampler = BlockSampler(np.random.default_rng(3))
+        >>> sampler.normal(0.45, 0.8) == np.random.default_rng(3).normal(0.45, 0.8)
+        True
+        """
+        return loc + scale * self.take('normal', size)
+
+    def exponential(self, scale=1.0, size=None):
+        """
+        :return: exponential values, as Generator.exponential
+        """
+        return scale * self.take('exponential', size)
+
+    def uniform(self, low=0.0, high=1.0, size=None):
+        """
+        :return: uniform values between low and high, as Generator.uniform
+        """
+        return low + (high - low) * self.take('random', size)
+
+    def random(self, size=None):
+        """
+        :return: uniform values between 0.0 and 1.0, as Generator.random
+        """
+        return self.take('random', size)
+
+    def choice(self, options: list):
+        """
+        :param options: list to pick from
+        :return: one item of options, each equally likely
+
+        >>> BlockSampler(np.random.default_rng(3)).choice([True, False]) in (True, False)
+        True
+        """
+        return options[int(self.take('random') * len(options))]
+
+
+class SaturationRecord:
+    """
+    Saturation history of a run, kept in a preallocated (county, timestep) array. Each timestep fills one column
+    in place, the cumulative_df layout ('County', then 'year N' or 'month N' columns) is only built when
+    to_dataframe is called.
+
+    :param names: county names, in the order their saturations are recorded
+    :param steps: number of timesteps to allocate, including the starting one
+    :param time_frame: changes if the df column names are years or months
+    :param values: an existing (county, timestep) array to wrap instead of allocating one
+    """
+
+    def __init__(self, names: list, steps: int, time_frame=None, values=None):
+        self.names = list(names)
+        self.time_frame = 'year' if time_frame is None else time_frame
+        if values is None:
+            self.values = np.full((len(self.names), steps), np.nan)
+            self.filled = 0
+        else:
+            self.values = values
+            self.filled = values.shape[1]
+
+    @classmethod
+    def from_schema(cls, schema: dict, steps: int, time_frame=None):
+        """
+        allocates a record for every county in the schema and records their current saturation as timestep 1.
+        :param schema: a dict of county names and their objects
+        :param steps: number of timesteps to allocate, including the starting one
+        :param time_frame: changes if the df column names are years or months
+        :return: SaturationRecord with the first column filled
+
+        >>> record = SaturationRecord.from_schema({'Cook': County('Cook', saturation=0.2)}, 3, time_frame='month')
+        >>> record.record(2, [0.4])
+        >>> record.to_dataframe()
+          County  month 1  month 2
+        0   Cook      0.2      0.4
+        """
+        record = cls([schema[county].name for county in schema], steps, time_frame=time_frame)
+        record.record(1, [schema[county].saturation for county in schema])
+        return record
+
+    def record(self, time_tracker: int, saturations):
+        """
+        stores the saturation of every county at one timestep.
+        :param time_tracker: count of the current year or month, starting at 1
+        :param saturations: saturations in the same order as names
+        """
+        self.values[:, time_tracker - 1] = saturations
+        self.filled = max(self.filled, time_tracker)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        builds the cumulative_df of the timesteps recorded so far.
+        :return: dataframe with a 'County' column followed by one column per timestep
+        """
+        columns = [f'{self.time_frame} {step + 1}' for step in range(self.filled)]
+        cumulative_df = pd.DataFrame(self.values[:, :self.filled], columns=columns)
+        cumulative_df.insert(0, 'County', self.names)
+        return cumulative_df
+
+
+class SteadyState:
+    """
+    Watches a run for the point where its saturations stop changing, so the remaining timesteps can be filled in
+    instead of simulated. A run is absorbed once its saturations and every population it is given are all zero:
+    nothing is left to spread, mate or hatch, so every later timestep is zero too. With patience set, a run whose
+    saturations and populations have not changed for that many steps in a row is treated as settled as well. The
+    populations count because saturation can hold still while they change, as it does over winter in the life cycle
+    model while the eggs wait to hatch.
+
+    :param patience: number of unchanged steps after which the run is settled, defaults to only stopping once absorbed
+    """
+
+    def __init__(self, patience=None):
+        if patience is not None and not (type(patience) == int and patience > 0):
+            raise ValueError('Please use an integer greater than zero.')
+        self.patience = patience
+        self.unchanged = 0
+        self.previous = None
+
+    def update(self, saturations, *populations) -> bool:
+        """
+        takes the saturations of the latest timestep and reports whether the run has settled.
+        :param saturations: saturation of every county (and replicate)
+        :param populations: other arrays that must also be zero for the run to be absorbed, such as slf_pop, and
+        unchanged for a step to count toward patience
+        :return: True once the remaining timesteps would repeat the latest saturations
+
+        >>> steady = SteadyState()
+        >>> steady.update(np.array([0.0, 0.0]), np.array([0.0, 0.1]))
+        False
+        >>> steady.update(np.array([0.0, 0.0]), np.array([0.0, 0.0]))
+        True
+        >>> steady = SteadyState(patience=2)
+        >>> [steady.update(np.array([1.0, 0.5])) for _ in range(4)]
+        [False, False, True, True]
+        >>> steady = SteadyState(patience=2)  # flat saturation over a winter while the eggs change
+        >>> [steady.update(np.array([0.5]), np.array([0.0]), np.array([eggs])) for eggs in (.3, .2, .1, .1, .1)]
+        [False, False, False, False, True]
+        >>> SteadyState(patience=0)
+        Traceback (most recent call last):
+        ...
+        ValueError: Please use an integer greater than zero.
+        """
+        if self.patience is not None:
+            current = np.array((saturations,) + populations, dtype=float)  # a copy, the engines update in place
+            self.unchanged = self.unchanged + 1 if np.array_equal(current, self.previous) else 0
+            self.previous = current
+            if self.unchanged >= self.patience:
+                return True
+        return not any(np.any(values) for values in (saturations,) + populations)
+
+    @staticmethod
+    def fill(saturation_record, time_tracker: int, steps: int, saturations):
+        """
+        records the latest saturations for every timestep after time_tracker, up to and including steps.
+        :param saturation_record: SaturationRecord or open SaturationSink of the run
+        :param time_tracker: last timestep that was simulated
+        :param steps: number of timesteps the run was meant to have, including the starting one
+        :param saturations: saturations to repeat
+
+        >>> record = SaturationRecord(['Cook'], 4)
+        >>> record.record(1, [0.0])
+        >>> SteadyState.fill(record, 1, 4, [0.0])
+        >>> record.to_dataframe().shape
+        (1, 5)
+        """
+        if isinstance(saturation_record, SaturationRecord):
+            saturation_record.values[..., time_tracker:steps] = np.asarray(saturations)[..., np.newaxis]
+            saturation_record.filled = max(saturation_record.filled, steps)
+        else:
+            for step in range(time_tracker + 1, steps + 1):
+                saturation_record.record(step, saturations)
+
+
+class EnsembleAggregator:
+    """
+    Online summary of an ensemble, folded one batch of replicates at a time so memory depends on counties x timesteps
+    and never on the number of replicates. Mean and variance use Welford's update, merged between batches with Chan's
+    formula. Quantiles come from a fixed-bin histogram sketch per county and timestep: saturations are always between
+    0.0 and 1.0, so with the default 100 bins every quantile is within 0.01 of the empirical (inverted cdf) one.
+    Aggregators of the same network and length from different workers are combined with merge.
+
+    Everything is kept per county and timestep and statewide, where the statewide value of a replicate is its mean
+    saturation over the counties, the line model_variables_avg plots for every run.
+
+    :param names: county names, in the order of the county axis of the results
+    :param steps: number of timesteps, including the starting one
+    :param bins: number of histogram bins of the quantile sketches
+    :param county_quantiles: also keeps sketches per county. They take 8 x counties x steps x bins bytes, about 98 MB
+    for 100 years of months of the 102 counties with the default bins, so only the statewide ones are kept by default.
+    """
+
+    def __init__(self, names: list, steps: int, bins=100, county_quantiles=False):
+        self.names = list(names)
+        self.steps = steps
+        self.bins = bins
+        self.count = 0
+        self.mean = np.zeros((len(self.names), steps))
+        self.m2 = np.zeros((len(self.names), steps))
+        self.statewide_mean = np.zeros(steps)
+        self.statewide_m2 = np.zeros(steps)
+        self.histogram = np.zeros((len(self.names), steps, bins), dtype=np.int64) if county_quantiles else None
+        self.statewide_histogram = np.zeros((steps, bins), dtype=np.int64)
+
+    def add(self, results: np.ndarray):
+        """
+        folds a batch of replicates into the summary.
+        :param results: saturations shaped (replicate, county, time), or (county, time) for a single run
+
+        >>> aggregator = EnsembleAggregator(['Cook', 'Pope'], 2)
+        >>> aggregator.add(np.array([[[0.0, 0.2], [0.0, 0.4]], [[0.0, 0.4], [0.0, 0.8]]]))
+        >>> aggregator.add(np.array([[0.0, 0.6], [0.0, 0.0]]))
+        >>> aggregator.count, aggregator.mean[:, 1].round(8).tolist(), aggregator.variance()[:, 1].round(8).tolist()
+        (3, [0.4, 0.4], [0.04, 0.16])
+        >>> aggregator.statewide_mean.round(8).tolist()
+        [0.0, 0.4]
+        """
+        results = np.asarray(results, dtype=float)
+        results = results[np.newaxis] if results.ndim == 2 else results
+        statewide = results.mean(axis=1)
+        self.mean, self.m2 = merge_moments(self.count, self.mean, self.m2, *get_moments(results))
+        self.statewide_mean, self.statewide_m2 = merge_moments(self.count, self.statewide_mean, self.statewide_m2,
+                                                               *get_moments(statewide))
+        if self.histogram is not None:
+            self.histogram += self.count_bins(results)
+        self.statewide_histogram += self.count_bins(statewide)
+        self.count += len(results)
+
+    def count_bins(self, values: np.ndarray) -> np.ndarray:
+        """
+        counts the values of every cell into the histogram bins.
+        :param values: array shaped (replicate, ...) with the shape of one histogram cell after the replicate axis
+        :return: counts shaped (..., bins)
+        """
+        cells = int(np.prod(values.shape[1:]))
+        bins = np.clip((values * self.bins).astype(np.intp), 0, self.bins - 1).reshape(len(values), cells)
+        flat = (np.arange(cells) * self.bins + bins).ravel()
+        return np.bincount(flat, minlength=cells * self.bins).reshape(values.shape[1:] + (self.bins,))
+
+    def merge(self, other):
+        """
+        folds the summary of another aggregator, for example one from another worker, into this one.
+        :param other: EnsembleAggregator of the same counties and timesteps
+        :return: this aggregator
+
+        >>> results = np.random.default_rng(1).random((6, 3, 4))
+        >>> first, second, whole = (EnsembleAggregator('ABC', 4, county_quantiles=True) for _ in range(3))
+        >>> first.add(results[:2]), second.add(results[2:]), whole.add(results)
+        (None, None, None)
+        >>> merged = first.merge(second)
+        >>> bool(np.allclose(merged.variance(), whole.variance())), bool((merged.histogram == whole.histogram).all())
+        (True, True)
+        """
+        if other.names != self.names or other.steps != self.steps or other.bins != self.bins:
+            raise ValueError('These aggregators do not summarize the same network.')
+        if other.count:
+            self.mean, self.m2 = merge_moments(self.count, self.mean, self.m2, other.count, other.mean, other.m2)
+            self.statewide_mean, self.statewide_m2 = merge_moments(self.count, self.statewide_mean, self.statewide_m2,
+                                                                   other.count, other.statewide_mean,
+                                                                   other.statewide_m2)
+            if self.histogram is not None and other.histogram is not None:
+                self.histogram += other.histogram
+            else:
+                self.histogram = None
+            self.statewide_histogram += other.statewide_histogram
+            self.count += other.count
+        return self
+
+    def variance(self, statewide=False) -> np.ndarray:
+        """
+        returns the sample variance of every county and timestep, or of the statewide mean of every timestep.
+        :param statewide: True for the statewide variance
+        :return: array shaped (county, time), or (time,) when statewide
+        """
+        m2 = self.statewide_m2 if statewide else self.m2
+        return m2 / (self.count - 1) if self.count > 1 else np.full(m2.shape, np.nan)
+
+    def confidence_interval(self, z=1.96, statewide=True) -> (np.ndarray, np.ndarray):
+        """
+        returns the normal confidence interval of the mean at every timestep.
+        :param z: standard score of the confidence level, 1.96 for 95%
+        :param statewide: True for the statewide mean, False for every county
+        :return low: lower bound of the interval
+        :return high: upper bound of the interval
+        """
+        mean = self.statewide_mean if statewide else self.mean
+        half_width = z * np.sqrt(self.variance(statewide=statewide) / self.count)
+        return mean - half_width, mean + half_width
+
+    def quantiles(self, q, statewide=True) -> np.ndarray:
+        """
+        estimates quantiles from the histogram sketches, interpolating inside the bin a quantile falls in.
+        :param q: quantile or list of quantiles between 0.0 and 1.0
+        :param statewide: True for the statewide mean, False for every county
+        :return: array shaped (quantile, time), or (quantile, county, time) for counties. The quantile axis is left
+        out for a single quantile.
+
+        >>> aggregator = EnsembleAggregator(['Cook'], 1)
+        >>> aggregator.add(np.linspace(0, 1, 1001).reshape(1001, 1, 1))
+        >>> aggregator.quantiles([0.1, 0.5]).round(2).tolist()
+        [[0.1], [0.5]]
+        """
+        histogram = self.statewide_histogram if statewide else self.histogram
+        if histogram is None:
+            raise ValueError('This aggregator does not keep county quantiles.')
+        cumulative = histogram.cumsum(axis=-1)
+        estimates = []
+        for quantile in np.atleast_1d(q):
+            target = quantile * self.count
+            index = np.minimum((cumulative < target).sum(axis=-1), self.bins - 1)
+            before = np.where(index > 0, np.take_along_axis(cumulative, np.maximum(index - 1, 0)[..., None],
+                                                            axis=-1)[..., 0], 0)
+            in_bin = np.take_along_axis(histogram, index[..., None], axis=-1)[..., 0]
+            estimates.append((index + np.clip((target - before) / np.maximum(in_bin, 1), 0, 1)) / self.bins)
+        return np.array(estimates) if np.ndim(q) else estimates[0]
+
+    def to_dataframe(self, q=(0.05, 0.5, 0.95), z=1.96) -> pd.DataFrame:
+        """
+        builds the statewide trend and uncertainty bands of every timestep.
+        :param q: quantiles to include, as columns named 'q5', 'q50', ...
+        :param z: standard score of the confidence interval of the mean
+        :return: dataframe with mean, std, ci_low, ci_high and one column per quantile, indexed by timestep
+        """
+        low, high = self.confidence_interval(z=z)
+        summary_df = pd.DataFrame({'mean': self.statewide_mean, 'std': np.sqrt(self.variance(statewide=True)),
+                                   'ci_low': low, 'ci_high': high})
+        for quantile, values in zip(q, self.quantiles(list(q))):
+            summary_df[f'q{round(quantile * 100):g}'] = values
+        return summary_df
+
+
+class MonthQueue:
+    """
+    A calendar which keeps track of which month it is. Each month is a dictionary of the month name and the attributes
+    associated with it, begins with traffic levels inserted. The months are kept in a plain list with the position of
+    the next month, and the numeric values of every attribute are also a column of the 12 x K levels array, so
+    months and attributes are looked up by index instead of by rotating.
+    """
+    MONTHS = ('January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+              'November', 'December')
 
     def __init__(self):
-        super().__init__()
         self.months_traffic_levels = {
             'January': 0.9, 'February': 0.9, 'March': 0.92, 'April': 0.94,
             'May': 0.96, 'June': 0.98, 'July': 1.0, 'August': 0.98,
             'September': 0.96, 'October': 0.94, 'November': 0.92, 'December': 0.90
         }
-        for month, traffic_level in self.months_traffic_levels.items():
-            self.put({'month': month, 'traffic_level': traffic_level})
+        self.month_ids = {month: month_id for month_id, month in enumerate(self.MONTHS)}
+        self.months = [{'month': month} for month in self.MONTHS]
+        self.attributes = {}
+        self.levels = np.empty((12, 0))
+        self.position = 0
+        self.add_atr_dict_to_queue('traffic_level', self.months_traffic_levels)
 
     def add_atr_dict_to_queue(self, atr_name, atr_dict):
         """
-        Adds a dictionary of a new attribute to the MonthQueue
+        Adds a dictionary of a new attribute to the MonthQueue, or updates the months in atr_dict of an attribute
+        that is already there. Any value can be stored, but only real numbers go into the levels array that
+        get_atr_schedule reads, other values are nan there.
         :param atr_name: the name of the attribute you want to insert
         :param atr_dict: a dictionary of values to be added to each month
 
@@ -210,12 +1211,27 @@ class MonthQueue(Queue):
         >>> queue = queue.add_atr_dict_to_queue('temp', temp)
         >>> queue.get_atr_level('January', 'temp')
         0.1
+        >>> queue.levels.shape
+        (12, 2)
+        >>> queue = queue.add_atr_dict_to_queue('temp', {'January': 0.3, 'February': 'frozen'})
+        >>> queue.position = 0
+        >>> queue.get_atr_schedule('temp', 3).tolist(), queue.get_atr_level('February', 'temp')
+        ([0.3, nan, 0.2], 'frozen')
         """
-        for _ in range(12):
-            month_data = self.rotate()
-            month = month_data['month']
+        if atr_name in self.attributes:
+            column = self.levels[:, self.attributes[atr_name]].copy()
+        else:
+            column = np.full(12, np.nan)
+        for month, month_data in zip(self.MONTHS, self.months):
             if month in atr_dict:
-                month_data[atr_name] = atr_dict[month]
+                value = atr_dict[month]
+                month_data[atr_name] = value
+                column[self.month_ids[month]] = value if isinstance(value, numbers.Real) else np.nan
+        if atr_name in self.attributes:
+            self.levels[:, self.attributes[atr_name]] = column
+        else:
+            self.attributes[atr_name] = self.levels.shape[1]
+            self.levels = np.column_stack([self.levels, column])
         return self
 
     def reset_year(self):
@@ -230,28 +1246,25 @@ class MonthQueue(Queue):
         >>> queue.rotate()
         {'month': 'January', 'traffic_level': 0.9}
         """
-        while True:
-            current_month = self.rotate()
-            if current_month['month'] == 'December':
-                break
+        self.position = 0
 
     def rotate(self):
         """
-        method which pops the first element of queue off and puts it at the back.
-        :return old_month: the month that was popped off
+        method which returns the month at the front of the calendar and moves on to the next one.
+        :return old_month: the month that was at the front
         >>> my_queue = MonthQueue()
         >>> my_queue.rotate()
         {'month': 'January', 'traffic_level': 0.9}
         >>> my_queue.rotate()
         {'month': 'February', 'traffic_level': 0.9}
         """
-        old_month = self.get()
-        self.put(old_month)
+        old_month = self.months[self.position]
+        self.position = (self.position + 1) % 12
         return old_month
 
     def get_atr_level(self, month_name, atr):
         """
-        find the value of attribute for month
+        find the value of attribute for month, without moving the calendar
         :param month_name: month to be accessed
         :param atr: The attribute whose level to be agtained
         :return: the traffic level for this month
@@ -259,11 +1272,27 @@ class MonthQueue(Queue):
         >>> my_queue = MonthQueue()
         >>> my_queue.get_atr_level('July', 'traffic_level')
         1.0
+        >>> my_queue.get_atr_level('Smarch', 'traffic_level')
+        Traceback (most recent call last):
+        ...
+        ValueError: This is not a valid month.
         """
+        if month_name not in self.month_ids:
+            raise ValueError('This is not a valid month.')
+        return self.months[self.month_ids[month_name]].get(atr, None)
 
-        correct_month = False
-        while not correct_month:
-            month = self.rotate()
-            correct_month = True if month['month'] == month_name else False
-            if correct_month:
-                return month.get(atr, None)
+    def get_atr_schedule(self, atr, iterations):
+        """
+        returns the values of an attribute for the months the next rotations will return, as an array, so engines
+        can look them up by timestep or broadcast them over counties.
+        :param atr: The attribute whose levels to be obtained
+        :param iterations: number of upcoming months
+        :return: array of the attribute's level for each upcoming month, nan where a month has no value
+
+        >>> my_queue = MonthQueue()
+        >>> my_queue.position = 5
+        >>> my_queue.get_atr_schedule('traffic_level', 3).tolist()
+        [0.98, 1.0, 0.98]
+        """
+        rows = (self.position + np.arange(iterations)) % 12
+        return self.levels[rows, self.attributes[atr]]
@@ -0,0 +1,327 @@
+# network_format.py
+
+"""
+Array format for county networks, the replacement of the three pickles illinois_network.py used to write.
+A network is a folder of raw .npy arrays next to a small meta.json:
+    - one column per County attribute, indexed by county id, plus the county names
+    - the adjacency in CSR form: the neighbors of county i are neighbors[offsets[i]:offsets[i + 1]], in graph order
+    - the undirected edge number of every CSR entry, and the weight and relation code of every undirected edge
+The arrays are opened with numpy.memmap, so every worker process reading a network shares the same pages, and no
+pickle is ever loaded. read_network_table hands the arrays to the vectorized engine as they are, read_network builds
+the graph and County objects of the object model from them. County geometries are kept in an optional side file, as
+WKB bytes with precomputed centroids, which is read lazily through a GeometryStore.
+"""
+
+import hashlib
+import json
+import os
+
+import networkx as nx
+import numpy as np
+from my_classes import CountyTable, GeometryStore
+
+FORMAT_NAME = 'slf-network'
+FORMAT_VERSION = 1
+NODE_COLUMNS = CountyTable.FLOAT_COLUMNS + CountyTable.BOOL_COLUMNS
+EDGE_ARRAYS = ('offsets', 'neighbors', 'edge_ids', 'weights', 'relations')
+
+
+def get_network_path(prefix=None, path=None) -> str:
+    """
+    Utility function.
+    returns the folder a network is stored in.
+    :param prefix: set to use other versions of the network, defaults to nothing for the primary network
+    :param path: folder holding the networks, defaults to data/location
+    :return: path of the network folder
+
+    >>> get_network_path(prefix='fast_')
+    'data/location/fast_IL_network'
+    """
+    prefix = '' if prefix is None else prefix
+    path = 'data/location' if path is None else path
+    return f'{path}/{prefix}IL_network'
+
+
+def get_geometry_path(prefix=None, path=None) -> str:
+    """
+    Utility function.
+    returns the side file a network's geometries are stored in.
+    :param prefix: set to use other versions of the network, defaults to nothing for the primary network
+    :param path: folder holding the networks, defaults to data/location
+    :return: path of the geometry file
+
+    >>> get_geometry_path()
+    'data/location/IL_geometry.npz'
+    """
+    prefix = '' if prefix is None else prefix
+    path = 'data/location' if path is None else path
+    return f'{path}/{prefix}IL_geometry.npz'
+
+
+def network_exists(prefix=None, path=None) -> bool:
+    """
+    checks if a network has been saved in the array format.
+    :param prefix: set to use other versions of the network, defaults to nothing for the primary network
+    :param path: folder holding the networks, defaults to data/location
+    :return: True if the network folder has a meta.json
+
+    >>> network_exists(), network_exists(prefix='missing_')
+    (True, False)
+    """
+    return os.path.isfile(f'{get_network_path(prefix, path)}/meta.json')
+
+
+def get_network_digest(prefix=None, path=None) -> str:
+    """
+    Utility function.
+    hashes the files set_up reads a network from: the array format folder if it exists, the pickles otherwise.
+    Geometries are left out, as they never change the results of a run.
+    :param prefix: set to use other versions of the network, defaults to nothing for the primary network
+    :param path: folder holding the networks, defaults to data/location
+    :return: sha256 hex digest
+
+    >>> digest = get_network_digest()
+    >>> len(digest), digest == get_network_digest(), digest == get_network_digest(prefix='fast_')
+    (64, True, False)
+    """
+    prefix = '' if prefix is None else prefix
+    path = 'data/location' if path is None else path
+    if network_exists(prefix, path):
+        folder = get_network_path(prefix, path)
+        files = [f'{folder}/{name}' for name in sorted(os.listdir(folder))]
+    else:
+        files = [f'{path}/{prefix}{name}.dat' for name in ('IL_graph', 'graph_handler_counties',
+                                                           'graph_handler_neighbors')]
+    digest = hashlib.sha256()
+    for file in files:
+        digest.update(os.path.basename(file).encode())
+        with open(file, 'rb') as network_file:
+            digest.update(network_file.read())
+    return digest.hexdigest()
+
+
+def get_insertion_order(offsets: np.ndarray, neighbors: np.ndarray) -> list:
+    """
+    orders the edges of a CSR adjacency so that adding them to an empty graph gives every node its neighbors in CSR
+    order. Neighbor order decides the order random numbers are drawn in, so a loaded graph has to keep it.
+    :param offsets: position where each node's neighbors begin, with the total at the end
+    :param neighbors: neighbor ids of every node, grouped by node
+    :return: list of (node, neighbor, position) tuples, position being the CSR entry of the edge for node
+
+    >>> offsets, neighbors = np.array([0, 2, 4, 6]), np.array([1, 2, 0, 2, 0, 1])
+    >>> clone = nx.Graph()
+    >>> clone.add_nodes_from(range(3))
+    >>> clone.add_edges_from((node, neighbor) for node, neighbor, position in get_insertion_order(offsets, neighbors))
+    >>> [list(clone.neighbors(node)) for node in clone]
+    [[1, 2], [0, 2], [0, 1]]
+    >>> get_insertion_order(offsets, np.array([1, 2, 2, 0, 0, 1]))  # no graph has this neighbor order
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid adjacency.
+    """
+    offsets, neighbors = offsets.tolist(), neighbors.tolist()
+    position = offsets[:-1]
+    ordered, pending = [], list(range(len(position)))
+    while pending:
+        node = pending.pop()
+        while position[node] < offsets[node + 1]:
+            neighbor = neighbors[position[node]]
+            if position[neighbor] == offsets[neighbor + 1] or neighbors[position[neighbor]] != node:
+                break  # the edge comes later for the neighbor, it is added once the neighbor reaches it
+            ordered.append((node, neighbor, position[node]))
+            position[node] += 1
+            position[neighbor] += 1
+            pending.append(neighbor)
+    if 2 * len(ordered) != len(neighbors):
+        raise ValueError('This is not a valid adjacency.')
+    return ordered
+
+
+def write_network(CG: nx.Graph, schema: dict, prefix=None, path=None, geometry=True):
+    """
+    Saves a network in the array format, and its geometries in the side file.
+    Counties are numbered in schema order, which has to be the node order of the graph.
+    :param CG: graph of the county network, with a weight and a rel on every edge
+    :param schema: a dict of county names and their objects
+    :param prefix: set to save other versions of the network, defaults to nothing for the primary network
+    :param path: folder holding the networks, defaults to data/location
+    :param geometry: also writes the geometry side file, if the counties have geometries
+    """
+    names = list(schema)
+    if names != [node.name for node in CG]:
+        raise ValueError('The schema has to be in the node order of the graph.')
+    ids = {name: county_id for county_id, name in enumerate(names)}
+    offsets, neighbors, edge_ids, weights, relations = [0], [], [], [], []
+    edge_numbers, relation_codes = {}, {}
+    for node in CG:
+        for neighbor in CG.neighbors(node):
+            pair = (min(ids[node.name], ids[neighbor.name]), max(ids[node.name], ids[neighbor.name]))
+            if pair not in edge_numbers:
+                edge_numbers[pair] = len(edge_numbers)
+                weights.append(CG[node][neighbor]['weight'])
+                relations.append(relation_codes.setdefault(CG[node][neighbor].get('rel'), len(relation_codes)))
+            neighbors.append(ids[neighbor.name])
+            edge_ids.append(edge_numbers[pair])
+        offsets.append(len(neighbors))
+
+    network_path = get_network_path(prefix, path)
+    os.makedirs(network_path, exist_ok=True)
+    table = CountyTable.from_counties(schema.values(), NODE_COLUMNS)
+    arrays = dict(table.columns, names=np.array(names), offsets=np.array(offsets, dtype=np.int64),
+                  neighbors=np.array(neighbors, dtype=np.int64), edge_ids=np.array(edge_ids, dtype=np.int64),
+                  weights=np.array(weights, dtype=float), relations=np.array(relations, dtype=np.int8))
+    for name, array in arrays.items():
+        np.save(f'{network_path}/{name}.npy', array)
+    meta = {'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'counties': len(names), 'edges': len(weights),
+            'columns': list(NODE_COLUMNS), 'relations': list(relation_codes)}
+    with open(f'{network_path}/meta.json', 'w') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+
+    if geometry and all(getattr(county, 'geometry', None) is not None for county in schema.values()):
+        write_geometry([county.geometry for county in schema.values()], prefix=prefix, path=path)
+
+
+def write_geometry(geometries: list, prefix=None, path=None):
+    """
+    Saves county geometries, in county id order, as WKB bytes with their centroids.
+    :param geometries: list of shapely geometries
+    :param prefix: set to save other versions of the network, defaults to nothing for the primary network
+    :param path: folder holding the networks, defaults to data/location
+    """
+    import shapely  # only needed to build and draw maps, the simulation never loads geometries
+
+    wkb = [shapely.to_wkb(geometry) for geometry in geometries]
+    offsets = np.concatenate([[0], np.cumsum([len(data) for data in wkb])]).astype(np.int64)
+    centroids = np.array([[geometry.centroid.x, geometry.centroid.y] for geometry in geometries], dtype=float)
+    np.savez(get_geometry_path(prefix, path), wkb=np.frombuffer(b''.join(wkb), dtype=np.uint8), offsets=offsets,
+             centroids=centroids)
+
+
+def read_network_arrays(prefix=None, path=None, mmap_mode='r') -> (dict, dict):
+    """
+    Opens the arrays of a saved network.
+    :param prefix: set to use other versions of the network, defaults to nothing for the primary network
+    :param path: folder holding the networks, defaults to data/location
+    :param mmap_mode: numpy.load mmap_mode of the arrays, 'r' shares read-only pages, None reads them into memory
+    :return meta: the contents of meta.json
+    :return arrays: dict of array names and arrays
+
+    >>> meta, arrays = read_network_arrays()
+    >>> meta['version'], meta['counties'], len(arrays['offsets']) - 1, isinstance(arrays['neighbors'], np.memmap)
+    (1, 102, 102, True)
+    """
+    network_path = get_network_path(prefix, path)
+    with open(f'{network_path}/meta.json') as meta_file:
+        meta = json.load(meta_file)
+    if meta.get('format') != FORMAT_NAME or meta.get('version') != FORMAT_VERSION:
+        raise ValueError('This network file version is not supported.')
+    arrays = {name: np.load(f'{network_path}/{name}.npy', mmap_mode=mmap_mode)
+              for name in ('names',) + tuple(meta['columns']) + EDGE_ARRAYS}
+    return meta, arrays
+
+
+def table_from_arrays(meta: dict, arrays: dict) -> (CountyTable, dict):
+    """
+    Wraps the arrays of a network for the vectorized engine, without building any County objects or graph.
+    The columns and edge arrays stay memory mapped, so nothing is copied until a run writes to its own state.
+    :param meta: the contents of meta.json
+    :param arrays: dict of array names and arrays
+    :return table: CountyTable of the saved columns
+    :return edges: dict of the CSR 'offsets' and 'neighbors', the undirected 'edge_ids' of every CSR entry, and the
+    'weights' and 'interstate' flags of every undirected edge
+
+    >>> table, edges = table_from_arrays(*read_network_arrays(prefix='fast_'))
+    >>> table.names[:2], isinstance(table['saturation'], np.memmap), int(edges['interstate'].sum())
+    (['Cook', 'DuPage'], True, 76)
+    """
+    table = CountyTable(arrays['names'].tolist(), {atr: arrays[atr] for atr in meta['columns']})
+    interstate = meta['relations'].index('interstate') if 'interstate' in meta['relations'] else -1
+    edges = {name: arrays[name] for name in ('offsets', 'neighbors', 'edge_ids', 'weights')}
+    edges['interstate'] = np.asarray(arrays['relations']) == interstate
+    return table, edges
+
+
+def read_network_table(prefix=None, path=None) -> (CountyTable, dict):
+    """
+    Opens a saved network as the arrays the vectorized engine runs on, see table_from_arrays.
+    :param prefix: set to use other versions of the network, defaults to nothing for the primary network
+    :param path: folder holding the networks, defaults to data/location
+    :return table: CountyTable of the saved columns
+    :return edges: dict of edge arrays
+    """
+    return table_from_arrays(*read_network_arrays(prefix=prefix, path=path))
+
+
+def network_from_arrays(meta: dict, arrays: dict) -> (nx.Graph, dict, dict):
+    """
+    Builds the graph and handlers of a network from its arrays. The graph nodes are the county objects of the schema,
+    and every node gets its neighbors in the saved order.
+    :param meta: the contents of meta.json
+    :param arrays: dict of array names and arrays
+    :return CG: graph of the network
+    :return schema: a dict of county names and their objects
+    :return neighbor_schema: a dict of county names and the objects of their adjacent counties
+    """
+    names = arrays['names'].tolist()
+    table = CountyTable(names, {atr: arrays[atr] for atr in meta['columns']})
+    counties = table.to_counties()
+    schema = dict(zip(names, counties))
+    offsets, neighbors = arrays['offsets'].tolist(), arrays['neighbors'].tolist()
+    neighbor_schema = {name: [counties[neighbor] for neighbor in neighbors[offsets[i]:offsets[i + 1]]]
+                       for i, name in enumerate(names)}
+
+    edge_ids, weights, relations = arrays['edge_ids'], arrays['weights'].tolist(), arrays['relations'].tolist()
+    CG = nx.Graph()
+    CG.add_nodes_from(counties)
+    CG.add_edges_from((counties[node], counties[neighbor],
+                       {'weight': weights[edge_ids[position]], 'rel': meta['relations'][relations[edge_ids[position]]]})
+                      for node, neighbor, position in get_insertion_order(arrays['offsets'], arrays['neighbors']))
+    return CG, schema, neighbor_schema
+
+
+def read_network(prefix=None, path=None, geometry=True) -> (nx.Graph, dict, dict):
+    """
+    Loads a saved network.
+    :param prefix: set to use other versions of the network, defaults to nothing for the primary network
+    :param path: folder holding the networks, defaults to data/location
+    :param geometry: gives the counties a GeometryStore of the geometry side file, if the network has one. Geometries
+    are only read when a county's geometry or centroid is first accessed.
+    :return CG: graph of the network
+    :return schema: a dict of county names and their objects
+    :return neighbor_schema: a dict of county names and the objects of their adjacent counties
+
+    >>> CG, schema, neighbor_schema = read_network(prefix='fast_')
+    >>> CG.number_of_edges(), [county.name for county in neighbor_schema['Cook']][:3]
+    (268, ['McHenry', 'Lake', 'Will'])
+    >>> CG[schema['Cook']][schema['Will']], schema['Cook'].geometry.geom_type
+    ({'weight': 0.25, 'rel': 'interstate'}, 'Polygon')
+    >>> schema['Cook'].centroid.equals(schema['Cook'].geometry.centroid)
+    True
+    """
+    meta, arrays = read_network_arrays(prefix=prefix, path=path)
+    CG, schema, neighbor_schema = network_from_arrays(meta, arrays)
+    if geometry and os.path.isfile(get_geometry_path(prefix, path)):
+        GeometryStore(schema, get_geometry_path(prefix, path)).attach(schema.values())
+    return CG, schema, neighbor_schema
+
+
+def convert_pickles(prefix=None, path=None):
+    """
+    Saves a network pickled by an older illinois_network.py in the array format.
+    :param prefix: set to convert other versions of the network, defaults to nothing for the primary network
+    :param path: folder holding the networks, defaults to data/location
+    """
+    import pickle
+
+    prefix = '' if prefix is None else prefix
+    path = 'data/location' if path is None else path
+    with open(f'{path}/{prefix}IL_graph.dat', 'rb') as graph_file:
+        CG = pickle.load(graph_file)
+    with open(f'{path}/{prefix}graph_handler_counties.dat', 'rb') as schema_file:
+        schema = pickle.load(schema_file)
+    write_network(CG, schema, prefix=prefix, path=path)
+
+
+if __name__ == '__main__':
+    convert_pickles()
+    convert_pickles(prefix='fast_')
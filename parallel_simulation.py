@@ -0,0 +1,340 @@
+# parallel_simulation.py
+
+"""
+Spreads Monte Carlo replicates of saturation_ensemble over a pool of worker processes.
+Replicates are cut into fixed size chunks and every chunk draws from its own numpy Generator, spawned from a single
+SeedSequence. Which worker runs a chunk does not matter, so a seed gives the same results for any number of workers.
+"""
+
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from my_classes import EnsembleAggregator
+from result_cache import ResultCache
+from run_modes import RUN_MODE_REGISTRY, RunMode, get_run_mode
+from run_simulation import get_run_key, load_network_table, saturation_ensemble
+
+
+def split_replicates(replicates: int, chunk_size: int) -> list:
+    """
+    Utility function.
+    Cuts a number of replicates into chunks of at most chunk_size.
+    :param replicates: total number of replicates
+    :param chunk_size: largest number of replicates in a chunk
+    :return: list of chunk sizes
+
+    >>> split_replicates(10, 4)
+    [4, 4, 2]
+    >>> split_replicates(3, 50)
+    [3]
+    """
+    return [min(chunk_size, replicates - start) for start in range(0, replicates, chunk_size)]
+
+
+def get_seed_sequence(seed=None) -> np.random.SeedSequence:
+    """
+    Utility function.
+    Turns a seed into a SeedSequence, passing SeedSequences through so they can be spawned from further.
+    :param seed: int, SeedSequence or None for fresh entropy from the OS
+    :return: SeedSequence
+
+    >>> get_seed_sequence(5).entropy
+    5
+    >>> sequence = np.random.SeedSequence(5)
+    >>> get_seed_sequence(sequence) is sequence
+    True
+    """
+    return seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+
+def resolve_run_mode(run_mode, life_cycle=False, workers=None):
+    """
+    Utility function.
+    Resolves a run mode in the parent process, so an unknown mode fails before any job is submitted. Registered modes
+    are sent to the workers by name and looked up again in each worker, other RunModes are sent whole and so must be
+    picklable, which rules out kernels written as lambdas or local functions.
+    :param run_mode: name or alias of a registered mode, or a RunMode
+    :param life_cycle: True for the life cycle model, False for the annual one
+    :param workers: number of worker processes. 1 runs in the current process, where any RunMode can be used.
+    :return: the name of a registered mode, or the RunMode itself
+
+    >>> resolve_run_mode('Population-Based', life_cycle=True)
+    'Population-Based Countermeasures'
+    >>> resolve_run_mode(RunMode('Lambda', annual=print, annual_vectorized=lambda *args: None), workers=1)
+    RunMode('Lambda')
+    >>> resolve_run_mode(RunMode('Lambda', annual=print, annual_vectorized=lambda *args: None))
+    Traceback (most recent call last):
+    ...
+    ValueError: This run mode cannot be sent to worker processes. Please register it or use workers=1.
+    >>> resolve_run_mode('Parasitic Wasps')
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid run mode.
+    """
+    run_mode = get_run_mode(run_mode, life_cycle=life_cycle, vectorized=True)
+    if RUN_MODE_REGISTRY.get(run_mode.name) is run_mode:
+        return run_mode.name
+    if workers != 1:
+        try:
+            pickle.dumps(run_mode)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            raise ValueError('This run mode cannot be sent to worker processes. Please register it or use workers=1.') \
+                from None
+    return run_mode
+
+
+def run_chunk(job: tuple) -> np.ndarray:
+    """
+    Runs one chunk of replicates in a worker process. Takes a single tuple so that it can be sent through
+    ProcessPoolExecutor.map.
+    :param job: (run_mode, iterations, replicates, life_cycle, prefix, update, seed_sequence)
+    :return: array of saturations shaped (replicate, county, time)
+    """
+    run_mode, iterations, replicates, life_cycle, prefix, update, seed_sequence = job
+    return saturation_ensemble(run_mode, iterations, replicates, life_cycle=life_cycle, prefix=prefix,
+                               update=update, rng=np.random.default_rng(seed_sequence))
+
+
+def parallel_ensemble(run_mode: str, iterations: int, replicates: int, life_cycle=False, prefix=None, update=None,
+                      seed=None, workers=None, chunk_size=50, cache=None) -> np.ndarray:
+    """
+    Runs replicates of any run mode across a process pool and stitches them back together in chunk order.
+    :param run_mode: version of Monte Carlo to run, a registered name or a RunMode whose kernels can be pickled
+    :param iterations: number of years or months in each replicate
+    :param replicates: number of replicates
+    :param life_cycle: a Boolean that decided if saturation is affected by class methods.
+    :param prefix: set to call other versions of graphs and handlers
+    :param update: update order of the vectorized engine
+    :param seed: int or SeedSequence to spawn from, defaults to fresh entropy from the OS
+    :param workers: number of worker processes, defaults to the number of CPUs. 1 runs in the current process.
+    :param chunk_size: replicates run in lockstep by one job. Results depend on it, but not on workers.
+    :param cache: folder or ResultCache of earlier results. Only used when a seed is given, as otherwise every call
+    gives new results.
+    :return: array of saturations shaped (replicate, county, time)
+
+    >>> one = parallel_ensemble('Quarantine', 3, 6, seed=7, workers=1, chunk_size=2)
+    >>> two = parallel_ensemble('Quarantine', 3, 6, seed=7, workers=2, chunk_size=2)
+    >>> one.shape, bool((one == two).all())
+    ((6, 102, 4), True)
+    >>> parallel_ensemble('All', 3, 2, life_cycle=True, seed=7, workers=1).shape
+    (2, 102, 4)
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as path:
+    ...     cached = [parallel_ensemble('Quarantine', 3, 6, seed=7, workers=1, chunk_size=2, cache=path)
+    ...               for _ in range(2)]
+    >>> bool((cached[0] == one).all()), bool((cached[1] == one).all())
+    (True, True)
+    >>> with tempfile.TemporaryDirectory() as path:
+    ...     sequences = [np.random.SeedSequence(7) for _ in range(2)]
+    ...     runs = [parallel_ensemble('Quarantine', 3, 6, seed=sequence, workers=1, chunk_size=2, cache=path)
+    ...             for sequence in sequences]
+    >>> [sequence.n_children_spawned for sequence in sequences]
+    [3, 3]
+    >>> parallel_ensemble('Baseline', 3, 0, workers=1)
+    Traceback (most recent call last):
+    ...
+    ValueError: Please use an integer greater than zero.
+    """
+    if not (type(replicates) == int and replicates > 0):
+        raise ValueError('Please use an integer greater than zero.')
+    run_mode = resolve_run_mode(run_mode, life_cycle=life_cycle, workers=workers)
+    chunks = split_replicates(replicates, chunk_size)
+    seed_sequence = get_seed_sequence(seed)
+    children = seed_sequence.n_children_spawned
+    # spawned before the cache is read, so a shared SeedSequence moves on the same way whether the results are cached
+    chunk_sequences = seed_sequence.spawn(len(chunks))
+    cache = ResultCache(cache) if isinstance(cache, str) else cache
+    if cache is not None and seed is not None:
+        key = get_run_key('parallel_ensemble', get_run_mode(run_mode, life_cycle=life_cycle, vectorized=True),
+                          iterations, life_cycle, '' if prefix is None else prefix, None, None,
+                          replicates=replicates, update='sequential' if update is None else update,
+                          chunk_size=chunk_size, entropy=seed_sequence.entropy,
+                          spawn_key=list(seed_sequence.spawn_key), children=children)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached[0]
+    else:
+        cache = None
+    jobs = [(run_mode, iterations, size, life_cycle, prefix, update, chunk_sequence)
+            for size, chunk_sequence in zip(chunks, chunk_sequences)]
+
+    if workers == 1:
+        results = list(map(run_chunk, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_chunk, jobs))
+    results = np.concatenate(results, axis=0)
+    if cache is not None:
+        cache.put(key, results)
+    return results
+
+
+def aggregate_chunk(job: tuple) -> EnsembleAggregator:
+    """
+    Runs one chunk of replicates in a worker process and sends back only its summary.
+    :param job: (run_mode, iterations, replicates, life_cycle, prefix, update, seed_sequence, bins, county_quantiles)
+    :return: EnsembleAggregator of the chunk
+    """
+    *chunk_job, bins, county_quantiles = job
+    run_mode, iterations, replicates, life_cycle, prefix, update, seed_sequence = chunk_job
+    table, edges = load_network_table(prefix=prefix)
+    aggregator = EnsembleAggregator(table.names, iterations + 1, bins=bins, county_quantiles=county_quantiles)
+    aggregator.add(run_chunk(tuple(chunk_job)))
+    return aggregator
+
+
+def parallel_aggregate(run_mode: str, iterations: int, replicates: int, life_cycle=False, prefix=None, update=None,
+                       seed=None, workers=None, chunk_size=50, bins=100, county_quantiles=False,
+                       aggregator=None) -> EnsembleAggregator:
+    """
+    Runs replicates like parallel_ensemble, but every chunk is folded into an EnsembleAggregator as soon as it
+    finishes, so no more than one chunk of results per worker is ever held in memory. Chunks are merged in chunk
+    order, so a seed gives the same summary for any number of workers.
+    :param run_mode: version of Monte Carlo to run, a registered name or a RunMode whose kernels can be pickled
+    :param iterations: number of years or months in each replicate
+    :param replicates: number of replicates
+    :param life_cycle: a Boolean that decided if saturation is affected by class methods.
+    :param prefix: set to call other versions of graphs and handlers
+    :param update: update order of the vectorized engine
+    :param seed: int or SeedSequence to spawn from, defaults to fresh entropy from the OS
+    :param workers: number of worker processes, defaults to the number of CPUs. 1 runs in the current process.
+    :param chunk_size: replicates run in lockstep by one job
+    :param bins: number of histogram bins of the quantile sketches
+    :param county_quantiles: also keeps quantile sketches per county, see EnsembleAggregator for their memory cost
+    :param aggregator: EnsembleAggregator to add the replicates to, defaults to a new one
+    :return: EnsembleAggregator of every replicate
+
+    >>> summary = parallel_aggregate('Quarantine', 3, 6, seed=7, workers=1, chunk_size=2)
+    >>> results = parallel_ensemble('Quarantine', 3, 6, seed=7, workers=1, chunk_size=2)
+    >>> summary.count, bool(np.allclose(summary.statewide_mean, results.mean(axis=1).mean(axis=0)))
+    (6, True)
+    >>> summary.to_dataframe().columns.tolist()
+    ['mean', 'std', 'ci_low', 'ci_high', 'q5', 'q50', 'q95']
+    """
+    if not (type(replicates) == int and replicates > 0):
+        raise ValueError('Please use an integer greater than zero.')
+    run_mode = resolve_run_mode(run_mode, life_cycle=life_cycle, workers=workers)
+    chunks = split_replicates(replicates, chunk_size)
+    seed_sequences = get_seed_sequence(seed).spawn(len(chunks))
+    jobs = [(run_mode, iterations, size, life_cycle, prefix, update, seed_sequence, bins, county_quantiles)
+            for size, seed_sequence in zip(chunks, seed_sequences)]
+
+    if workers == 1:
+        aggregator = fold_summaries(map(aggregate_chunk, jobs), aggregator)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            aggregator = fold_summaries(pool.map(aggregate_chunk, jobs), aggregator)
+    return aggregator
+
+
+def fold_summaries(summaries, aggregator=None) -> EnsembleAggregator:
+    """
+    Utility function.
+    Merges chunk summaries in order as they arrive.
+    :param summaries: iterable of EnsembleAggregator
+    :param aggregator: EnsembleAggregator to merge into, defaults to the first summary
+    :return: the merged EnsembleAggregator
+    """
+    for summary in summaries:
+        aggregator = summary if aggregator is None else aggregator.merge(summary)
+    return aggregator
+
+
+def get_ci_width(aggregator: EnsembleAggregator, county=None, z=1.96) -> np.ndarray:
+    """
+    Utility function.
+    returns the width of the confidence interval of the mean trajectory at every timestep.
+    :param aggregator: EnsembleAggregator of the replicates so far
+    :param county: name of the county to follow, defaults to the statewide mean
+    :param z: standard score of the confidence level
+    :return: array of interval widths, one per timestep
+    """
+    low, high = aggregator.confidence_interval(z=z, statewide=county is None)
+    if county is not None:
+        low, high = low[aggregator.names.index(county)], high[aggregator.names.index(county)]
+    return high - low
+
+
+def adaptive_ensemble(run_mode: str, iterations: int, tolerance: float, life_cycle=False, prefix=None, update=None,
+                      seed=None, county=None, z=1.96, batch_size=50, max_replicates=10000, workers=None,
+                      chunk_size=50, county_quantiles=False) -> (EnsembleAggregator, bool):
+    """
+    Runs replicates in batches until the confidence interval of the mean trajectory is narrower than tolerance at
+    every timestep, or max_replicates have run. Low variance modes stop after a batch or two, noisy ones keep going.
+    Every batch draws from its own child of the seed, so a seed always stops at the same point with the same summary.
+    :param run_mode: version of Monte Carlo to run
+    :param iterations: number of years or months in each replicate
+    :param tolerance: largest accepted width of the confidence interval, in saturation
+    :param life_cycle: a Boolean that decided if saturation is affected by class methods.
+    :param prefix: set to call other versions of graphs and handlers
+    :param update: update order of the vectorized engine
+    :param seed: int or SeedSequence to spawn from, defaults to fresh entropy from the OS
+    :param county: name of a county whose trajectory decides when to stop, defaults to the statewide mean
+    :param z: standard score of the confidence level, 1.96 for 95%
+    :param batch_size: replicates run between checks
+    :param max_replicates: replicates after which the ensemble stops even if it has not converged
+    :param workers: number of worker processes, defaults to the number of CPUs. 1 runs in the current process.
+    :param chunk_size: replicates run in lockstep by one job
+    :param county_quantiles: also keeps quantile sketches per county, see EnsembleAggregator for their memory cost
+    :return aggregator: EnsembleAggregator of every replicate run
+    :return converged: True if the tolerance was met, False if max_replicates stopped the ensemble
+
+    >>> summary, converged = adaptive_ensemble('Baseline', 3, 0.05, seed=3, batch_size=10, workers=1)
+    >>> converged, summary.count
+    (True, 10)
+    >>> summary, converged = adaptive_ensemble('Quarantine', 3, 0.001, seed=3, batch_size=10, max_replicates=25,
+    ...                                        workers=1)
+    >>> converged, summary.count
+    (False, 25)
+    >>> adaptive_ensemble('Quarantine', 3, 0.001, seed=3, max_replicates=4, workers=1)[0].count
+    4
+    >>> adaptive_ensemble('Baseline', 3, 0.0, batch_size=1)
+    Traceback (most recent call last):
+    ...
+    ValueError: Please use a tolerance greater than zero and a batch size of at least 2.
+    """
+    if not (tolerance > 0 and type(batch_size) == int and batch_size > 1):
+        raise ValueError('Please use a tolerance greater than zero and a batch size of at least 2.')
+    seed_sequence = get_seed_sequence(seed)
+    aggregator, converged = None, False
+    while not converged and (aggregator is None or aggregator.count < max_replicates):
+        size = min(batch_size, max_replicates - (0 if aggregator is None else aggregator.count))
+        aggregator = parallel_aggregate(run_mode, iterations, size, life_cycle=life_cycle, prefix=prefix,
+                                        update=update, seed=seed_sequence.spawn(1)[0], workers=workers,
+                                        chunk_size=chunk_size, county_quantiles=county_quantiles,
+                                        aggregator=aggregator)
+        converged = bool((get_ci_width(aggregator, county=county, z=z) < tolerance).all())
+    return aggregator, converged
+
+
+def parallel_trends(run_modes: list, iterations: int, replicates: int, all_trends=None, life_cycle=False,
+                    prefix=None, update=None, seed=None, workers=None, chunk_size=50) -> dict:
+    """
+    Runs every run mode with parallel_ensemble and merges the results into the all_trends dict built by
+    model_variables_avg: the statewide saturation averaged over all replicates, indexed by timestep.
+    Each run mode gets its own child of the seed.
+    :param run_modes: list of run modes to simulate
+    :param iterations: number of years or months in each replicate
+    :param replicates: number of replicates per run mode
+    :param all_trends: a dictionary that accumulates trends for each of the simulations run in different modes.
+    :param life_cycle: a Boolean that decided if saturation is affected by class methods.
+    :param prefix: set to call other versions of graphs and handlers
+    :param update: update order of the vectorized engine
+    :param seed: int or SeedSequence to spawn from, defaults to fresh entropy from the OS
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param chunk_size: replicates run in lockstep by one job
+    :return all_trends: dict of run mode names and pandas Series of average saturation
+
+    >>> trends = parallel_trends(['Baseline', 'All'], 3, 4, seed=1, workers=1)
+    >>> list(trends), len(trends['All'])
+    (['Baseline', 'All'], 4)
+    """
+    all_trends = {} if all_trends is None else all_trends
+    mode_seeds = get_seed_sequence(seed).spawn(len(run_modes))
+    for run_mode, mode_seed in zip(run_modes, mode_seeds):
+        results = parallel_ensemble(run_mode, iterations, replicates, life_cycle=life_cycle, prefix=prefix,
+                                    update=update, seed=mode_seed, workers=workers, chunk_size=chunk_size)
+        all_trends[run_mode] = pd.Series(results.mean(axis=1).mean(axis=0))
+    return all_trends
@@ -0,0 +1,316 @@
+# parameter_sweep.py
+
+"""
+Runs the model over a space of parameters: the model constants in run_modes.MODEL_CONSTANTS and the starting
+coefficients of data/coef_dict.JSON. A parameter is either the name of a model constant, like 'transmission_mean',
+or 'County:attribute' for a starting coefficient, like 'Cook:saturation'.
+
+Points are laid out as a grid, drawn at random or by Latin hypercube sampling, and every (point, chunk of replicates)
+job runs in a process pool. Each point is written to its own tidy table, named after a hash of its parameters, and
+points whose table already exists are skipped, so a sweep that stops part way picks up where it left off when it is
+run again. Every point draws from its own child of the sweep's seed, so results do not depend on the order of the
+points or the number of workers.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import itertools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from parallel_simulation import get_seed_sequence, split_replicates
+from run_modes import MODEL_CONSTANTS, get_run_mode, set_model_constants
+from run_simulation import ENGINES, load_network_table, saturation_ensemble, saturation_main
+
+SAMPLING_METHODS = ('grid', 'random', 'lhs')
+
+
+def get_sweep_points(space: dict, method='grid', samples=None, seed=None) -> list:
+    """
+    Lays out the points of a parameter space.
+    :param space: dict of parameter names and, for 'grid', the list of values each takes, for 'random' and 'lhs'
+    the (low, high) range each is drawn from
+    :param method: 'grid' for every combination of the values, 'random' for independent uniform draws and 'lhs' for
+    a Latin hypercube, which puts exactly one point in each of the samples equal slices of every range
+    :param samples: number of points to draw for 'random' and 'lhs'
+    :param seed: int or SeedSequence of the draws, defaults to fresh entropy from the OS
+    :return: list of dicts of parameter names and values
+
+    >>> get_sweep_points({'transmission_mean': [0.3, 0.45], 'Cook:saturation': [0.2]})
+    [{'transmission_mean': 0.3, 'Cook:saturation': 0.2}, {'transmission_mean': 0.45, 'Cook:saturation': 0.2}]
+    >>> points = get_sweep_points({'transmission_mean': (0.3, 0.6), 'toh_scale': (0.01, 0.03)}, method='lhs',
+    ...                           samples=4, seed=1)
+    >>> sorted(int((point['transmission_mean'] - 0.3) / 0.075) for point in points)
+    [0, 1, 2, 3]
+    >>> get_sweep_points({'toh_scale': (0.01, 0.03)}, method='sobol', samples=4)
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid sampling method.
+    """
+    if method not in SAMPLING_METHODS:
+        raise ValueError('This is not a valid sampling method.')
+    names = list(space)
+    if method == 'grid':
+        return [dict(zip(names, values)) for values in itertools.product(*space.values())]
+
+    if not (type(samples) == int and samples > 0):
+        raise ValueError('Please use an integer greater than zero.')
+    rng = np.random.default_rng(get_seed_sequence(seed))
+    columns = []
+    for low, high in space.values():
+        if method == 'lhs':  # one draw inside each slice, the slices shuffled independently for every parameter
+            shares = (rng.permutation(samples) + rng.random(samples)) / samples
+        else:
+            shares = rng.random(samples)
+        columns.append((low + shares * (high - low)).tolist())
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+def get_point_id(point: dict) -> str:
+    """
+    Utility function.
+    Names a point after a hash of its parameters, so the same point always has the same table.
+    :param point: dict of parameter names and values
+    :return: 16 character hex string
+
+    >>> get_point_id({'toh_scale': 0.02, 'transmission_mean': 0.45}) == get_point_id({'transmission_mean': 0.45,
+    ...                                                                                'toh_scale': 0.02})
+    True
+    """
+    return hashlib.sha256(json.dumps(point, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def split_point(point: dict, names: list) -> (dict, dict):
+    """
+    Utility function.
+    Separates the model constants of a point from its starting coefficients.
+    :param point: dict of parameter names and values
+    :param names: county names of the network
+    :return constants: dict of model constant names and values
+    :return coefficients: dict of county names and dicts of their attributes and values
+
+    >>> split_point({'toh_scale': 0.03, 'St. Clair:saturation': 0.1}, ['Cook', 'St. Clair'])
+    ({'toh_scale': 0.03}, {'St. Clair': {'saturation': 0.1}})
+    >>> split_point({'flamethrower_range': 3.0}, ['Cook'])
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid parameter.
+    """
+    constants, coefficients = {}, {}
+    for name, value in point.items():
+        county, separator, atr = name.rpartition(':')
+        if separator and county in names:
+            coefficients.setdefault(county, {})[atr] = value
+        elif not separator and name in MODEL_CONSTANTS:
+            constants[name] = value
+        else:
+            raise ValueError('This is not a valid parameter.')
+    return constants, coefficients
+
+
+def write_point_coefficients(coefficients: dict, path: str, point_id: str, coef_path=None):
+    """
+    Utility function.
+    Writes the starting coefficients of a point, the base coefficient file with the point's values on top.
+    :param coefficients: dict of county names and dicts of their attributes and values
+    :param path: folder of the sweep
+    :param point_id: id of the point
+    :param coef_path: base JSON file of starting coefficients, defaults to data/coef_dict.JSON
+    :return: path of the written file, or coef_path if the point changes no coefficients
+    """
+    if not coefficients:
+        return coef_path
+    with open('data/coef_dict.JSON' if coef_path is None else coef_path) as coef_file:
+        coef_dict = json.load(coef_file)
+    for county, attributes in coefficients.items():
+        coef_dict.setdefault(county, {}).update(attributes)
+    point_coef_path = f'{path}/point_{point_id}_coef.JSON'
+    with open(point_coef_path, 'w') as coef_file:
+        json.dump(coef_dict, coef_file)
+    return point_coef_path
+
+
+def run_sweep_chunk(job: tuple) -> np.ndarray:
+    """
+    Runs one chunk of replicates of one point in a worker process, with the point's model constants set only for
+    the length of the job. Takes a single tuple so that it can be sent through ProcessPoolExecutor.map.
+    :param job: (run_mode, iterations, replicates, life_cycle, prefix, engine, update, constants, coef_path,
+    seed_sequence)
+    :return: array of saturations shaped (replicate, county, time)
+    """
+    run_mode, iterations, replicates, life_cycle, prefix, engine, update, constants, coef_path, seed_sequence = job
+    rng = np.random.default_rng(seed_sequence)
+    previous = set_model_constants(constants)
+    try:
+        if engine == 'vectorized':
+            return saturation_ensemble(run_mode, iterations, replicates, life_cycle=life_cycle, prefix=prefix,
+                                       update=update, rng=rng, coef_path=coef_path)
+        return np.stack([saturation_main(run_mode, iterations, life_cycle=life_cycle, prefix=prefix, rng=rng,
+                                         coef_path=coef_path).iloc[:, 1:].to_numpy() for _ in range(replicates)])
+    finally:
+        set_model_constants(previous)
+
+
+def make_point_table(point: dict, results: np.ndarray, names: list, time_frame=None) -> pd.DataFrame:
+    """
+    Builds the tidy table of a point: one row per replicate, county and timestep, led by the point's parameters.
+    :param point: dict of parameter names and values
+    :param results: array of saturations shaped (replicate, county, time)
+    :param names: county names, in the order of the county axis
+    :param time_frame: name of the timestep column, 'year' or 'month'
+    :return: dataframe with the parameter columns, then 'replicate', 'County', time_frame and 'saturation'
+
+    >>> make_point_table({'toh_scale': 0.03}, np.array([[[0.1, 0.2]]]), ['Cook'], time_frame='month')
+       toh_scale  replicate County  month  saturation
+    0       0.03          0   Cook      1         0.1
+    1       0.03          0   Cook      2         0.2
+    """
+    time_frame = 'year' if time_frame is None else time_frame
+    replicates, counties, steps = results.shape
+    point_df = pd.DataFrame({'replicate': np.repeat(np.arange(replicates), counties * steps),
+                             'County': np.tile(np.repeat(names, steps), replicates),
+                             time_frame: np.tile(np.arange(1, steps + 1), replicates * counties),
+                             'saturation': results.ravel()})
+    for position, (name, value) in enumerate(point.items()):
+        point_df.insert(position, name, value)
+    return point_df
+
+
+def check_sweep_settings(path: str, settings: dict) -> dict:
+    """
+    Utility function.
+    Records the settings of a sweep in its folder, or checks them against the ones recorded by an earlier run, which
+    also supplies the seed when none is given.
+    :param path: folder of the sweep
+    :param settings: json-able settings of the sweep, with 'entropy' None when no seed was given
+    :return: the settings the sweep runs with
+    """
+    if os.path.exists(f'{path}/sweep.json'):
+        with open(f'{path}/sweep.json') as settings_file:
+            recorded = json.load(settings_file)
+        if settings['entropy'] is None:
+            settings['entropy'] = recorded['entropy']
+        if recorded != settings:
+            raise ValueError('This folder holds a sweep with other settings.')
+        return settings
+    if settings['entropy'] is None:
+        settings['entropy'] = np.random.SeedSequence().entropy
+    with open(f'{path}/sweep.json', 'w') as settings_file:
+        json.dump(settings, settings_file)
+    return settings
+
+
+def parameter_sweep(run_mode: str, iterations: int, points: list, path: str, replicates=10, life_cycle=False,
+                    prefix=None, engine=None, update=None, seed=None, workers=None, chunk_size=50,
+                    coef_path=None) -> pd.DataFrame:
+    """
+    Runs replicates of every point of a sweep across a process pool and writes each point to point_<id>.csv in path
+    as soon as all of its replicates are done. Points that already have a table are skipped, so an interrupted sweep
+    is finished by calling it again with the same arguments.
+    :param run_mode: version of Monte Carlo to run, a registered name so that it can be sent to the workers
+    :param iterations: number of years or months in each replicate
+    :param points: list of dicts of parameter names and values, e.g. from get_sweep_points
+    :param path: folder the tables are written to, created if needed
+    :param replicates: number of replicates of each point
+    :param life_cycle: a Boolean that decided if saturation is affected by class methods.
+    :param prefix: set to call other versions of graphs and handlers
+    :param engine: 'vectorized' (default) runs each chunk in lockstep, 'object' runs its replicates one by one
+    :param update: update order of the vectorized engine
+    :param seed: int or SeedSequence to spawn from, defaults to the seed of an earlier run in path, or fresh entropy
+    :param workers: number of worker processes, defaults to the number of CPUs. 1 runs in the current process.
+    :param chunk_size: replicates of a point run by one job
+    :param coef_path: base JSON file of starting coefficients, defaults to data/coef_dict.JSON
+    :return: dataframe with one row per point: its parameters, 'point' id and 'table' file name. It is also written
+    to points.csv in path.
+
+    >>> import tempfile
+    >>> points = get_sweep_points({'transmission_mean': [0.3, 0.6], 'Cook:saturation': [0.5]})
+    >>> with tempfile.TemporaryDirectory() as path:
+    ...     index = parameter_sweep('Quarantine', 2, points, path, replicates=3, prefix='fast_', seed=4, workers=1)
+    ...     written = [os.stat(f'{path}/{table}').st_mtime_ns for table in index['table']]
+    ...     again = parameter_sweep('Quarantine', 2, points, path, replicates=3, prefix='fast_', seed=4, workers=1)
+    ...     rewritten = [os.stat(f'{path}/{table}').st_mtime_ns for table in again['table']]
+    ...     sweep_df = read_sweep(path)
+    >>> index.columns.tolist(), written == rewritten
+    (['transmission_mean', 'Cook:saturation', 'point', 'table'], True)
+    >>> sweep_df.shape
+    (1836, 7)
+    >>> sweep_df.loc[(sweep_df['County'] == 'Cook') & (sweep_df['year'] == 1), 'saturation'].tolist()
+    [0.5, 0.5, 0.5, 0.5, 0.5, 0.5]
+    """
+    prefix = '' if prefix is None else prefix
+    engine = 'vectorized' if engine is None else engine
+    update = 'sequential' if update is None else update
+    if engine not in ENGINES:
+        raise ValueError('This is not a valid engine.')
+    if not all(type(count) == int and count > 0 for count in (iterations, replicates)):
+        raise ValueError('Please use an integer greater than zero.')
+    run_mode = get_run_mode(run_mode, life_cycle=life_cycle, vectorized=engine == 'vectorized').name
+    os.makedirs(path, exist_ok=True)
+    settings = check_sweep_settings(path, {
+        'run_mode': run_mode, 'iterations': iterations, 'replicates': replicates, 'life_cycle': life_cycle,
+        'prefix': prefix, 'engine': engine, 'update': update, 'chunk_size': chunk_size, 'coef_path': coef_path,
+        'entropy': None if seed is None else get_seed_sequence(seed).entropy})
+    names = load_network_table(prefix=prefix, coef_path=coef_path)[0].names
+    time_frame = 'month' if life_cycle else 'year'
+
+    point_ids = [get_point_id(point) for point in points]
+    index_df = pd.DataFrame(points)
+    index_df['point'] = point_ids
+    index_df['table'] = [f'point_{point_id}.csv' for point_id in point_ids]
+    pending = {point_id: point for point_id, point in zip(point_ids, points)
+               if not os.path.exists(f'{path}/point_{point_id}.csv')}
+
+    chunks = split_replicates(replicates, chunk_size)
+    jobs = []
+    for point_id, point in pending.items():
+        constants, coefficients = split_point(point, names)
+        point_coef_path = write_point_coefficients(coefficients, path, point_id, coef_path=coef_path)
+        point_seed = np.random.SeedSequence(settings['entropy'], spawn_key=(int(point_id, 16),))
+        jobs.extend((run_mode, iterations, size, life_cycle, prefix, engine, update, constants, point_coef_path,
+                     seed_sequence) for size, seed_sequence in zip(chunks, point_seed.spawn(len(chunks))))
+
+    if workers == 1:
+        write_point_tables(map(run_sweep_chunk, jobs), pending, len(chunks), path, names, time_frame)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            write_point_tables(pool.map(run_sweep_chunk, jobs), pending, len(chunks), path, names, time_frame)
+    index_df.to_csv(f'{path}/points.csv', index=False)
+    return index_df
+
+
+def write_point_tables(results, pending: dict, chunk_count: int, path: str, names: list, time_frame: str):
+    """
+    Utility function.
+    Collects the chunks of every point in job order and writes its table once the last chunk arrives. Tables are
+    written under a temporary name first, so a table that exists is always complete.
+    :param results: iterable of chunk results, chunk_count per point in the order of pending
+    :param pending: dict of the ids and points being run
+    :param chunk_count: number of chunks per point
+    :param path: folder of the sweep
+    :param names: county names, in the order of the county axis
+    :param time_frame: name of the timestep column
+    """
+    results = iter(results)
+    for point_id, point in pending.items():
+        point_results = np.concatenate([next(results) for _ in range(chunk_count)], axis=0)
+        make_point_table(point, point_results, names, time_frame=time_frame).to_csv(
+            f'{path}/point_{point_id}.csv.tmp', index=False)
+        os.replace(f'{path}/point_{point_id}.csv.tmp', f'{path}/point_{point_id}.csv')
+
+
+def read_sweep(path: str) -> pd.DataFrame:
+    """
+    Reads the tables of every point of a sweep listed in its points.csv into one tidy dataframe.
+    :param path: folder of the sweep
+    :return: dataframe of every point's table, with a 'point' id column after the parameters
+    """
+    index_df = pd.read_csv(f'{path}/points.csv', dtype={'point': str})
+    tables = []
+    for point_id, table in zip(index_df['point'], index_df['table']):
+        point_df = pd.read_csv(f'{path}/{table}')
+        point_df.insert(len(point_df.columns) - 4, 'point', point_id)
+        tables.append(point_df)
+    return pd.concat(tables, ignore_index=True)
@@ -0,0 +1,229 @@
+# profiling.py
+
+"""
+Opt-in instrumentation of the object model. iterate_through_timeframe and saturation_main take a RunProfiler that
+records the wall time of every phase of every timestep, counters of edges visited, rng draws and live memory blocks, and
+can run one chosen timestep under cProfile or pyinstrument. Runs without a profiler do not touch this module.
+"""
+
+import contextlib
+import cProfile
+import io
+import pstats
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class CountingRng:
+    """
+    Stand-in for an rng that forwards every draw to it and counts the calls and the values drawn on a RunProfiler.
+    Draws are unchanged, so a run given a CountingRng produces the same results as one given the rng itself.
+
+    :param rng: numpy Generator, BlockSampler or the numpy.random module to draw from
+    :param profiler: RunProfiler the counts go to
+    """
+
+    def __init__(self, rng, profiler):
+        self.rng = rng
+        self.profiler = profiler
+
+    def __getattr__(self, atr: str):  # only called for attributes the stand-in does not hold
+        method = getattr(self.rng, atr)
+        if not callable(method):
+            return method
+
+        def counted(*args, **kwargs):
+            result = method(*args, **kwargs)
+            self.profiler.count('rng_calls', 1)
+            self.profiler.count('rng_draws', getattr(result, 'size', 1))
+            return result
+        setattr(self, atr, counted)  # later calls find it without going through __getattr__
+        return counted
+
+
+class RunProfiler:
+    """
+    Opt-in instrumentation of a run. Records the wall time of every phase of every timestep, with the time of nested
+    phases taken out of the phase around them, and counters of edges visited, rng calls and values drawn.
+    net_allocated_blocks is the change in sys.getallocatedblocks over the timestep: blocks still alive at its end minus
+    those alive at its start. It grows with what a step keeps, not with how much it allocates and frees again, and is
+    negative when a step frees more than it keeps. The setup before the first step is recorded as timestep 1. A chosen
+    timestep can also run under cProfile, or pyinstrument if it is installed.
+    A disabled profiler does nothing, its phases are a shared null context and its rng is the rng itself.
+
+    :param enabled: records nothing if False
+    :param profile_step: timestep to run under the profiler backend, if any
+    :param backend: 'cprofile' or 'pyinstrument'
+
+    >>> profiler = RunProfiler(profile_step=2)
+    >>> profiler.start_step(2)
+    >>> with profiler.phase('spread'):
+    ...     profiler.timed('countermeasures', sum)(range(10))
+    ...     profiler.wrap_rng(np.random.default_rng(0)).random(3).shape
+    45
+    (3,)
+    >>> profiler.end_step()
+    >>> summary = profiler.summary()
+    >>> list(summary['phases']), summary['counters']['rng_draws'], summary['steps']
+    (['countermeasures', 'spread'], 3, 1)
+    >>> 'function calls' in profiler.profile_report()
+    True
+    """
+    BACKENDS = ('cprofile', 'pyinstrument')
+    COUNTERS = ('edges', 'rng_calls', 'rng_draws', 'net_allocated_blocks')
+    NULL_PHASE = contextlib.nullcontext()
+
+    def __init__(self, enabled=True, profile_step=None, backend='cprofile'):
+        if backend not in self.BACKENDS:
+            raise ValueError('This is not a valid profiler backend.')
+        self.enabled = enabled
+        self.profile_step, self.backend = profile_step, backend
+        self.steps = {}
+        self.current = {}
+        self.phases = []
+        self.nested = []  # time spent in the nested phases of every open phase
+        self.blocks = 0
+        self.profiler = None
+
+    def start_step(self, time_tracker: int):
+        """
+        starts recording a timestep, and the profiler backend if it is the chosen one.
+        :param time_tracker: count of the current year or month
+        """
+        if not self.enabled:
+            return
+        self.current = self.steps.setdefault(time_tracker, {})
+        self.blocks = sys.getallocatedblocks()
+        if time_tracker == self.profile_step:
+            if self.backend == 'pyinstrument':
+                import pyinstrument  # only needed to profile with pyinstrument
+                self.profiler = pyinstrument.Profiler()
+            else:
+                self.profiler = cProfile.Profile()
+            self.profiler.start() if self.backend == 'pyinstrument' else self.profiler.enable()
+
+    def end_step(self):
+        """
+        stops recording the current timestep.
+        """
+        if not self.enabled:
+            return
+        self.count('net_allocated_blocks', sys.getallocatedblocks() - self.blocks)
+        if self.profiler is not None and self.steps.get(self.profile_step) is self.current:
+            self.profiler.stop() if self.backend == 'pyinstrument' else self.profiler.disable()
+
+    def count(self, name: str, value):
+        """
+        adds to a counter of the current timestep.
+        :param name: name of the counter
+        :param value: amount to add
+        """
+        if self.enabled:
+            self.current[name] = self.current.get(name, 0) + value
+
+    def add_time(self, name: str, elapsed: float):
+        """
+        Utility function.
+        adds the time of a phase to the current timestep and takes it out of the phase around it.
+        :param name: name of the phase
+        :param elapsed: seconds the phase took, nested phases included
+        """
+        own = elapsed - self.nested.pop()
+        if self.nested:
+            self.nested[-1] += elapsed
+        if name not in self.phases:
+            self.phases.append(name)
+        self.current[name] = self.current.get(name, 0.0) + own
+
+    @contextlib.contextmanager
+    def timing(self, name: str):
+        """
+        Utility function.
+        times the body of a with statement as a phase.
+        :param name: name of the phase
+        """
+        self.nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def phase(self, name: str):
+        """
+        returns a context manager timing its body as a phase of the current timestep.
+        :param name: name of the phase
+        :return: context manager
+        """
+        return self.timing(name) if self.enabled else self.NULL_PHASE
+
+    def timed(self, name: str, function):
+        """
+        wraps a function so every call is timed as a phase of the current timestep.
+        :param name: name of the phase
+        :param function: function to time
+        :return: the wrapped function, or the function itself if disabled
+        """
+        if not self.enabled:
+            return function
+
+        def timed_function(*args, **kwargs):
+            self.nested.append(0.0)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add_time(name, time.perf_counter() - start)
+        return timed_function
+
+    def wrap_rng(self, rng):
+        """
+        returns a CountingRng of the rng, or the rng itself if disabled.
+        :param rng: numpy Generator, BlockSampler or the numpy.random module to draw from
+        :return: rng to run with
+        """
+        return CountingRng(rng, self) if self.enabled else rng
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        builds a table of the recorded timesteps.
+        :return: dataframe with a 'step' column, the seconds of every phase and every counter
+        """
+        columns = self.phases + [name for name in self.COUNTERS if any(name in step for step in self.steps.values())]
+        profile_df = pd.DataFrame([[step.get(name, 0) for name in columns] for step in self.steps.values()],
+                                  columns=columns)
+        profile_df.insert(0, 'step', list(self.steps))
+        return profile_df
+
+    def summary(self) -> dict:
+        """
+        summarizes the recorded timesteps.
+        :return: dict of the number of 'steps' and 'total' seconds, the 'phases' with their total, mean and max
+        seconds per timestep and share of the total, and the totals of the 'counters'
+        """
+        profile_df = self.to_dataframe()
+        total = float(profile_df[self.phases].to_numpy().sum())
+        phases = {name: {'total': float(profile_df[name].sum()), 'mean': float(profile_df[name].mean()),
+                         'max': float(profile_df[name].max()),
+                         'share': float(profile_df[name].sum() / total) if total else 0.0}
+                  for name in self.phases}
+        counters = {name: int(profile_df[name].sum()) for name in self.COUNTERS if name in profile_df}
+        return {'steps': len(profile_df), 'total': total, 'phases': phases, 'counters': counters,
+                'profile_step': self.profile_step}
+
+    def profile_report(self, limit=20) -> str:
+        """
+        returns the report of the profiled timestep.
+        :param limit: number of functions listed by cProfile, sorted by cumulative time
+        :return: text of the report, empty if no timestep was profiled
+        """
+        if self.profiler is None:
+            return ''
+        if self.backend == 'pyinstrument':
+            return self.profiler.output_text()
+        report = io.StringIO()
+        pstats.Stats(self.profiler, stream=report).sort_stats('cumulative').print_stats(limit)
+        return report.getvalue()
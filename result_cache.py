@@ -0,0 +1,131 @@
+# result_cache.py
+
+"""
+Content addressed cache of simulation results. saturation_main, saturation_ensemble and parallel_ensemble look a
+run up by the hash of everything it depends on before simulating it, and store its results afterwards.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+from checkpoint import Checkpoint
+
+
+class ResultCache:
+    """
+    Content addressed on-disk cache of simulation results. Every entry is one compressed .npz file named after the
+    sha256 key of everything its run depended on, including the state of the rng before the run. An entry keeps the
+    results and the state the run left the rng in, so a hit returns the same arrays and leaves the rng exactly where
+    the run would have. Reading an entry marks it as used, and the least recently used entries are removed once the
+    folder grows past max_bytes.
+
+    :param path: folder of the cache, created if needed
+    :param max_bytes: size cap of the folder
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, path: str, max_bytes=2 ** 30):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def get_key(settings: dict, rng=None) -> str:
+        """
+        hashes the settings of a run and the state of its rng.
+        :param settings: json-able dict of everything the results depend on
+        :param rng: numpy Generator, BlockSampler or the numpy.random module the run draws from, if any
+        :return: sha256 hex digest
+
+        >>> first = ResultCache.get_key({'iterations': 3}, np.random.default_rng(1))
+        >>> first == ResultCache.get_key({'iterations': 3}, np.random.default_rng(1))
+        True
+        >>> first == ResultCache.get_key({'iterations': 3}, np.random.default_rng(2))
+        False
+        """
+        state, arrays = Checkpoint.get_rng_state(rng) if rng is not None else (None, {})
+        digest = hashlib.sha256(json.dumps([ResultCache.FORMAT_VERSION, settings, state], sort_keys=True).encode())
+        for name in sorted(arrays):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+        return digest.hexdigest()
+
+    def get(self, key: str, rng=None):
+        """
+        looks a run up, and on a hit puts the rng into the state the run left it in.
+        :param key: key from get_key
+        :param rng: the rng of the run, of the same kind as when the entry was put
+        :return: (results, meta) of the entry, or None if there is no entry for the key
+
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as path:
+        ...     cache, rng = ResultCache(path), np.random.default_rng(1)
+        ...     key = ResultCache.get_key({'iterations': 3}, rng)
+        ...     miss = cache.get(key, rng=rng)
+        ...     cache.put(key, rng.random(3), rng=rng, time_frame='year')
+        ...     after = rng.random()
+        ...     rng = np.random.default_rng(1)
+        ...     results, meta = cache.get(key, rng=rng)
+        >>> miss, meta['time_frame'], bool((results == np.random.default_rng(1).random(3)).all()), rng.random() == after
+        (None, 'year', True, True)
+        """
+        entry = f'{self.path}/{key}.npz'
+        try:
+            with np.load(entry, allow_pickle=False) as entry_file:
+                arrays = {name: entry_file[name] for name in entry_file.files}
+            os.utime(entry)  # marks the entry as the most recently used
+        except FileNotFoundError:
+            return None
+        meta = json.loads(arrays.pop('meta').item())
+        if rng is not None and meta['rng'] is not None:
+            Checkpoint.set_rng_state(rng, meta['rng'], arrays)
+        return arrays['results'], meta
+
+    def put(self, key: str, results: np.ndarray, rng=None, **meta):
+        """
+        stores the results of a run and the state it left its rng in, then evicts entries past the size cap.
+        :param key: key from get_key
+        :param results: array of results
+        :param rng: the rng of the run, after the run
+        :param meta: json-able values to keep with the results
+        """
+        state, arrays = Checkpoint.get_rng_state(rng) if rng is not None else (None, {})
+        meta = dict(meta, version=self.FORMAT_VERSION, rng=state)
+        with open(f'{self.path}/{key}.npz.tmp', 'wb') as entry_file:
+            np.savez_compressed(entry_file, meta=np.array(json.dumps(meta)), results=results, **arrays)
+        os.replace(f'{self.path}/{key}.npz.tmp', f'{self.path}/{key}.npz')
+        self.evict()
+
+    def evict(self):
+        """
+        removes the least recently used entries until the folder is no larger than max_bytes.
+
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as path:
+        ...     cache = ResultCache(path, max_bytes=3000)
+        ...     for key in 'abc':
+        ...         cache.put(key, np.random.default_rng(0).random(100))
+        ...     sorted(os.listdir(path))
+        ['b.npz', 'c.npz']
+        """
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npz'):
+                entry_stat = entry.stat()
+                entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, entry.path))
+        total = sum(size for used, size, entry in entries)
+        for used, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(entry)
+            total -= size
+
+    def clear(self):
+        """
+        removes every entry.
+        """
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npz'):
+                os.remove(entry.path)
@@ -0,0 +1,178 @@
+# run_modes.py
+
+"""
+Registry of the run modes the simulation can use.
+Every mode is a RunMode holding the scalar kernels of the object model and the array kernels of the
+vectorized engine. saturation_main resolves the mode once per run, and new interventions can be added with
+register_run_mode without touching the engines.
+
+The built-in modes ('Baseline', 'Poison ToH', 'Population-Based Countermeasures', 'Quarantine', 'All') are
+registered by run_simulation.py, which defines the object model kernels and imports the vectorized ones, so they can
+be looked up by name once run_simulation (or anything that imports it) has been imported. This module imports
+neither engine, both engines import it.
+
+MODEL_CONSTANTS holds the constants the kernels of both engines read on every call, so a run can be made with other
+values through set_model_constants, as parameter_sweep.py does, without editing the kernels.
+"""
+
+
+class RunMode:
+    """
+    Strategy object for one run mode. It holds the kernels the engines call for the mode, so a run looks the mode up
+    once instead of comparing run_mode strings on every edge. A kernel left as None means the mode is not available
+    for that model or engine. Modes are registered and looked up with register_run_mode and get_run_mode.
+
+    :param name: name the mode is selected by
+    :param annual: scalar kernel of the annual model, called for every edge as
+    annual(county, net_neighbors, probability, ToH_modifier, quarantine_list, rng). Returns the saturation the
+    neighbor passes on to the county.
+    :param annual_vectorized: array kernel of the annual model, called for every batch of edges as
+    annual_vectorized(county_sat, neighbor_sat, neighbor_popdense, probability, ToH_modifier, dst, quarantined, rng)
+    :param countermeasures: scalar kernels of the life cycle model, each called in order for every edge as
+    countermeasure(edge_weights, county, neighbor, rng). An empty tuple runs no countermeasures.
+    :param countermeasures_vectorized: array kernels of the life cycle model, each called in order for every batch
+    of edges as countermeasure(state, weights, county, neighbor, edge, interstate, rng)
+    :param aliases: other names that select the mode
+    """
+
+    def __init__(self, name: str, annual=None, annual_vectorized=None, countermeasures=None,
+                 countermeasures_vectorized=None, aliases=()):
+        self.name = name
+        self.annual = annual
+        self.annual_vectorized = annual_vectorized
+        self.countermeasures = None if countermeasures is None else tuple(countermeasures)
+        self.countermeasures_vectorized = None if countermeasures_vectorized is None \
+            else tuple(countermeasures_vectorized)
+        self.aliases = tuple(aliases)
+
+    def supports(self, life_cycle=False, vectorized=False) -> bool:
+        """
+        checks if the mode has the kernels a run needs.
+        :param life_cycle: True for the life cycle model, False for the annual one
+        :param vectorized: True for the vectorized engine, False for the object model
+        :return: True if the mode can run
+
+        >>> RunMode('Scalar Only', annual=print).supports(), RunMode('Scalar Only', annual=print).supports(True)
+        (True, False)
+        """
+        if life_cycle:
+            kernel = self.countermeasures_vectorized if vectorized else self.countermeasures
+        else:
+            kernel = self.annual_vectorized if vectorized else self.annual
+        return kernel is not None
+
+    def __repr__(self):
+        return f'RunMode({self.name!r})'
+
+
+RUN_MODE_REGISTRY = {}
+MODEL_CONSTANTS = {
+    'growth_mean': 0.025, 'growth_std': 0.05,  # annual growth of a county's own saturation
+    'transmission_mean': 0.45, 'transmission_std': 0.8,  # annual probability a neighbor infects a county
+    'toh_scale': 0.02,  # scale of the exponential ToH modifier
+    'quarantine_threshold': 0.5,  # saturation at which an annual county may quarantine
+    'bug_smash_mean': 0.2, 'bug_smash_std': 0.1,  # annual population-based countermeasure
+    'spread_high': 0.1, 'spread_range': 0.05,  # monthly base spread probability lies in [high - range, high]
+    'transfer_low': 0.05, 'transfer_high': 0.15,  # share of the spread SLF that reaches a neighbor
+    'awareness_threshold': 0.5,  # saturation at which the public becomes aware
+    'toh_growth': 0.0025,  # monthly growth of ToH density
+    'pop_kill_mean': 0.35, 'pop_kill_std': 0.1, 'pop_kill_divisor': 5000,  # monthly population-based die off
+    'poison_mean': 50, 'poison_std': 25,  # ToH poisoning divides the ToH density by this
+    'lockdown_threshold': 0.75, 'release_threshold': 0.10,  # saturations that start and end a quarantine
+    'quarantine_weight_low': 2, 'quarantine_weight_high': 5,  # edge weights of a quarantined county
+}
+
+
+def register_run_mode(run_mode: RunMode, replace=False) -> RunMode:
+    """
+    Adds a run mode to the registry under its name and aliases.
+    :param run_mode: the RunMode to add
+    :param replace: allows an existing mode of the same name to be replaced
+    :return: the registered RunMode
+
+    >>> slow = register_run_mode(RunMode('Slow Spread', annual=lambda county, net_neighbors, probability,
+    ...                                  ToH_modifier, quarantine_list, rng: net_neighbors.saturation * 0.1))
+    >>> get_run_mode('Slow Spread') is slow
+    True
+    >>> register_run_mode(RunMode('Slow Spread'))
+    Traceback (most recent call last):
+    ...
+    ValueError: This run mode is already registered.
+    >>> unregister_run_mode('Slow Spread')
+    """
+    names = (run_mode.name,) + run_mode.aliases
+    if not replace and any(name in RUN_MODE_REGISTRY for name in names):
+        raise ValueError('This run mode is already registered.')
+    for name in names:
+        RUN_MODE_REGISTRY[name] = run_mode
+    return run_mode
+
+
+def unregister_run_mode(name: str):
+    """
+    Removes a run mode and all of its aliases from the registry.
+    :param name: name or alias of the mode
+    """
+    run_mode = RUN_MODE_REGISTRY[name]
+    for alias in (run_mode.name,) + run_mode.aliases:
+        RUN_MODE_REGISTRY.pop(alias, None)
+
+
+def get_run_mode(run_mode, life_cycle=False, vectorized=False) -> RunMode:
+    """
+    Resolves a run mode name to its RunMode and checks that it can run the requested model and engine.
+    :param run_mode: name or alias of a registered mode, or a RunMode which is only checked
+    :param life_cycle: True for the life cycle model, False for the annual one
+    :param vectorized: True for the vectorized engine, False for the object model
+    :return: the RunMode
+
+    >>> import run_simulation  # registers the built-in modes
+    >>> get_run_mode('Population-Based', life_cycle=True).name
+    'Population-Based Countermeasures'
+    >>> get_run_mode('Parasitic Wasps')
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid run mode.
+    """
+    if not isinstance(run_mode, RunMode):
+        run_mode = RUN_MODE_REGISTRY.get(run_mode)
+    if run_mode is None or not run_mode.supports(life_cycle=life_cycle, vectorized=False):
+        raise ValueError('This is not a valid run mode.')
+    if vectorized and not run_mode.supports(life_cycle=life_cycle, vectorized=True):
+        raise ValueError('This run mode has no vectorized kernels.')
+    return run_mode
+
+
+def get_run_mode_names() -> list:
+    """
+    Lists the registered run modes, without their aliases.
+    :return: list of run mode names
+
+    >>> import run_simulation  # registers the built-in modes
+    >>> get_run_mode_names()[:5]
+    ['Baseline', 'Poison ToH', 'Population-Based Countermeasures', 'Quarantine', 'All']
+    """
+    return list(dict.fromkeys(run_mode.name for run_mode in RUN_MODE_REGISTRY.values()))
+
+
+def set_model_constants(constants: dict) -> dict:
+    """
+    Changes model constants for every run that follows.
+    :param constants: dict of MODEL_CONSTANTS names and their new values
+    :return: dict of the same names and their previous values, to put them back with
+
+    >>> previous = set_model_constants({'transmission_mean': 0.3})
+    >>> previous, MODEL_CONSTANTS['transmission_mean']
+    ({'transmission_mean': 0.45}, 0.3)
+    >>> set_model_constants(previous)['transmission_mean']
+    0.3
+    >>> set_model_constants({'flamethrower_range': 3.0})
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a model constant.
+    """
+    if any(name not in MODEL_CONSTANTS for name in constants):
+        raise ValueError('This is not a model constant.')
+    previous = {name: MODEL_CONSTANTS[name] for name in constants}
+    MODEL_CONSTANTS.update(constants)
+    return previous
@@ -11,22 +11,61 @@ Uses an accumulated dataframe that inserts rows based on each successive year th
 returns result in a dataframe
 """
 
+import hashlib
+import os
 import pickle
 
 import networkx as nx
+import numpy as np
 from numpy import random
 import pandas as pd
 import json
-from my_classes import MonthQueue, County
-
-
-def saturation_main(run_mode: str, iterations: int, life_cycle=False, prefix=None) -> pd.DataFrame:
+from network_format import get_network_digest, network_exists, read_network, read_network_table
+from checkpoint import Checkpoint
+from my_classes import (BlockSampler, EdgeWeights, MonthQueue, County, CountyTable, NetworkTemplate, SaturationRecord,
+                        SteadyState)
+from profiling import RunProfiler
+from result_cache import ResultCache
+from run_modes import MODEL_CONSTANTS, RunMode, get_run_mode, register_run_mode
+from saturation_sink import SaturationSink
+from vectorized_simulation import (build_network_table, run_arrays, baseline_edges, toh_edges, population_edges,
+                                   quarantine_edges, all_modes_edges, implement_poison_edges, implement_pop_kill_edges,
+                                   implement_quarantine_edges)
+
+ENGINES = ('object', 'vectorized')
+NETWORK_CACHE = {}
+
+
+def saturation_main(run_mode: str, iterations: int, life_cycle=False, prefix=None, engine=None,
+                    update=None, rng=None, sink=None, patience=None, checkpoint=None, resume_from=None,
+                    coef_path=None, cache=None, profiler=None) -> pd.DataFrame:
     """
     Main Function that sequences the order of events when running this file
-    :param run_mode: version of Monte Carlo to run
+    :param run_mode: version of Monte Carlo to run, a name from run_modes.get_run_mode_names or a RunMode
     :param iterations: number of times to run Monte Carlo
     :param life_cycle: a Boolean that decided if saturation is affected by class methods.
     :param prefix: set to call other versions of graphs and handlers, defaults to nothing to return primary objects
+    :param engine: 'object' runs the County object model, 'vectorized' the array engine in vectorized_simulation.py.
+    Defaults to 'object'
+    :param update: update order of the vectorized engine, 'sequential' (default) follows the object model's
+    in-place order and 'synchronous' computes every county from the previous timestep. Either way the vectorized
+    engine matches the object model in distribution, not draw for draw.
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state.
+    Passing a seeded one makes the run replayable.
+    :param sink: folder or SaturationSink to stream the saturations to as the run goes, instead of building the
+    cumulative_df in memory. The closed SaturationSink is returned in place of the df, SaturationSink.read_dataframe
+    reads it back.
+    :param patience: number of steps without any change in saturation (and in the life cycle model, in slf_pop,
+    egg_pop and mated) after which the run stops early and repeats its last saturations for the remaining columns.
+    Runs where every county has died out always stop early.
+    :param checkpoint: file or Checkpoint the full state of the run is saved to every few timesteps
+    :param resume_from: checkpoint file of an earlier call with the same arguments to continue from. rng has to be of
+    the same kind as in that call, its state is restored from the checkpoint.
+    :param coef_path: JSON file of starting coefficients, defaults to data/coef_dict.JSON
+    :param cache: folder or ResultCache of earlier results. A run with the same arguments, coefficients, network,
+    model constants and rng state is read from it instead of simulated, and leaves the rng in the same state.
+    Runs streamed to a sink, checkpointed or profiled are never cached.
+    :param profiler: RunProfiler recording the time of every phase of every timestep, object engine only
 
     :return cumulative_df: pandas dataframe of cumulative years
 
@@ -46,23 +85,202 @@ def saturation_main(run_mode: str, iterations: int, life_cycle=False, prefix=Non
     Traceback (most recent call last):
     ...
     ValueError: This is not a valid run mode.
+    >>> saturation_main('Baseline', 15, engine='quantum')
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid engine.
+    >>> saturation_main('Baseline', 15, engine='vectorized', profiler=RunProfiler())
+    Traceback (most recent call last):
+    ...
+    ValueError: Profiling is only supported by the object engine.
+    >>> df = saturation_main('Baseline', 3, engine='vectorized')
+    >>> df.columns.tolist()
+    ['County', 'year 1', 'year 2', 'year 3', 'year 4']
+    >>> first = saturation_main('All', 4, life_cycle=True, rng=np.random.default_rng(11))
+    >>> first.equals(saturation_main('All', 4, life_cycle=True, rng=np.random.default_rng(11)))
+    True
+    >>> first = saturation_main('Quarantine', 4, rng=BlockSampler(np.random.default_rng(11)))
+    >>> first.equals(saturation_main('Quarantine', 4, rng=BlockSampler(np.random.default_rng(11))))
+    True
+    >>> halved = RunMode('Halved Spread', annual=lambda county, net_neighbors, probability, ToH_modifier,
+    ...                  quarantine_list, rng: baseline_calc(net_neighbors, probability, ToH_modifier) / 2)
+    >>> saturation_main(halved, 2).shape
+    (102, 4)
+    >>> saturation_main(halved, 2, engine='vectorized')
+    Traceback (most recent call last):
+    ...
+    ValueError: This run mode has no vectorized kernels.
+    >>> import tempfile
+    >>> streamed = saturation_main('All', 4, life_cycle=True, rng=np.random.default_rng(11))
+    >>> with tempfile.TemporaryDirectory() as path:
+    ...     sink = saturation_main('All', 4, life_cycle=True, rng=np.random.default_rng(11), sink=path)
+    ...     streamed.equals(SaturationSink.read_dataframe(path))
+    True
+    >>> with tempfile.TemporaryDirectory() as path:
+    ...     rng = np.random.default_rng(11)
+    ...     first = saturation_main('All', 4, life_cycle=True, rng=rng, cache=path)
+    ...     after = rng.random()
+    ...     rng = np.random.default_rng(11)
+    ...     cached = saturation_main('All', 4, life_cycle=True, rng=rng, cache=path)
+    >>> cached.equals(first), cached.equals(streamed), rng.random() == after
+    (True, True, True)
     """
     prefix = '' if prefix is None else prefix
+    engine = 'object' if engine is None else engine
+    if engine not in ENGINES:
+        raise ValueError('This is not a valid engine.')
+    if engine == 'vectorized' and profiler is not None:
+        raise ValueError('Profiling is only supported by the object engine.')
 
     if type(iterations) == int and iterations > 0:
-        CG, schema, neighbor_schema = set_up(prefix=prefix)
-        schema = set_coefficients(schema)
-        cumulative_df = iterate_through_timeframe(CG, schema, iterations,
-                                                  run_mode, life_cycle=life_cycle)
-
+        run_mode = get_run_mode(run_mode, life_cycle=life_cycle, vectorized=engine == 'vectorized')
+        update = 'sequential' if update is None else update
+        cache = ResultCache(cache) if isinstance(cache, str) else cache
+        if cache is not None and sink is None and checkpoint is None and resume_from is None and profiler is None:
+            rng = random if rng is None else rng
+            key = get_run_key('saturation_main', run_mode, iterations, life_cycle, prefix, coef_path, rng,
+                              engine=engine, update=update, patience=patience)
+            cached = cache.get(key, rng=rng)
+            if cached is not None:
+                results, meta = cached
+                return SaturationRecord(meta['names'], results.shape[1], time_frame=meta['time_frame'],
+                                        values=results).to_dataframe()
+        else:
+            cache = None
+        sink = SaturationSink(sink) if isinstance(sink, str) else sink
+        if engine == 'vectorized':  # runs on the network's arrays, no graph or County objects are built
+            table, edges = load_network_table(prefix=prefix, coef_path=coef_path)
+            results, state = run_arrays(table, edges, iterations, run_mode, life_cycle=life_cycle, update=update,
+                                        rng=rng, sink=sink, patience=patience, checkpoint=checkpoint,
+                                        resume_from=resume_from)
+            if sink is None:
+                cumulative_df = SaturationRecord(table.names, results.shape[1], values=results,
+                                                 time_frame='month' if life_cycle else 'year').to_dataframe()
+            else:
+                cumulative_df = sink
+        else:
+            CG, schema, neighbor_schema = load_network(prefix=prefix, coef_path=coef_path)
+            cumulative_df = iterate_through_timeframe(CG, schema, iterations, run_mode, life_cycle=life_cycle,
+                                                      rng=rng, sink=sink, patience=patience, checkpoint=checkpoint,
+                                                      resume_from=resume_from, profiler=profiler)
+        if cache is not None:
+            cache.put(key, cumulative_df.iloc[:, 1:].to_numpy(), rng=rng, names=cumulative_df['County'].tolist(),
+                      time_frame='month' if life_cycle else 'year')
         return cumulative_df
     else:
         raise ValueError('Please use an integer greater than zero.')
 
 
+def saturation_ensemble(run_mode: str, iterations: int, replicates: int, life_cycle=False, prefix=None,
+                        update=None, rng=None, sink=None, patience=None, checkpoint=None, resume_from=None,
+                        coef_path=None, cache=None) -> np.ndarray:
+    """
+    Runs many Monte Carlo replicates of the vectorized engine at once. The network is loaded a single time and every
+    replicate advances in lockstep, with the county state stored as replicate x county arrays.
+    :param run_mode: version of Monte Carlo to run
+    :param iterations: number of years or months in each replicate
+    :param replicates: number of replicates
+    :param life_cycle: a Boolean that decided if saturation is affected by class methods.
+    :param prefix: set to call other versions of graphs and handlers, defaults to nothing to return primary objects
+    :param update: update order of the vectorized engine, defaults to 'sequential'
+    :param rng: numpy Generator to draw from, defaults to the global numpy.random state
+    :param sink: folder or SaturationSink to stream the (replicate, county) saturations of every timestep to,
+    returned closed in place of the array
+    :param patience: number of steps without any change in saturation (and in the life cycle model, in slf_pop,
+    egg_pop and mated), in any replicate, after which the ensemble stops early and repeats its last saturations.
+    Ensembles where every replicate has died out always stop early.
+    :param checkpoint: file or Checkpoint the state of every replicate is saved to every few timesteps
+    :param resume_from: checkpoint file of an earlier call with the same arguments to continue from
+    :param coef_path: JSON file of starting coefficients, defaults to data/coef_dict.JSON
+    :param cache: folder or ResultCache of earlier results, as in saturation_main
+    :return results: array of saturations shaped (replicate, county, time). Counties are in the same order as the
+    'County' column of saturation_main, and time index 0 is the starting saturation.
+
+    >>> results = saturation_ensemble('Quarantine', 4, 25)
+    >>> results.shape
+    (25, 102, 5)
+    >>> first = saturation_ensemble('All', 4, 5, rng=np.random.default_rng(42))
+    >>> bool((first == saturation_ensemble('All', 4, 5, rng=np.random.default_rng(42))).all())
+    True
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as path:
+    ...     sink = saturation_ensemble('All', 4, 5, rng=np.random.default_rng(42), sink=SaturationSink(path, every=2))
+    ...     bool((first[..., ::2] == SaturationSink.read(path)).all())
+    True
+    >>> with tempfile.TemporaryDirectory() as path:
+    ...     runs = [saturation_ensemble('All', 4, 5, rng=np.random.default_rng(42), cache=path) for _ in range(2)]
+    ...     len(os.listdir(path)), bool((runs[1] == first).all())
+    (1, True)
+    >>> saturation_ensemble('Baseline', 4, 0)
+    Traceback (most recent call last):
+    ...
+    ValueError: Please use an integer greater than zero.
+    >>> saturation_ensemble('Parasitic Wasps', 4, 10)
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid run mode.
+    """
+    prefix = '' if prefix is None else prefix
+    update = 'sequential' if update is None else update
+
+    if all(type(count) == int and count > 0 for count in (iterations, replicates)):
+        cache = ResultCache(cache) if isinstance(cache, str) else cache
+        if cache is not None and sink is None and checkpoint is None and resume_from is None:
+            rng = random if rng is None else rng
+            key = get_run_key('saturation_ensemble', get_run_mode(run_mode, life_cycle=life_cycle, vectorized=True),
+                              iterations, life_cycle, prefix, coef_path, rng, replicates=replicates, update=update,
+                              patience=patience)
+            cached = cache.get(key, rng=rng)
+            if cached is not None:
+                return cached[0]
+        else:
+            cache = None
+        table, edges = load_network_table(prefix=prefix, coef_path=coef_path)
+        sink = SaturationSink(sink) if isinstance(sink, str) else sink
+        results, state = run_arrays(table, edges, iterations, run_mode, life_cycle=life_cycle, update=update,
+                                    replicates=replicates, rng=rng, sink=sink, patience=patience,
+                                    checkpoint=checkpoint, resume_from=resume_from)
+        if cache is not None:
+            cache.put(key, results, rng=rng)
+        return results
+    else:
+        raise ValueError('Please use an integer greater than zero.')
+
+
+def get_run_key(api: str, run_mode: RunMode, iterations: int, life_cycle: bool, prefix: str, coef_path, rng,
+                **options) -> str:
+    """
+    Utility function.
+    Keys a run in a ResultCache by everything its results depend on: the arguments, the contents of the coefficient
+    file, the network files, the model constants and the state of the rng before the run.
+    :param api: name of the function whose results are cached
+    :param run_mode: the RunMode of the run, which is keyed by name
+    :param iterations: number of years or months
+    :param life_cycle: a Boolean that decided if saturation is affected by class methods.
+    :param prefix: version of the network
+    :param coef_path: JSON file of starting coefficients, defaults to data/coef_dict.JSON
+    :param rng: numpy Generator, BlockSampler or the numpy.random module, None for runs seeded some other way
+    :param options: any other json-able arguments that change the results
+    :return: sha256 hex digest
+
+    >>> key = get_run_key('saturation_main', get_run_mode('All'), 4, False, 'fast_', None, np.random.default_rng(3))
+    >>> key == get_run_key('saturation_main', get_run_mode('All'), 5, False, 'fast_', None, np.random.default_rng(3))
+    False
+    """
+    coef_path = 'data/coef_dict.JSON' if coef_path is None else coef_path
+    with open(coef_path, 'rb') as coef_file:
+        coefficients = hashlib.sha256(coef_file.read()).hexdigest()
+    settings = {'api': api, 'run_mode': run_mode.name, 'iterations': iterations, 'life_cycle': life_cycle,
+                'prefix': prefix, 'coefficients': coefficients, 'network': get_network_digest(prefix=prefix),
+                'constants': MODEL_CONSTANTS, 'options': options}
+    return ResultCache.get_key(settings, rng)
+
+
 def set_up(prefix=None) -> (nx.Graph, dict, dict):
     """
     return input files created by the illinois_network.py
+    Networks saved in the array format of network_format.py are memory mapped from it, networks that only exist as
+    pickles are unpickled.
     :return CG: Picked graph from illinois_network.py
     :return schema: a dict containing each county and its own class instance
     :return neighbor_schema: a dict containing each county and references the instances of adjacent counties
@@ -86,17 +304,98 @@ def set_up(prefix=None) -> (nx.Graph, dict, dict):
     """
     prefix = '' if prefix is None else prefix
     path = 'data/location'
+    if network_exists(prefix=prefix, path=path):
+        return read_network(prefix=prefix, path=path)
     CG = pickle.load(open(f'{path}/{prefix}IL_graph.dat', 'rb'))
     schema = pickle.load(open(f'{path}/{prefix}graph_handler_counties.dat', 'rb'))
     neighbor_schema = pickle.load(open(f'{path}/{prefix}graph_handler_neighbors.dat', 'rb'))
     return CG, schema, neighbor_schema
 
 
-def set_coefficients(schema: dict) -> dict:
+def load_network(prefix=None, coef_path=None) -> (nx.Graph, dict, dict):
+    """
+    Returns a fresh simulation state of a network, with coefficients set. The pickles are read by set_up and the
+    coefficients applied only the first time a prefix is loaded in this process, or when the contents of the
+    coefficient file change. Later calls clone the counties of the cached NetworkTemplate.
+    :param prefix: set to call other versions of graphs and handlers, defaults to nothing to return primary objects
+    :param coef_path: JSON file of starting coefficients, defaults to data/coef_dict.JSON
+    :return CG: graph of the network, frozen and shared by every call. Runs change edge weights in an EdgeWeights
+    overlay of it.
+    :return schema: a dict of county names and their objects, independent of any other call
+    :return neighbor_schema: a dict of county names and the objects of their adjacent counties
+
+    >>> CG, schema, neighbor_schema = load_network()
+    >>> schema['Cook'].saturation = 1.0
+    >>> other_CG, other_schema, other_neighbor_schema = load_network()
+    >>> other_schema['Cook'].saturation
+    0.2
+    >>> other_schema['Cook'].geometry is schema['Cook'].geometry, other_CG is CG
+    (True, True)
+    """
+    prefix = '' if prefix is None else prefix
+    coef_path = 'data/coef_dict.JSON' if coef_path is None else coef_path
+    with open(coef_path, 'rb') as coef_file:
+        key = (prefix, hashlib.sha256(coef_file.read()).hexdigest())
+    if key not in NETWORK_CACHE:
+        CG, schema, neighbor_schema = set_up(prefix=prefix)
+        NETWORK_CACHE[key] = NetworkTemplate(CG, set_coefficients(schema, coef_path), neighbor_schema)
+    return NETWORK_CACHE[key].new_state()
+
+
+def load_network_table(prefix=None, coef_path=None) -> (CountyTable, dict):
+    """
+    Returns the arrays of a network the vectorized engine runs on, with coefficients set, without building its graph
+    or County objects. Networks in the array format stay memory mapped, only the columns the coefficients change are
+    copied. Networks that only exist as pickles are loaded with load_network and flattened. Either way the arrays are
+    cached like load_network caches its template, and are shared by every call, so they are read-only.
+    :param prefix: set to call other versions of graphs and handlers, defaults to nothing to return primary objects
+    :param coef_path: JSON file of starting coefficients, defaults to data/coef_dict.JSON
+    :return table: CountyTable of the counties, see vectorized_simulation.run_arrays
+    :return edges: dict of the edge arrays of the network
+
+    >>> table, edges = load_network_table()
+    >>> table['saturation'][table.ids['Cook']], load_network_table()[0] is table
+    (0.2, True)
+    >>> isinstance(edges['weights'], np.memmap), table['saturation'].flags.writeable
+    (True, False)
+    """
+    prefix = '' if prefix is None else prefix
+    coef_path = 'data/coef_dict.JSON' if coef_path is None else coef_path
+    with open(coef_path, 'rb') as coef_file:
+        key = ('table', prefix, hashlib.sha256(coef_file.read()).hexdigest())
+    if key not in NETWORK_CACHE:
+        if network_exists(prefix=prefix, path='data/location'):
+            table, edges = read_network_table(prefix=prefix, path='data/location')
+            with open(coef_path) as coef_file:
+                coef_dict = json.load(coef_file)
+            for atr in {atr for coefficients in coef_dict.values() for atr in coefficients} & set(table.columns):
+                column = np.array(table[atr])
+                for coef_county, coefficients in coef_dict.items():
+                    if atr in coefficients and coef_county in table.ids:
+                        column[table.ids[coef_county]] = coefficients[atr]
+                column.flags.writeable = False
+                table[atr] = column
+        else:
+            CG, schema, neighbor_schema = load_network(prefix=prefix, coef_path=coef_path)
+            table, edges = build_network_table(CG, schema)
+        NETWORK_CACHE[key] = table, edges
+    return NETWORK_CACHE[key]
+
+
+def clear_network_cache():
+    """
+    Drops every cached network, so the next load_network or load_network_table call reads the files again.
+    Needed after the network files of a prefix are rebuilt in the same process.
+    """
+    NETWORK_CACHE.clear()
+
+
+def set_coefficients(schema: dict, coef_path=None) -> dict:
     """
       Sets coefficients for the class attributes
       Changes the attributes within the schema
       :param schema: handler for dictionary
+      :param coef_path: JSON file of starting coefficients, defaults to data/coef_dict.JSON
       :return: handler but updated
 
       >>> class County:
@@ -116,7 +415,8 @@ def set_coefficients(schema: dict) -> dict:
       >>> any(hasattr(county, 'toh') for county in updated_schema.values())
       True
       """
-    coef_dict = open('data/coef_dict.JSON')
+    coef_path = 'data/coef_dict.JSON' if coef_path is None else coef_path
+    coef_dict = open(coef_path)
     coef_dict = json.load(coef_dict)
     for coef_county in coef_dict:
         for attribute in coef_dict[coef_county]:
@@ -128,7 +428,9 @@ def set_coefficients(schema: dict) -> dict:
 
 
 def iterate_through_timeframe(CG: nx.Graph, schema: dict, iterations: int,
-                              run_mode='Baseline', life_cycle=False) -> pd.DataFrame:
+                              run_mode='Baseline', life_cycle=False, rng=None, edge_weights=None,
+                              sink=None, patience=None, checkpoint=None, resume_from=None,
+                              profiler=None) -> pd.DataFrame:
     """
     Takes the initial schema and iterates it through a number of years or months
     :param CG: graph of Illinois network
@@ -136,24 +438,126 @@ def iterate_through_timeframe(CG: nx.Graph, schema: dict, iterations: int,
     :param iterations: number of years or months
     :param run_mode: whether it is baseline mode or another format
     :param life_cycle: determines the model uses the County class methods to fluctuate the levels of SLF
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+    :param edge_weights: EdgeWeights overlay the run changes instead of CG, defaults to a fresh overlay of CG
+    :param sink: SaturationSink the saturations are streamed to in place of a SaturationRecord. It is returned closed
+    instead of the df.
+    :param patience: number of steps without any change in saturation (and in the life cycle model, in slf_pop,
+    egg_pop and mated) after which the run stops early. The run always stops once every county has died out, the
+    remaining timesteps repeat the last saturations either way.
+    :param checkpoint: file or Checkpoint the full state of the run is saved to every few timesteps
+    :param resume_from: checkpoint file of the same run to continue from. The schema and CG are those of a fresh
+    load_network, and rng has to be of the same kind as the one the checkpoint was saved with (its seed does not
+    matter). The resumed run finishes exactly as the original one would have.
+    :param profiler: RunProfiler recording the time of the 'neighbors', 'life_cycle', 'spread', 'countermeasures',
+    'bookkeeping' and 'dataframe' phases of every timestep, with the edges visited, rng draws and allocations.
+    The results are the same with or without it.
     :return cumulative_df: a df that contains the full data for all counties in a run simulation
+
+    >>> CG, schema, neighbor_schema = load_network(prefix='fast_')
+    >>> for county in schema.values():
+    ...     county.saturation = county.slf_pop = county.egg_pop = county.mated = 0.0
+    >>> df = iterate_through_timeframe(CG, schema, 24, 'All', life_cycle=True)
+    >>> df.shape, float(df.iloc[:, 1:].to_numpy().max())
+    ((102, 26), 0.0)
+    >>> import tempfile
+    >>> full = saturation_main('All', 14, life_cycle=True, prefix='fast_', rng=np.random.default_rng(8))
+    >>> with tempfile.TemporaryDirectory() as folder:
+    ...     CG, schema, neighbor_schema = load_network(prefix='fast_')
+    ...     part = iterate_through_timeframe(CG, schema, 9, 'All', life_cycle=True, rng=np.random.default_rng(8),
+    ...                                      checkpoint=Checkpoint(f'{folder}/run.npz', every=3))
+    ...     CG, schema, neighbor_schema = load_network(prefix='fast_')
+    ...     iterate_through_timeframe(CG, schema, 14, 'All', life_cycle=True, rng=np.random.default_rng(8),
+    ...                               resume_from=f'{folder}/run.npz')
+    Traceback (most recent call last):
+    ...
+    ValueError: This checkpoint does not belong to this run.
+    >>> with tempfile.TemporaryDirectory() as folder:
+    ...     CG, schema, neighbor_schema = load_network(prefix='fast_')
+    ...     part = iterate_through_timeframe(CG, schema, 14, 'All', life_cycle=True, rng=np.random.default_rng(8),
+    ...                                      checkpoint=Checkpoint(f'{folder}/run.npz', every=10))
+    ...     CG, schema, neighbor_schema = load_network(prefix='fast_')
+    ...     resumed = iterate_through_timeframe(CG, schema, 14, 'All', life_cycle=True, rng=np.random.default_rng(0),
+    ...                                         resume_from=f'{folder}/run.npz')
+    >>> resumed.equals(full)
+    True
+    >>> CG, schema, neighbor_schema = load_network(prefix='fast_')
+    >>> profiler = RunProfiler()
+    >>> profiled = iterate_through_timeframe(CG, schema, 14, 'All', life_cycle=True, rng=np.random.default_rng(8),
+    ...                                      profiler=profiler)
+    >>> summary = profiler.summary()
+    >>> profiled.equals(full), summary['steps'], summary['counters']['edges'] == 14 * 2 * CG.number_of_edges()
+    (True, 15, True)
+    >>> sorted(summary['phases'])
+    ['bookkeeping', 'countermeasures', 'dataframe', 'life_cycle', 'neighbors', 'spread']
     """
-    cumulative_df = make_starting_df(schema, time_frame='month') if life_cycle \
-        else make_starting_df(schema, time_frame='year')
+    rng = random if rng is None else rng
+    profiler = RunProfiler(enabled=False) if profiler is None else profiler
+    edge_weights = EdgeWeights.of(CG) if edge_weights is None else edge_weights
+    steady_state = SteadyState(patience=patience)
+    checkpoint = Checkpoint(checkpoint) if isinstance(checkpoint, str) else checkpoint
+    if sink is not None and (checkpoint is not None or resume_from is not None):
+        raise ValueError('Checkpoints are not supported when streaming to a sink.')
+    run = {'engine': 'object', 'run_mode': get_run_mode(run_mode, life_cycle=life_cycle).name,
+           'life_cycle': life_cycle, 'iterations': iterations, 'counties': list(schema)}
+    time_frame = 'month' if life_cycle else 'year'
+    if sink is None:
+        saturation_record = SaturationRecord.from_schema(schema, iterations + 1, time_frame=time_frame)
+    else:
+        saturation_record = sink.open(list(schema), time_frame=time_frame)
+        saturation_record.record(1, [schema[county].saturation for county in schema])
     time_tracker = 1
     months_queue = MonthQueue()
-    for _ in range(iterations):
+    if resume_from is not None:
+        state = Checkpoint.load(resume_from, run=run)
+        CountyTable(list(schema), state['columns']).to_counties(schema.values())
+        edge_weights.weights = state['weights'].copy()
+        time_tracker, months_queue.position = state['time_tracker'], state['month_position']
+        saturation_record.values[:, :time_tracker] = state['results']  # the timesteps already run
+        saturation_record.filled = time_tracker
+        steady_state.unchanged, steady_state.previous = state['unchanged'], state['previous']
+        Checkpoint.set_rng_state(rng, state['rng'], state['arrays'])
+    step_rng = profiler.wrap_rng(rng)  # checkpoints keep the state of rng itself
+    profiler.start_step(time_tracker)
+    with profiler.phase('neighbors'):
+        neighbor_obj = find_neighbor_status(CG, schema)  # the network never changes shape, so this is done once
+    profiler.end_step()
+    edges = sum(len(neighbors) for neighbors in neighbor_obj.values())
+    for _ in range(iterations + 1 - time_tracker):
         current_month = months_queue.rotate()
         time_tracker += 1
+        profiler.start_step(time_tracker)
 
         if life_cycle:
-            handle_life_cycle_for_county(current_month, schema)
-
-        neighbor_obj = find_neighbor_status(CG, schema)  # Used to make both timeframes work correctly
-        schema, cumulative_df = calculate_changes(CG, neighbor_obj, schema, cumulative_df, time_tracker, current_month,
-                                                  run_mode, life_cycle=life_cycle)
-
-    return cumulative_df
+            with profiler.phase('life_cycle'):
+                handle_life_cycle_for_county(current_month, schema, rng=step_rng)
+
+        with profiler.phase('spread'):
+            schema, saturation_record = calculate_changes(CG, neighbor_obj, schema, saturation_record, time_tracker,
+                                                          current_month, run_mode, life_cycle=life_cycle,
+                                                          rng=step_rng, edge_weights=edge_weights, profiler=profiler)
+        profiler.count('edges', edges)
+        with profiler.phase('bookkeeping'):
+            counties = [schema[name] for name in neighbor_obj]  # the order calculate_changes records them in
+            saturations = [county.saturation for county in counties]
+            populations = ([[getattr(county, atr) for county in counties] for atr in ('slf_pop', 'egg_pop', 'mated')]
+                           if life_cycle else [])
+            settled = steady_state.update(saturations, *populations)
+            if settled:
+                SteadyState.fill(saturation_record, time_tracker, iterations + 1, saturations)
+            elif checkpoint is not None and checkpoint.due(time_tracker):
+                checkpoint.save(run, time_tracker,
+                                CountyTable.from_counties(schema.values(), Checkpoint.COLUMNS).columns,
+                                saturation_record.values, rng, weights=edge_weights.weights,
+                                month_position=months_queue.position, steady_state=steady_state)
+        profiler.end_step()
+        if settled:
+            break
+
+    with profiler.phase('dataframe'):
+        if sink is not None:
+            return sink.close()
+        return saturation_record.to_dataframe()
 
 
 def make_starting_df(schema: dict, time_frame=None) -> pd.DataFrame:
@@ -214,9 +618,7 @@ def get_object(name: str, schema: dict) -> County:
     >>> get_object('Travis', counties) is None
     True
     """
-    for county in schema:
-        if county == name:
-            return schema[county]
+    return schema.get(name)
 
 
 def find_neighbor_status(CG: nx.Graph, schema: dict) -> dict:
@@ -262,8 +664,9 @@ def find_neighbor_status(CG: nx.Graph, schema: dict) -> dict:
     return neighbor_obj
 
 
-def calculate_changes(CG: nx.Graph, neighbor_obj: dict, schema: dict, cumulative_df: pd.DataFrame,
-                      time_tracker: int, current_month=None, run_mode=None, life_cycle=False) -> (dict, pd.DataFrame):
+def calculate_changes(CG: nx.Graph, neighbor_obj: dict, schema: dict, saturation_record: SaturationRecord,
+                      time_tracker: int, current_month=None, run_mode=None,
+                      life_cycle=False, rng=None, edge_weights=None, profiler=None) -> (dict, SaturationRecord):
     """
     Models interactions between every county and every county it is adjacent to
     This is a yearly interaction
@@ -272,21 +675,26 @@ def calculate_changes(CG: nx.Graph, neighbor_obj: dict, schema: dict, cumulative
     :param CG: graph of county network
     :param neighbor_obj: the adjacent object
     :param schema: dict of county names and objects
-    :param cumulative_df: a dataframe that stores saturation levels from year to year for each county
+    :param saturation_record: stores saturation levels from year to year for each county
     :param time_tracker: count of current year or month
     :param run_mode: type of simulation
     :param life_cycle: Boolean determining if the annually or monthly simulation runs
     :param current_month: current month in MonthQueue() if passed. Defaults to None.
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+    :param edge_weights: EdgeWeights overlay of the run, defaults to a fresh overlay of CG
+    :param profiler: RunProfiler timing the countermeasures of the life cycle model, if any
     :return schema: a dict of counties and their objects
-    :return cumulative_df: the df used to record, store, and access saturation rates
+    :return saturation_record: the record used to store and access saturation rates
 
     # going to have trouble doctesting this because it's not deterministic
     """
     run_mode = 'Baseline' if run_mode is None else run_mode
+    rng = random if rng is None else rng
     if life_cycle:
-        schema, cumulative_df = calc_infest(CG, neighbor_obj, schema, cumulative_df, time_tracker, current_month,
-                                            run_mode=run_mode)
-        return schema, cumulative_df
+        schema, saturation_record = calc_infest(CG, neighbor_obj, schema, saturation_record, time_tracker,
+                                                current_month, run_mode=run_mode, rng=rng, edge_weights=edge_weights,
+                                                profiler=profiler)
+        return schema, saturation_record
     else:
 
         saturation_collector = []
@@ -294,21 +702,21 @@ def calculate_changes(CG: nx.Graph, neighbor_obj: dict, schema: dict, cumulative
         for county_net in neighbor_obj:
             all_new_saturations = 0
             county = get_object(county_net, schema)
-            county.saturation = county.saturation + (random.normal(0.025, 0.05) *
+            county.saturation = county.saturation + (rng.normal(MODEL_CONSTANTS['growth_mean'],
+                                                                MODEL_CONSTANTS['growth_std']) *
                                                      (county.saturation * county.toh_density))
             all_new_saturations = process_net_neighbors(all_new_saturations, county, county_net, neighbor_obj,
-                                                        quarantine_list, run_mode)
+                                                        quarantine_list, run_mode, rng=rng)
             all_new_saturations = round(all_new_saturations / (len(neighbor_obj[county_net])), 8) + county.saturation
             all_new_saturations = max(0, min(all_new_saturations, 1))  # keeps all_new_saturations between 0 and 1
             setattr(county, 'saturation', all_new_saturations)  # changes the county instance attribute
             saturation_collector.append(all_new_saturations)  # Adds the saturation to a list
-        cumulative_df.insert(time_tracker, f'year {time_tracker}', saturation_collector, True)
-        # adds list to df
-        return schema, cumulative_df
+        saturation_record.record(time_tracker, saturation_collector)  # fills the column for this year
+        return schema, saturation_record
 
 
 def process_net_neighbors(all_new_saturations: float, county: County, county_net: County,
-                          neighbor_obj: dict, quarantine_list: set, run_mode: str) -> float:
+                          neighbor_obj: dict, quarantine_list: set, run_mode: str, rng=None) -> float:
     """
     calculates neighbor county influence on the target county and
     generates random statistics for ToH and base probability
@@ -319,6 +727,7 @@ def process_net_neighbors(all_new_saturations: float, county: County, county_net
     :param neighbor_obj: the total list of neighbor objects
     :param quarantine_list: the set of quarantining counties
     :param run_mode: a string defining run_mode
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
     :return all_new_saturations: float of the accumulated all new saturations
 
     >>> class County:
@@ -339,27 +748,32 @@ def process_net_neighbors(all_new_saturations: float, county: County, county_net
     True
 
     """
+    rng = random if rng is None else rng
+    kernel = get_run_mode(run_mode).annual
+    transmission_mean, transmission_std = MODEL_CONSTANTS['transmission_mean'], MODEL_CONSTANTS['transmission_std']
+    toh_scale = MODEL_CONSTANTS['toh_scale']
     for net_neighbors in neighbor_obj[county_net]:
-        probability = random.normal(0.45, 0.8)
+        probability = rng.normal(transmission_mean, transmission_std)
         ToH_modifier = (net_neighbors.saturation
                         * net_neighbors.toh_density * 100
-                        * random.exponential(0.02))
-        new_saturation = assign_mode(ToH_modifier, county, net_neighbors, probability, quarantine_list, run_mode)
+                        * rng.exponential(toh_scale))
+        new_saturation = kernel(county, net_neighbors, probability, ToH_modifier, quarantine_list, rng)
         all_new_saturations += new_saturation
     return all_new_saturations
 
 
 def assign_mode(ToH_modifier: float, county: County, net_neighbors: County, probability: float,
-                quarantine_list: set, run_mode: str) -> float:
+                quarantine_list: set, run_mode: str, rng=None) -> float:
     """
-    a hub that sends variables to the correct processing function depending on the selected run_mode
+    a hub that sends variables to the annual kernel of the selected run_mode
     catches invalid run modes
     :param ToH_modifier: a modifier that represents the effect ToH have on SLF populations
     :param county: the target county object
     :param net_neighbors: the neighboring county objects
     :param probability: the probability of transmission from one county to another
     :param quarantine_list: the set of counties that have decided to quarantine
-    :param run_mode: the run mode selected as an input variable
+    :param run_mode: the run mode selected as an input variable, a name or a RunMode
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
     :return new_saturation: the new saturation of the target county object.
 
     >>> class County:
@@ -383,20 +797,15 @@ def assign_mode(ToH_modifier: float, county: County, net_neighbors: County, prob
     >>> result_baseline = assign_mode(0.5, Williamson, Ogle, 0.8, set(), 'Baseline')
     >>> isinstance(result_baseline, float)  # Check if the result is a float
     True
+    >>> assign_mode(0.5, Williamson, Ogle, 0.8, set(), 'Parasitic Wasps')
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid run mode.
 
     """
-    if run_mode == 'Baseline':
-        new_saturation = baseline_calc(net_neighbors, probability, ToH_modifier)
-    elif run_mode == 'Poison ToH':
-        new_saturation = ToH_calc(net_neighbors, probability, ToH_modifier)
-    elif run_mode == 'Population-Based Countermeasures':
-        new_saturation = population_calc(county, net_neighbors, probability, ToH_modifier)
-    elif run_mode == 'Quarantine':
-        quarantine_list, new_saturation = quarantine_calc(quarantine_list, net_neighbors, probability, ToH_modifier)
-    elif run_mode == 'All':
-        quarantine_list, new_saturation = all_modes(quarantine_list, county, net_neighbors, probability, ToH_modifier)
-    else:  # catches invalid run modes
-        raise ValueError('This is not a valid run mode.')
+    rng = random if rng is None else rng
+    new_saturation = get_run_mode(run_mode).annual(county, net_neighbors, probability, ToH_modifier, quarantine_list,
+                                                   rng)
     return new_saturation
 
 
@@ -448,7 +857,8 @@ def ToH_calc(net_neighbors: County, probability: float, ToH_modifier: float) ->
     return new_saturation
 
 
-def population_calc(county: County, net_neighbors: County, probability: float, ToH_modifier: float) -> float:
+def population_calc(county: County, net_neighbors: County, probability: float, ToH_modifier: float,
+                    rng=None) -> float:
     """
     A modification of the baseline that models what may happen if citizen of a county
     were inclined and educated to help eliminate SLF and their eggs
@@ -456,6 +866,7 @@ def population_calc(county: County, net_neighbors: County, probability: float, T
     :param net_neighbors: the object of the neighboring county
     :param probability: random probability of transmission based on a normal distribution
     :param ToH_modifier: random probability that transmission will be influenced by ToH
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
     :return new_infection: the new infection level from neighbor to target county
 
     >>> class County:
@@ -472,14 +883,15 @@ def population_calc(county: County, net_neighbors: County, probability: float, T
     >>> new_infection > 0
     True
     """
-    bug_smash = random.normal(0.2, 0.1) * 0.01
+    rng = random if rng is None else rng
+    bug_smash = rng.normal(MODEL_CONSTANTS['bug_smash_mean'], MODEL_CONSTANTS['bug_smash_std']) * 0.01
     new_saturation = (net_neighbors.saturation * probability + ToH_modifier * net_neighbors.saturation
                       - (county.saturation * net_neighbors.popdense_sqmi * bug_smash))
     return new_saturation
 
 
 def quarantine_calc(quarantine_list: set, net_neighbors: County,
-                    probability: float, ToH_modifier: float) -> (set, float):
+                    probability: float, ToH_modifier: float, rng=None) -> (set, float):
     """
     Modification of baseline that models what would happen if
     a county, reaching 50% of saturation, had a 50% chance of quarantining with 100% efficacy
@@ -488,6 +900,7 @@ def quarantine_calc(quarantine_list: set, net_neighbors: County,
     :param net_neighbors: neighbor object
     :param probability: probability on a normal distribution of transmission from one county to another
     :param ToH_modifier: probability of ToH influencing saturation
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
     :return quarantine_list: the new set of quarantining counties, possibly with the target added.
     :return new_infection: the new infection rate from a neighbor to a target county
 
@@ -503,7 +916,9 @@ def quarantine_calc(quarantine_list: set, net_neighbors: County,
     >>> isinstance(new_infection, float)
     True
     """
-    if (net_neighbors in quarantine_list) or (net_neighbors.saturation > 0.5 and random.choice([True, False])):
+    rng = random if rng is None else rng
+    if (net_neighbors in quarantine_list) or (net_neighbors.saturation > MODEL_CONSTANTS['quarantine_threshold']
+                                              and rng.choice([True, False])):
         new_saturation = 0
         quarantine_list.add(net_neighbors)
     else:
@@ -512,7 +927,7 @@ def quarantine_calc(quarantine_list: set, net_neighbors: County,
 
 
 def all_modes(quarantine_list: set, county: County, net_neighbors: County, probability: float,
-              ToH_modifier: float) -> (set, float):
+              ToH_modifier: float, rng=None) -> (set, float):
     """
     A variation of baseline that includes all interventions modeled in all other functions
 
@@ -521,6 +936,7 @@ def all_modes(quarantine_list: set, county: County, net_neighbors: County, proba
     :param net_neighbors: neighboring county object
     :param probability: the probabiltiy, on a normal distribution, that one county infects a neighbor
     :param ToH_modifier: the probabilty that extant ToH populations will influence saturation growth
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
     :return quarantine_list: the new set of quarantining counties, possibly with the target added.
     :return new_infection: the new infection rate from a neighbor to a target county
 
@@ -541,12 +957,13 @@ def all_modes(quarantine_list: set, county: County, net_neighbors: County, proba
     >>> isinstance(quarantine_list, set)
     True
     """
-
-    if (net_neighbors in quarantine_list) or (net_neighbors.saturation > 0.5 and random.choice([True, False])):
+    rng = random if rng is None else rng
+    if (net_neighbors in quarantine_list) or (net_neighbors.saturation > MODEL_CONSTANTS['quarantine_threshold']
+                                              and rng.choice([True, False])):
         new_saturation = 0
         quarantine_list.add(net_neighbors)
     else:
-        bug_smash = random.normal(0.2, 0.1) * 0.01
+        bug_smash = rng.normal(MODEL_CONSTANTS['bug_smash_mean'], MODEL_CONSTANTS['bug_smash_std']) * 0.01
         ToH_modifier = -ToH_modifier
         new_saturation = (net_neighbors.saturation * probability +
                           ToH_modifier * net_neighbors.saturation -
@@ -554,7 +971,7 @@ def all_modes(quarantine_list: set, county: County, net_neighbors: County, proba
     return quarantine_list, new_saturation
 
 
-def calculate_spread_prob(CG: nx.Graph, county: County, neighbor: County) -> float:
+def calculate_spread_prob(edge_weights: EdgeWeights, county: County, neighbor: County, rng=None) -> float:
     """
     returns the likelyhood of a saturation spreading from one county to another.
     the spread is based on:
@@ -563,35 +980,40 @@ def calculate_spread_prob(CG: nx.Graph, county: County, neighbor: County) -> flo
         - The weight of edge connecting the two counties
         - The current traffic level of the month
 
-    :param CG: graph of county network
+    :param edge_weights: EdgeWeights overlay of the county network
     :param county: the source node the saturation is spreading from
     :param neighbor: target node saturation might spread to.
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
     :return spread_prob: probability of spread, between 0.0 and 1.0
     >>> CG = nx.Graph()
     >>> county_1 = County('Main County', slf_pop=.4, traffic_level=.8)
     >>> county_2 = County('Neighbor County', toh_density=.8, tree_density=.2)
     >>> CG.add_nodes_from([county_1, county_2])
     >>> CG.add_edge(county_1, county_2, weight=1.0)
-    >>> prob = calculate_spread_prob(CG, county_1, county_2)
+    >>> prob = calculate_spread_prob(EdgeWeights(CG), county_1, county_2)
     >>> prob < 0.6
     True
 
     """
-    edge_weight = CG[county][neighbor]['weight']
-    base_prob = random.uniform(0.1, 0.05) * county.slf_pop / (neighbor.toh_density + neighbor.tree_density)
+    rng = random if rng is None else rng
+    edge_weight = edge_weights[county, neighbor]
+    # uniform(high, high - range) as the legacy sampler computes it, Generator.uniform refuses a high below low
+    base_prob = ((MODEL_CONSTANTS['spread_high'] - MODEL_CONSTANTS['spread_range'] * rng.random()) * county.slf_pop
+                 / (neighbor.toh_density + neighbor.tree_density))
     spread_prob = (base_prob / edge_weight / county.traffic_level)
 
     spread_prob = max(0.0, min(spread_prob, 1.0))
     return spread_prob
 
 
-def spread_infest(county: County, neighbor, spread_prob, current_month=None):
+def spread_infest(county: County, neighbor, spread_prob, current_month=None, rng=None):
     """
     updates the saturation level of a neighboring county to source county
     :param county: source node that saturation spreads from
     :param neighbor: target node the saturation will spread to
     :param spread_prob: probability that the saturation will spread
     :param current_month:
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
     >>> CG = nx.Graph()
     >>> months_queue = MonthQueue()
     >>> prob = 1.0
@@ -607,8 +1029,9 @@ def spread_infest(county: County, neighbor, spread_prob, current_month=None):
     >>> county_2.saturation >= 0
     True
     """
+    rng = random if rng is None else rng
     max_transferable = county.slf_pop * spread_prob
-    variability = random.uniform(0.05, 0.15)
+    variability = rng.uniform(MODEL_CONSTANTS['transfer_low'], MODEL_CONSTANTS['transfer_high'])
 
     transfer_amount = max_transferable * variability
 
@@ -620,48 +1043,58 @@ def spread_infest(county: County, neighbor, spread_prob, current_month=None):
         neighbor.stabilize_levels()
 
 
-def implement_counter_measures(CG: nx.Graph, county: County, neighbor: County, run_mode: str):
+def implement_counter_measures(edge_weights: EdgeWeights, county: County, neighbor: County, run_mode: str,
+                               rng=None):
     """
-    Manipulates saturation and egg levels based on run mode
-    :param CG: graph of county network
+    Manipulates saturation and egg levels by running the countermeasures of the run mode in order
+    :param edge_weights: EdgeWeights overlay of the county network
     :param county: county node being assessed
     :param neighbor: node adjacent to county node
-    :param run_mode: Type of simulation to run
+    :param run_mode: Type of simulation to run, a name or a RunMode
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
     >>> CG = nx.Graph()
     >>> county_1 = County('Some County', saturation=0.9, egg_pop=1.0, toh_density=0.5, popdense_sqmi=1000,
     ... public_awareness=True, quarantine=True)
     >>> county_2 = County('Another County', saturation=0.4, egg_pop=0.5, toh_density=0.3)
     >>> CG.add_nodes_from([county_1, county_2])
     >>> CG.add_edge(county_1, county_2, weight=1.0, rel = 'interstate')
-    >>> implement_counter_measures(CG, county_2, county_1, 'Poison ToH')
+    >>> edge_weights = EdgeWeights(CG)
+    >>> implement_counter_measures(edge_weights, county_2, county_1, 'Poison ToH')
     >>> county_2.saturation <= 1
     True
-    >>> implement_counter_measures(CG, county_1, county_2, 'Population-Based')
+    >>> implement_counter_measures(edge_weights, county_1, county_2, 'Population-Based')
     >>> county_1.saturation <= 1
     True
-    >>> weight = CG[county_1][county_2]['weight']
-    >>> implement_counter_measures(CG, county_1, county_2, 'Quarantine')
-    >>> new_weight = CG[county_1][county_2]['weight']
+    >>> weight = edge_weights[county_1, county_2]
+    >>> implement_counter_measures(edge_weights, county_1, county_2, 'Quarantine')
+    >>> new_weight = edge_weights[county_1, county_2]
     >>> new_weight > weight
     True
 
     """
-    if run_mode == 'Poison ToH':
-        county.toh_trigger = True if county.public_awareness else county.toh_trigger
-        if county.toh_trigger:
-            variance = random.normal(50, 25)
-            county.die_off(mortality_rate=county.toh_density/variance)
-    elif run_mode in ('Population-Based', 'Quarantine'):
-        implement_pop_kill(county, neighbor)
-    elif run_mode == 'All':
-        implement_counter_measures(CG, county, neighbor, run_mode='Poison ToH')
-        implement_counter_measures(CG, county, neighbor, run_mode='Quarantine')
+    rng = random if rng is None else rng
+    for countermeasure in get_run_mode(run_mode, life_cycle=True).countermeasures:
+        countermeasure(edge_weights, county, neighbor, rng)
 
-    if run_mode == 'Quarantine':
-        implement_quarantine(CG, county, neighbor)
 
+def implement_poison_toh(county: County, rng=None):
+    """
+    Once a county has become publicly aware, poisons its ToH, which kills off SLF in proportion to the ToH density.
+    :param county: County obj being assessed
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+    >>> county_1 = County('Dog County', slf_pop=0.6, toh_density=0.5, public_awareness=True)
+    >>> implement_poison_toh(county_1)
+    >>> county_1.toh_trigger
+    True
+    """
+    rng = random if rng is None else rng
+    county.toh_trigger = True if county.public_awareness else county.toh_trigger
+    if county.toh_trigger:
+        variance = rng.normal(MODEL_CONSTANTS['poison_mean'], MODEL_CONSTANTS['poison_std'])
+        county.die_off(mortality_rate=county.toh_density/variance)
 
-def implement_pop_kill(county: County, neighbor: County):
+
+def implement_pop_kill(county: County, neighbor: County, rng=None):
     """
     Toggles county's public_awareness if they reach certain thresholds.
     If the county is aware, triggers die_off and egg removal based off population density.
@@ -669,7 +1102,7 @@ def implement_pop_kill(county: County, neighbor: County):
     Can also toggle neighbor's public awareness at certain thresholds.
     :param county: County obj being assessed
     :param neighbor: neighboring county
-    :param prob: Probability generated for randomizing public awareness
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
     >>> county_1 = County('Dog County', slf_pop=0.6, egg_pop=1.0, popdense_sqmi=5000, public_awareness=True)
     >>> county_2 = County('Cat County', slf_pop=0.3, egg_pop=.50, popdense_sqmi=3000)
     >>> implement_pop_kill(county_1, county_2)
@@ -678,11 +1111,13 @@ def implement_pop_kill(county: County, neighbor: County):
     >>> isinstance(county_2.public_awareness, bool)
     True
     """
+    rng = random if rng is None else rng
     egg_to_fly_ratio = 3.0
-    prob = random.normal(0.35, 0.1)
-    mortality_rate = prob * county.popdense_sqmi/5000
+    prob = rng.normal(MODEL_CONSTANTS['pop_kill_mean'], MODEL_CONSTANTS['pop_kill_std'])
+    mortality_rate = prob * county.popdense_sqmi/MODEL_CONSTANTS['pop_kill_divisor']
 
-    county.public_awareness = False if county.saturation <= .5 else county.public_awareness
+    county.public_awareness = (False if county.saturation <= MODEL_CONSTANTS['awareness_threshold']
+                               else county.public_awareness)
     if neighbor.quarantine:
         county.public_awareness = True if county.saturation >= neighbor.saturation / 2 else county.public_awareness
     if county.public_awareness:
@@ -694,99 +1129,154 @@ def implement_pop_kill(county: County, neighbor: County):
         county.stabilize_levels()
 
 
-def implement_quarantine(CG: nx.Graph, county: County, neighbor: County):
+def implement_quarantine(edge_weights: EdgeWeights, county: County, neighbor: County, rng=None):
     """
     Toggles a county's quarantine once it reaches certain thresholds.
     Toggles neighbor's public awareness if its saturation is half of quarantine
     Changes wieght of edge between county and neighbor if certain conditions are met.
+    The weight is changed in the run's EdgeWeights overlay, the graph itself is never written.
 
-    :param CG: Network Graph
+    :param edge_weights: EdgeWeights overlay of the network graph
     :param county: County node object
     :param neighbor: County node object connected to county by edge.
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
     >>> CG = nx.Graph()
     >>> county_1 = County('The Greatest County', saturation=0.8, quarantine=False)
     >>> county_2 = County('The Worst County', saturation=0.2, quarantine=True, public_awareness=True)
     >>> CG.add_nodes_from([county_1, county_2])
     >>> CG.add_edge(county_1, county_2, weight=1.0)
-    >>> implement_quarantine(CG, county_1, county_2)
+    >>> edge_weights = EdgeWeights(CG)
+    >>> implement_quarantine(edge_weights, county_1, county_2)
     >>> county_1.quarantine
     True
-    >>> implement_quarantine(CG, county_2, county_1)
+    >>> implement_quarantine(edge_weights, county_2, county_1)
     >>> county_2.quarantine
     True
-    >>> isinstance(CG[county_1][county_2]['weight'], float)
-    True
+    >>> isinstance(edge_weights[county_1, county_2], float), CG[county_1][county_2]['weight']
+    (True, 1.0)
     """
-    prob = random.uniform(2, 5)
-    county.quarantine = True if county.saturation >= .75 else county.quarantine
-    county.quarantine = False if county.saturation <= .10 else county.quarantine
+    rng = random if rng is None else rng
+    prob = rng.uniform(MODEL_CONSTANTS['quarantine_weight_low'], MODEL_CONSTANTS['quarantine_weight_high'])
+    county.quarantine = True if county.saturation >= MODEL_CONSTANTS['lockdown_threshold'] else county.quarantine
+    county.quarantine = False if county.saturation <= MODEL_CONSTANTS['release_threshold'] else county.quarantine
     if county.quarantine is True:
         neighbor.public_awareness = True
-        CG[county][neighbor]['weight'] = prob
+        edge_weights[county, neighbor] = prob
     elif county.quarantine is False and neighbor.quarantine is True:
         pass
-    elif CG[county][neighbor]['rel'] == 'interstate':
-        CG[county][neighbor]['weight'] = .25
+    elif edge_weights.is_interstate(county, neighbor):
+        edge_weights[county, neighbor] = .25
     else:
-        CG[county][neighbor]['weight'] = 1.0
+        edge_weights[county, neighbor] = 1.0
 
 
-def handle_life_cycle_for_county(current_month: str, schema: dict):
+def handle_life_cycle_for_county(current_month: str, schema: dict, rng=None):
     """
     Activates different class methods based on the current month
     :param current_month: month from MonthQueue
     :param schema: county names and objects
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
     """
+    rng = random if rng is None else rng
     for name, county in schema.items():
         county.traffic_level = current_month['traffic_level']
         if current_month['month'] in ['May', 'June']:
-            county.hatch_eggs()
+            county.hatch_eggs(rng=rng)
         elif current_month['month'] in ['August', 'September', 'October', 'November', 'December']:
-            county.mate()
+            county.mate(rng=rng)
             if current_month['month'] in ['September', 'October', 'November']:
-                county.lay_eggs()
+                county.lay_eggs(rng=rng)
         elif current_month['month'] in ['January', 'February']:
-            county.die_off()
+            county.die_off(rng=rng)
         county.saturation = max((county.slf_pop + county.egg_pop * 3.0) / 2, county.egg_pop * 3.0, county.slf_pop)
         county.stabilize_levels()
 
 
-def calc_infest(CG: nx.Graph, neighbor_obj: dict, schema: dict, cumulative_df: pd.DataFrame,
-                time_tracker: int, current_month: str, run_mode=None) -> (dict, pd.DataFrame):
+def calc_infest(CG: nx.Graph, neighbor_obj: dict, schema: dict, saturation_record: SaturationRecord,
+                time_tracker: int, current_month: str, run_mode=None, rng=None,
+                edge_weights=None, profiler=None) -> (dict, SaturationRecord):
     """
     updates the new saturation levels for all nodes in county graph.
     :param CG: The graph of counties
     :param neighbor_obj: a collection of the neighbors of all nodes.
     :param schema: a handler of counties for easy reference
-    :param cumulative_df: dataframe which keeps track of all county saturations over time
+    :param saturation_record: record which keeps track of all county saturations over time
     :param time_tracker: count of current iteration
     :param current_month: current month from MonthQueue
     :param run_mode: Kind of simulation to run
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+    :param edge_weights: EdgeWeights overlay the countermeasures change, defaults to a fresh overlay of CG
+    :param profiler: RunProfiler the countermeasures are timed on as their own phase, if any
     :return schema: updated schema
-    :return cumulative_df: cumulative_df
+    :return saturation_record: saturation_record
     """
     run_mode = 'Baseline' if run_mode is None else run_mode
+    rng = random if rng is None else rng
+    edge_weights = EdgeWeights.of(CG) if edge_weights is None else edge_weights
+    countermeasures = get_run_mode(run_mode, life_cycle=True).countermeasures
+    if profiler is not None:
+        countermeasures = [profiler.timed('countermeasures', countermeasure) for countermeasure in countermeasures]
+    awareness_threshold, toh_growth = MODEL_CONSTANTS['awareness_threshold'], MODEL_CONSTANTS['toh_growth']
     saturation_collector = []
-    infest_data = {}
 
     for county_net in neighbor_obj:
         county = schema[county_net]
-        county.public_awareness = True if county.saturation > .5 else county.public_awareness
-        county.toh_density = county.toh_density + .0025  # shows slow growth of ToH, might delete
+        county.public_awareness = True if county.saturation > awareness_threshold else county.public_awareness
+        county.toh_density = county.toh_density + toh_growth  # shows slow growth of ToH, might delete
         new_saturations = 0
 
         for net_neighbor in neighbor_obj[county_net]:
-            spread_prob = calculate_spread_prob(CG, county, net_neighbor)
-            spread_infest(county, net_neighbor, spread_prob, current_month=current_month)
-            implement_counter_measures(CG, county, net_neighbor, run_mode=run_mode)
+            spread_prob = calculate_spread_prob(edge_weights, county, net_neighbor, rng=rng)
+            spread_infest(county, net_neighbor, spread_prob, current_month=current_month, rng=rng)
+            for countermeasure in countermeasures:
+                countermeasure(edge_weights, county, net_neighbor, rng)
 
             new_saturations += net_neighbor.saturation
         saturation_collector.append(county.saturation)
-        infest_data[f'month {time_tracker}'] = saturation_collector
 
-    new_trackers = pd.DataFrame(infest_data)
-    cumulative_df = pd.concat([cumulative_df, new_trackers], axis=1)
-    return schema, cumulative_df
+    saturation_record.record(time_tracker, saturation_collector)
+    return schema, saturation_record
+
+
+register_run_mode(RunMode(
+    'Baseline',
+    annual=lambda county, net_neighbors, probability, ToH_modifier, quarantine_list, rng:
+    baseline_calc(net_neighbors, probability, ToH_modifier),
+    annual_vectorized=baseline_edges,
+    countermeasures=(), countermeasures_vectorized=()), replace=True)
+register_run_mode(RunMode(
+    'Poison ToH',
+    annual=lambda county, net_neighbors, probability, ToH_modifier, quarantine_list, rng:
+    ToH_calc(net_neighbors, probability, ToH_modifier),
+    annual_vectorized=toh_edges,
+    countermeasures=(lambda edge_weights, county, neighbor, rng: implement_poison_toh(county, rng=rng),),
+    countermeasures_vectorized=(implement_poison_edges,)), replace=True)
+register_run_mode(RunMode(
+    'Population-Based Countermeasures',
+    annual=lambda county, net_neighbors, probability, ToH_modifier, quarantine_list, rng:
+    population_calc(county, net_neighbors, probability, ToH_modifier, rng=rng),
+    annual_vectorized=population_edges,
+    countermeasures=(lambda edge_weights, county, neighbor, rng: implement_pop_kill(county, neighbor, rng=rng),),
+    countermeasures_vectorized=(implement_pop_kill_edges,),
+    aliases=('Population-Based',)), replace=True)  # the life cycle notebook uses the short name
+register_run_mode(RunMode(
+    'Quarantine',
+    annual=lambda county, net_neighbors, probability, ToH_modifier, quarantine_list, rng:
+    quarantine_calc(quarantine_list, net_neighbors, probability, ToH_modifier, rng=rng)[1],
+    annual_vectorized=quarantine_edges,
+    countermeasures=(lambda edge_weights, county, neighbor, rng: implement_pop_kill(county, neighbor, rng=rng),
+                     implement_quarantine),
+    countermeasures_vectorized=(implement_pop_kill_edges, implement_quarantine_edges)), replace=True)
+register_run_mode(RunMode(
+    'All',
+    annual=lambda county, net_neighbors, probability, ToH_modifier, quarantine_list, rng:
+    all_modes(quarantine_list, county, net_neighbors, probability, ToH_modifier, rng=rng)[1],
+    annual_vectorized=all_modes_edges,
+    countermeasures=(lambda edge_weights, county, neighbor, rng: implement_poison_toh(county, rng=rng),
+                     lambda edge_weights, county, neighbor, rng: implement_pop_kill(county, neighbor, rng=rng),
+                     implement_quarantine),
+    countermeasures_vectorized=(implement_poison_edges, implement_pop_kill_edges, implement_quarantine_edges)),
+    replace=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,158 @@
+# saturation_sink.py
+
+"""
+On-disk store of saturation histories. The engines record into a SaturationSink in place of a SaturationRecord
+when a run is given a sink, so memory stays flat for any number of timesteps, and SaturationSink.read reads a
+store back, also while a run is still writing it.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class SaturationSink:
+    """
+    Streams the saturation history of a run to disk, so memory stays flat for any number of timesteps. It records
+    like a SaturationRecord and can be passed to the engines in place of one.
+
+    The store is a folder of chunk files, each a .npy of chunk_steps timesteps shaped (timestep, [replicate,] county)
+    and written through numpy.lib.format.open_memmap, next to a meta.json. Every flush_steps recorded timesteps the
+    open chunk is flushed and meta.json is atomically replaced with the number of timesteps written so far, so a
+    reader using SaturationSink.read can tail the store while a run is still writing it.
+
+    :param path: folder of the store, created if it does not exist
+    :param every: keeps only every k-th timestep, counted from the starting one
+    :param chunk_steps: number of kept timesteps per chunk file
+    :param flush_steps: number of kept timesteps between flushes
+    """
+    FORMAT_NAME = 'slf-saturations'
+    FORMAT_VERSION = 1
+
+    def __init__(self, path: str, every=1, chunk_steps=256, flush_steps=16):
+        self.path = path
+        self.every = every
+        self.chunk_steps = chunk_steps
+        self.flush_steps = flush_steps
+        self.names = None
+        self.time_frame = None
+        self.replicates = None
+        self.written = 0
+        self.flushed = 0
+        self.chunk = None
+        self.complete = False
+
+    def open(self, names: list, time_frame=None, replicates=None):
+        """
+        starts the store of a run. Called by the engines before the first timestep is recorded.
+        :param names: county names, in the order their saturations are recorded
+        :param time_frame: 'year' or 'month'
+        :param replicates: number of replicates of an ensemble, None for a single run
+        :return: the sink
+        """
+        self.names = list(names)
+        self.time_frame = 'year' if time_frame is None else time_frame
+        self.replicates = replicates
+        self.written = self.flushed = 0
+        os.makedirs(self.path, exist_ok=True)
+        self.write_meta()
+        return self
+
+    def record(self, time_tracker: int, saturations):
+        """
+        stores the saturation of every county at one timestep, if it is a kept one. Timesteps come in order.
+        :param time_tracker: count of the current year or month, starting at 1
+        :param saturations: saturations in the same order as names, with a leading replicate axis for ensembles
+        """
+        if (time_tracker - 1) % self.every:
+            return
+        position = self.written % self.chunk_steps
+        if position == 0:
+            self.flush()
+            shape = (self.chunk_steps,) + (() if self.replicates is None else (self.replicates,)) + (len(self.names),)
+            chunk_path = f'{self.path}/chunk_{self.written // self.chunk_steps:05d}.npy'
+            self.chunk = np.lib.format.open_memmap(chunk_path, mode='w+', dtype=float, shape=shape)
+        self.chunk[position] = saturations
+        self.written += 1
+        if self.written - self.flushed >= self.flush_steps:
+            self.flush()
+
+    def flush(self):
+        """
+        writes the open chunk to disk and makes the timesteps recorded so far readable.
+        """
+        if self.chunk is not None and self.written > self.flushed:
+            self.chunk.flush()
+            self.flushed = self.written
+            self.write_meta()
+
+    def close(self):
+        """
+        flushes the store and marks it as complete.
+        :return: the sink
+        """
+        self.flush()
+        self.chunk = None
+        self.complete = True
+        self.write_meta()
+        return self
+
+    def write_meta(self):
+        meta = {'format': self.FORMAT_NAME, 'version': self.FORMAT_VERSION, 'names': self.names,
+                'time_frame': self.time_frame, 'replicates': self.replicates, 'every': self.every,
+                'chunk_steps': self.chunk_steps, 'steps': self.flushed, 'complete': self.complete}
+        with open(f'{self.path}/meta.json.tmp', 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(f'{self.path}/meta.json.tmp', f'{self.path}/meta.json')  # readers never see a partial file
+
+    @staticmethod
+    def read_meta(path: str) -> dict:
+        """
+        reads the meta.json of a store.
+        :param path: folder of the store
+        :return: dict of the store's settings, with 'steps' the number of readable timesteps
+        """
+        with open(f'{path}/meta.json') as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('format') != SaturationSink.FORMAT_NAME or meta.get('version') != SaturationSink.FORMAT_VERSION:
+            raise ValueError('This saturation store version is not supported.')
+        return meta
+
+    @staticmethod
+    def read(path: str) -> np.ndarray:
+        """
+        reads every timestep of a store that has been flushed, including stores that are still being written.
+        :param path: folder of the store
+        :return: array of saturations shaped ([replicate,] county, time), like the results of the vectorized engine
+
+        >>> import tempfile
+        >>> with tempfile.TemporaryDirectory() as path:
+        ...     sink = SaturationSink(path, every=2, chunk_steps=2, flush_steps=1).open(['Cook', 'Pope'])
+        ...     for time_tracker in range(1, 7):
+        ...         sink.record(time_tracker, [time_tracker / 10, 0.0])
+        ...     SaturationSink.read(path)[0].tolist(), SaturationSink.read_meta(path)['complete']
+        ([0.1, 0.3, 0.5], False)
+        """
+        meta = SaturationSink.read_meta(path)
+        steps, chunk_steps = meta['steps'], meta['chunk_steps']
+        chunks = [np.load(f'{path}/chunk_{chunk:05d}.npy', mmap_mode='r')[:min(chunk_steps, steps - start)]
+                  for chunk, start in enumerate(range(0, steps, chunk_steps))]
+        shape = (0,) + (() if meta['replicates'] is None else (meta['replicates'],)) + (len(meta['names']),)
+        values = np.concatenate(chunks) if chunks else np.empty(shape)
+        return np.moveaxis(values, 0, -1)
+
+    @staticmethod
+    def read_dataframe(path: str) -> pd.DataFrame:
+        """
+        reads a store of a single run into the cumulative_df layout, with columns named after the kept timesteps.
+        :param path: folder of the store
+        :return: dataframe with a 'County' column followed by one column per kept timestep
+        """
+        meta = SaturationSink.read_meta(path)
+        values = SaturationSink.read(path)
+        columns = [f"{meta['time_frame']} {1 + step * meta['every']}" for step in range(values.shape[-1])]
+        cumulative_df = pd.DataFrame(values, columns=columns)
+        cumulative_df.insert(0, 'County', meta['names'])
+        return cumulative_df
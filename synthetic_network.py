@@ -0,0 +1,271 @@
+# synthetic_network.py
+
+"""
+Builds synthetic county networks of any size, to see how the model scales past the 102 counties of Illinois.
+Three topologies are available:
+    - 'grid': a planar adjacency grid, every county bordering the ones beside it
+    - 'geometric': a random geometric graph, counties scattered at random and bordering every county within a radius
+    - 'national': county-like cells on a jittered grid bordering their 6 to 8 surrounding cells, with interstate
+    shortcuts linking the most populated counties to the nearest other hubs
+Densities are drawn around the Illinois ones, 'adjacent' edges get a weight around 1.0 and 'interstate' edges one
+around 0.5, and the infestation starts in the most populated county. Networks are written in the array format of
+network_format.py, so run_simulation.set_up and load_network read them by prefix like the Illinois networks:
+    python synthetic_network.py 3100 national
+writes data/location/national_3100_IL_network, loaded with saturation_main(..., prefix='national_3100_').
+"""
+
+import sys
+
+import networkx as nx
+import numpy as np
+from my_classes import County
+from network_format import write_network
+
+TOPOLOGIES = ('grid', 'geometric', 'national')
+LAT_RANGE = (37.0, 42.5)
+LON_RANGE = (-91.5, -87.5)
+MEAN_DEGREE = 5.0
+
+
+def make_counties(positions: np.ndarray, rng) -> dict:
+    """
+    Creates a county at every position with densities drawn around the Illinois ones: population densities from a
+    lognormal centered on 48 per square mile, tree densities of .2, .4 or .6, and tree of heaven in a quarter of the
+    counties. The most populated county starts infested like Cook.
+    :param positions: array of the (x, y) position of every county in the unit square
+    :param rng: numpy Generator to draw from
+    :return: a dict of county names and their objects, in position order
+
+    >>> schema = make_counties(np.array([[0.0, 0.0], [1.0, 1.0]]), np.random.default_rng(0))
+    >>> list(schema), schema['County 0'].lat, schema['County 1'].lon
+    (['County 0', 'County 1'], 37.0, -87.5)
+    >>> sorted(county.saturation for county in schema.values())
+    [0.0, 0.2]
+    """
+    counties = len(positions)
+    popdense_sqmi = np.round(rng.lognormal(np.log(48), 0.9, counties), 1)
+    tree_density = rng.choice([.2, .4, .6], counties)
+    toh_density = np.where(rng.random(counties) < .25, np.round(rng.exponential(.03, counties), 4), 0.0)
+    lat = LAT_RANGE[0] + positions[:, 1] * (LAT_RANGE[1] - LAT_RANGE[0])
+    lon = LON_RANGE[0] + positions[:, 0] * (LON_RANGE[1] - LON_RANGE[0])
+
+    schema = {}
+    for county_id in range(counties):
+        name = f'County {county_id}'
+        schema[name] = County(name, lat=float(lat[county_id]), lon=float(lon[county_id]),
+                              pop=int(popdense_sqmi[county_id] * 560), popdense_sqmi=float(popdense_sqmi[county_id]),
+                              saturation=0.0, slf_pop=0.0, tree_density=float(tree_density[county_id]),
+                              toh_density=float(toh_density[county_id]))
+    first = schema[f'County {int(np.argmax(popdense_sqmi))}']
+    first.saturation, first.slf_pop, first.egg_pop = .2, .4, .1
+    return schema
+
+
+def get_grid_positions(counties: int, jitter=0.0, rng=None) -> (np.ndarray, int):
+    """
+    Utility function.
+    Lays counties out row by row on a square grid spanning the unit square.
+    :param counties: number of counties
+    :param jitter: share of a cell each position is moved at random
+    :param rng: numpy Generator to draw the jitter from
+    :return positions: array of the (x, y) position of every county
+    :return side: number of counties per row
+
+    >>> positions, side = get_grid_positions(5)
+    >>> side, positions[4].tolist()
+    (3, [0.5, 0.5])
+    """
+    side = int(np.ceil(np.sqrt(counties)))
+    rows, columns = np.divmod(np.arange(counties), side)
+    positions = np.column_stack([columns, rows]).astype(float)
+    if jitter:
+        positions += rng.uniform(-jitter / 2, jitter / 2, positions.shape)
+    return positions / max(side - 1, 1), side
+
+
+def get_grid_edges(counties: int, side: int, diagonals=0.0, rng=None) -> list:
+    """
+    Utility function.
+    Pairs every county of a grid with the counties right of and below it, and with a share of the diagonal ones.
+    :param counties: number of counties
+    :param side: number of counties per row
+    :param diagonals: chance each cell is also linked to one of its diagonal cells
+    :param rng: numpy Generator to draw the diagonals from
+    :return: list of (county id, county id) pairs
+
+    >>> get_grid_edges(4, 2)
+    [(0, 1), (0, 2), (1, 3), (2, 3)]
+    """
+    edges = []
+    for county_id in range(counties):
+        row, column = divmod(county_id, side)
+        if column + 1 < side and county_id + 1 < counties:
+            edges.append((county_id, county_id + 1))
+        if county_id + side < counties:
+            edges.append((county_id, county_id + side))
+        if diagonals and rng.random() < diagonals:
+            if rng.random() < .5 and column + 1 < side and county_id + side + 1 < counties:
+                edges.append((county_id, county_id + side + 1))
+            elif column > 0 and county_id + side - 1 < counties:
+                edges.append((county_id, county_id + side - 1))
+    return edges
+
+
+def get_nearest(positions: np.ndarray, targets: np.ndarray, k: int, chunk_size=1024) -> (np.ndarray, np.ndarray):
+    """
+    Utility function.
+    Finds the k nearest targets of every position, in chunks so memory stays bounded on large networks.
+    :param positions: array of (x, y) positions
+    :param targets: array of (x, y) positions to search
+    :param k: number of nearest targets
+    :param chunk_size: number of positions compared at once
+    :return indices: array of the target indices of every position, nearest first
+    :return distances: array of their distances
+
+    >>> indices, distances = get_nearest(np.array([[0.0, 0.0]]), np.array([[3.0, 4.0], [1.0, 0.0]]), 2)
+    >>> indices.tolist(), distances.tolist()
+    ([[1, 0]], [[1.0, 5.0]])
+    """
+    indices, distances = [], []
+    for start in range(0, len(positions), chunk_size):
+        chunk = positions[start:start + chunk_size]
+        squared = ((chunk[:, np.newaxis, :] - targets[np.newaxis, :, :]) ** 2).sum(axis=2)
+        nearest = np.argsort(squared, axis=1, kind='stable')[:, :k]
+        indices.append(nearest)
+        distances.append(np.sqrt(np.take_along_axis(squared, nearest, axis=1)))
+    return np.concatenate(indices), np.concatenate(distances)
+
+
+def get_geometric_edges(positions: np.ndarray, mean_degree=MEAN_DEGREE) -> list:
+    """
+    Utility function.
+    Pairs every county with the counties within the radius that gives about the mean degree, and with its nearest
+    county, so none is left isolated.
+    :param positions: array of the (x, y) position of every county in the unit square
+    :param mean_degree: expected number of neighbors of a county
+    :return: list of (county id, county id) pairs, lower id first
+
+    >>> get_geometric_edges(np.array([[0.0, 0.0], [0.1, 0.0], [1.0, 1.0]]), mean_degree=0.1)
+    [(0, 1), (1, 2)]
+    """
+    counties = len(positions)
+    radius = np.sqrt(mean_degree / (np.pi * counties))
+    k = min(counties, int(4 * mean_degree) + 2)
+    indices, distances = get_nearest(positions, positions, k)
+    edges = set()
+    for county_id in range(counties):
+        for rank in range(1, k):
+            if rank > 1 and distances[county_id, rank] > radius:
+                break
+            neighbor = int(indices[county_id, rank])
+            edges.add((min(county_id, neighbor), max(county_id, neighbor)))
+    return sorted(edges)
+
+
+def get_interstate_edges(positions: np.ndarray, popdense_sqmi: np.ndarray, hubs: int, links=3) -> list:
+    """
+    Utility function.
+    Links each of the most densely populated counties to its nearest other hubs.
+    :param positions: array of the (x, y) position of every county
+    :param popdense_sqmi: array of the population density of every county
+    :param hubs: number of hub counties
+    :param links: number of nearest hubs each hub is linked to
+    :return: list of (county id, county id) pairs, lower id first
+
+    >>> positions = np.array([[0.0, 0.0], [0.5, 0.0], [1.0, 0.0], [0.9, 0.0]])
+    >>> get_interstate_edges(positions, np.array([10.0, 1.0, 20.0, 30.0]), 3, links=1)
+    [(0, 3), (2, 3)]
+    """
+    hub_ids = np.argsort(-popdense_sqmi, kind='stable')[:hubs]
+    if len(hub_ids) < 2:
+        return []
+    indices, distances = get_nearest(positions[hub_ids], positions[hub_ids], min(links, len(hub_ids) - 1) + 1)
+    edges = set()
+    for hub, nearest in zip(hub_ids, indices[:, 1:]):
+        for other in hub_ids[nearest]:
+            edges.add((int(min(hub, other)), int(max(hub, other))))
+    return sorted(edges)
+
+
+def make_network(counties: int, topology='grid', seed=None, hubs=None) -> (nx.Graph, dict, dict):
+    """
+    Builds a synthetic county network.
+    :param counties: number of counties
+    :param topology: 'grid', 'geometric' or 'national'
+    :param seed: seed of the layout and county attributes
+    :param hubs: number of counties linked by interstate shortcuts. Defaults to one in 25 counties for 'national'
+    networks and none for the others.
+    :return CG: graph of the network, with a weight and a rel on every edge
+    :return schema: a dict of county names and their objects, in the node order of the graph
+    :return neighbor_schema: a dict of county names and the objects of their adjacent counties
+
+    >>> CG, schema, neighbor_schema = make_network(16, seed=0)
+    >>> len(schema), CG.number_of_edges(), [county.name for county in neighbor_schema['County 0']]
+    (16, 24, ['County 1', 'County 4'])
+    >>> CG, schema, neighbor_schema = make_network(400, 'national', seed=0)
+    >>> sorted({data['rel'] for _, _, data in CG.edges(data=True)}), nx.is_connected(CG)
+    (['adjacent', 'interstate'], True)
+    >>> make_network(10, 'ring')
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid topology.
+    """
+    if topology not in TOPOLOGIES:
+        raise ValueError('This is not a valid topology.')
+    rng = np.random.default_rng(seed)
+    if topology == 'grid':
+        positions, side = get_grid_positions(counties)
+        adjacent = get_grid_edges(counties, side)
+    elif topology == 'geometric':
+        positions = rng.random((counties, 2))
+        adjacent = get_geometric_edges(positions)
+    else:
+        positions, side = get_grid_positions(counties, jitter=.6, rng=rng)
+        adjacent = get_grid_edges(counties, side, diagonals=.8, rng=rng)
+    schema = make_counties(positions, rng)
+
+    hubs = (counties // 25 if topology == 'national' else 0) if hubs is None else hubs
+    popdense_sqmi = np.array([county.popdense_sqmi for county in schema.values()])
+    interstate = get_interstate_edges(positions, popdense_sqmi, hubs)
+
+    counties_list = list(schema.values())
+    CG = nx.Graph()
+    CG.add_nodes_from(counties_list)
+    for source, target in adjacent:
+        CG.add_edge(counties_list[source], counties_list[target], weight=float(rng.uniform(.75, 1.25)),
+                    rel='adjacent')
+    for source, target in interstate:
+        CG.add_edge(counties_list[source], counties_list[target], weight=float(rng.uniform(.25, .75)),
+                    rel='interstate')
+    neighbor_schema = {name: list(CG.neighbors(county)) for name, county in schema.items()}
+    return CG, schema, neighbor_schema
+
+
+def write_synthetic_network(counties: int, topology='grid', seed=None, hubs=None, prefix=None, path=None) -> str:
+    """
+    Builds a synthetic county network and saves it in the array format run_simulation.set_up loads.
+    :param counties: number of counties
+    :param topology: 'grid', 'geometric' or 'national'
+    :param seed: seed of the layout and county attributes
+    :param hubs: number of counties linked by interstate shortcuts, see make_network
+    :param prefix: prefix the network is saved and loaded under, defaults to '<topology>_<counties>_'
+    :param path: folder holding the networks, defaults to data/location
+    :return: the prefix
+
+    >>> import tempfile
+    >>> from network_format import read_network
+    >>> with tempfile.TemporaryDirectory() as path:
+    ...     prefix = write_synthetic_network(50, 'geometric', seed=1, path=path)
+    ...     CG, schema, neighbor_schema = read_network(prefix=prefix, path=path)
+    >>> original = make_network(50, 'geometric', seed=1)[1]
+    >>> prefix, len(schema), schema['County 3'].toh_density == original['County 3'].toh_density
+    ('geometric_50_', 50, True)
+    """
+    prefix = f'{topology}_{counties}_' if prefix is None else prefix
+    CG, schema, neighbor_schema = make_network(counties, topology, seed=seed, hubs=hubs)
+    write_network(CG, schema, prefix=prefix, path=path, geometry=False)
+    return prefix
+
+
+if __name__ == '__main__':
+    write_synthetic_network(int(sys.argv[1]), sys.argv[2] if len(sys.argv) > 2 else 'grid', seed=0)
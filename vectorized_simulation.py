@@ -0,0 +1,794 @@
+# vectorized_simulation.py
+
+"""
+Array based versions of the simulation engines in run_simulation.py
+County attributes are pulled out of the schema into a CountyTable of NumPy columns and the network is flattened
+into an edge list, so that each timestep is computed for many counties and edges at once instead of one County
+object at a time. run_arrays also runs straight on the memory mapped arrays of a saved network, without a graph.
+
+The object model updates counties in place, one after another, so a county already sees this timestep's values of
+every neighbor that came before it. Two update orders are offered:
+    - 'sequential': follows that order. Counties are split into levels where no two counties of a level are
+      neighbors, and each level is computed in one batch after all of the levels it depends on.
+      In the life cycle model a county's own edges are also applied one at a time, so each level is further split
+      into one batch per edge rank (first neighbor of every county, then the second, ...).
+      The engines are equivalent in distribution, not step for step: random numbers are drawn a batch at a time, so
+      a seeded vectorized run never matches a seeded object run draw for draw, and the annual quarantine coin flips
+      and the blocking of already quarantined neighbors happen level by level rather than county by county, so
+      which edges get blocked can differ when two counties share a later neighbor.
+    - 'synchronous': every county is computed in a single batch from the values at the start of the timestep.
+      Faster, but the infestation travels at most one edge per timestep, and in the life cycle model two neighboring
+      counties acting on each other in the same batch are resolved spread first, then countermeasures.
+"""
+
+import networkx as nx
+import numpy as np
+from numpy import random
+import pandas as pd
+from checkpoint import Checkpoint
+from my_classes import CountyTable, MonthQueue, NeighborIndex, SaturationRecord, SteadyState
+from run_modes import MODEL_CONSTANTS, get_run_mode
+
+UPDATE_ORDERS = ('sequential', 'synchronous')
+LIFE_CYCLE_ATTRIBUTES = ('saturation', 'slf_pop', 'egg_pop', 'mated', 'laid_eggs', 'toh_density', 'tree_density',
+                         'popdense_sqmi', 'traffic_level', 'public_awareness', 'quarantine', 'toh_trigger')
+
+
+def build_edge_list(CG: nx.Graph, schema: dict) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Flattens the county network into integer edge arrays.
+    Every county is visited in schema order and every neighbor in graph order, the same order the object model uses.
+    :param CG: graph of county network
+    :param schema: dict of county names and objects
+    :return src: index of the county each edge belongs to
+    :return dst: index of the neighbor on the other end of each edge
+    :return offsets: position in src/dst where each county's edges begin, with the total edge count at the end
+
+    >>> from my_classes import County
+    >>> CG = nx.Graph()
+    >>> schema = {name: County(name) for name in ['A', 'B', 'C']}
+    >>> CG.add_edge(schema['A'], schema['B'], weight=1.0)
+    >>> CG.add_edge(schema['A'], schema['C'], weight=1.0)
+    >>> src, dst, offsets = build_edge_list(CG, schema)
+    >>> src.tolist(), dst.tolist(), offsets.tolist()
+    ([0, 0, 1, 2], [1, 2, 0, 0], [0, 2, 3, 4])
+    """
+    index = NeighborIndex.of(CG)
+    if list(schema) == index.names:  # the schema is in graph order, so the index can be used as it is
+        offsets, dst = index.offsets, index.neighbors
+    else:
+        county_index = {name: i for i, name in enumerate(schema)}
+        neighbor_lists = [[county_index[neighbor] for neighbor in index.neighbor_names(name)] for name in schema]
+        offsets = np.concatenate([[0], np.cumsum([len(neighbors) for neighbors in neighbor_lists])])
+        dst = [neighbor for neighbors in neighbor_lists for neighbor in neighbors]
+    offsets, dst = np.asarray(offsets, dtype=np.intp), np.asarray(dst, dtype=np.intp)
+    src = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)).astype(np.intp)
+    return src, dst, offsets
+
+
+def build_update_plan(dst: np.ndarray, offsets: np.ndarray, update='sequential') -> list:
+    """
+    Splits the counties into batches that can be computed together.
+    In 'sequential' order a county goes one level after the latest neighbor that precedes it in the schema,
+    so no two counties in a batch are neighbors and every batch only reads finished or untouched counties.
+    :param dst: neighbor index of every edge
+    :param offsets: position where each county's edges begin
+    :param update: 'sequential' or 'synchronous'
+    :return: list of (counties, edges, edge_county, local_offsets) tuples, one per batch. edge_county is the position
+    of each edge's county within the batch and local_offsets are the batch's own edge offsets.
+
+    >>> dst, offsets = np.array([1, 0, 2, 1]), np.array([0, 1, 3, 4])  # a path A - B - C
+    >>> [batch[0].tolist() for batch in build_update_plan(dst, offsets)]
+    [[0], [1], [2]]
+    >>> [batch[0].tolist() for batch in build_update_plan(dst, offsets, update='synchronous')]
+    [[0, 1, 2]]
+    >>> build_update_plan(dst, offsets, update='sideways')
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid update order.
+    """
+    if update not in UPDATE_ORDERS:
+        raise ValueError('This is not a valid update order.')
+    n_counties = len(offsets) - 1
+    levels = np.zeros(n_counties, dtype=np.intp)
+    if update == 'sequential':
+        for county in range(n_counties):
+            earlier = dst[offsets[county]:offsets[county + 1]]
+            earlier = earlier[earlier < county]
+            levels[county] = levels[earlier].max() + 1 if len(earlier) else 0
+
+    plan = []
+    for level in range(levels.max() + 1 if n_counties else 0):
+        counties = np.flatnonzero(levels == level)
+        degree = offsets[counties + 1] - offsets[counties]
+        edges = np.concatenate([np.arange(offsets[c], offsets[c + 1]) for c in counties]).astype(np.intp)
+        edge_county = np.repeat(np.arange(len(counties)), degree)
+        local_offsets = np.concatenate([[0], np.cumsum(degree)]).astype(np.intp)
+        plan.append((counties, edges, edge_county, local_offsets))
+    return plan
+
+
+def build_edge_weights(CG: nx.Graph, schema: dict, src: np.ndarray, dst: np.ndarray) \
+        -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Numbers the undirected edges of the network and copies their weights into an array, so that both directions of
+    an edge read and write the same weight, as they do in the networkx graph.
+    :param CG: graph of county network
+    :param schema: dict of county names and objects
+    :param src: county index of every edge
+    :param dst: neighbor index of every edge
+    :return edge_id: undirected edge number of every edge in src/dst
+    :return weights: weight of every undirected edge
+    :return interstate: boolean array, True where the undirected edge is an interstate
+
+    >>> from my_classes import County
+    >>> CG = nx.Graph()
+    >>> schema = {name: County(name) for name in ['A', 'B', 'C']}
+    >>> CG.add_edge(schema['A'], schema['B'], weight=1.0, rel='adjacent')
+    >>> CG.add_edge(schema['A'], schema['C'], weight=0.5, rel='interstate')
+    >>> src, dst, offsets = build_edge_list(CG, schema)
+    >>> edge_id, weights, interstate = build_edge_weights(CG, schema, src, dst)
+    >>> edge_id.tolist(), weights.tolist(), interstate.tolist()
+    ([0, 1, 0, 1], [1.0, 0.5], [False, True])
+    """
+    counties = list(schema.values())
+    edge_numbers = {}
+    edge_id, weights, interstate = [], [], []
+    for i, j in zip(src.tolist(), dst.tolist()):
+        pair = (min(i, j), max(i, j))
+        if pair not in edge_numbers:
+            edge_numbers[pair] = len(edge_numbers)
+            edge_data = CG[counties[i]][counties[j]]
+            weights.append(edge_data['weight'])
+            interstate.append(edge_data.get('rel') == 'interstate')
+        edge_id.append(edge_numbers[pair])
+    return np.array(edge_id, dtype=np.intp), np.array(weights, dtype=float), np.array(interstate, dtype=bool)
+
+
+def build_network_table(CG: nx.Graph, schema: dict, weights=True) -> (CountyTable, dict):
+    """
+    Flattens a county network into the arrays run_arrays works on, the same arrays network_format.read_network_table
+    opens from a saved network.
+    :param CG: graph of county network
+    :param schema: dict of county names and objects
+    :param weights: also numbers the undirected edges and reads their weights, which only the life cycle model uses
+    :return table: CountyTable of the counties
+    :return edges: dict of the CSR 'offsets' and 'neighbors', and with weights, the undirected 'edge_ids' of every
+    edge and the 'weights' and 'interstate' flags of every undirected edge
+
+    >>> from my_classes import County
+    >>> CG = nx.Graph()
+    >>> schema = {name: County(name) for name in ['A', 'B', 'C']}
+    >>> CG.add_edge(schema['A'], schema['B'], weight=1.0, rel='adjacent')
+    >>> CG.add_edge(schema['A'], schema['C'], weight=0.5, rel='interstate')
+    >>> table, edges = build_network_table(CG, schema)
+    >>> table.names, edges['neighbors'].tolist(), edges['interstate'].tolist()
+    (['A', 'B', 'C'], [1, 2, 0, 0], [False, True])
+    """
+    src, dst, offsets = build_edge_list(CG, schema)
+    edges = {'offsets': offsets, 'neighbors': dst}
+    if weights:
+        edges['edge_ids'], edges['weights'], edges['interstate'] = build_edge_weights(CG, schema, src, dst)
+    return CountyTable.from_counties(schema.values(), LIFE_CYCLE_ATTRIBUTES), edges
+
+
+def split_by_rank(edges: np.ndarray, src: np.ndarray, offsets: np.ndarray) -> list:
+    """
+    Splits a batch of edges into the first edge of every county, the second edge of every county, and so on.
+    :param edges: edge numbers of the batch, grouped by county
+    :param src: county index of every edge
+    :param offsets: position where each county's edges begin
+    :return: list of edge arrays, one per rank
+
+    >>> src, offsets = np.array([0, 0, 1, 1, 1]), np.array([0, 2, 5])
+    >>> [rank.tolist() for rank in split_by_rank(np.arange(5), src, offsets)]
+    [[0, 2], [1, 3], [4]]
+    """
+    if len(edges) == 0:
+        return []
+    rank = edges - offsets[src[edges]]
+    return [edges[rank == r] for r in range(rank.max() + 1)]
+
+
+def sum_by_county(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Sums per edge values into per county totals along the last axis. Edges must be grouped by county, as
+    build_edge_list returns them. Counties without edges get a total of 0.
+    :param values: array of per edge values
+    :param offsets: offsets from build_edge_list
+    :return: array of per county totals
+
+    >>> sum_by_county(np.array([1.0, 2.0, 3.0, 4.0]), np.array([0, 2, 2, 4]))
+    array([3., 0., 7.])
+    """
+    n_counties = len(offsets) - 1
+    totals = np.zeros(values.shape[:-1] + (n_counties,))
+    if values.shape[-1] == 0:
+        return totals
+    starts = np.minimum(offsets[:-1], values.shape[-1] - 1)
+    sums = np.add.reduceat(values, starts, axis=-1)
+    return np.where(np.diff(offsets) > 0, sums, totals)
+
+
+def first_quarantine_mask(candidates: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """
+    The object model keeps a set of quarantined counties for each year. A neighbor is added the first time one of its
+    edges wins the coin flip, and every edge visited after that is blocked as well.
+    This returns the blocked edges given the per edge candidates, in edge visit order.
+    :param candidates: boolean array, True where the neighbor is over half saturated and won its coin flip
+    :param dst: neighbor index of every edge
+    :return: boolean array of blocked edges
+
+    >>> first_quarantine_mask(np.array([False, True, False, True]), np.array([1, 1, 1, 2]))
+    array([False,  True,  True,  True])
+    """
+    order = np.argsort(dst, kind='stable')
+    flips = np.cumsum(candidates[..., order], axis=-1)
+    sorted_dst = dst[order]
+    group_start = np.searchsorted(sorted_dst, sorted_dst, side='left')
+    before_group = np.concatenate([np.zeros(flips.shape[:-1] + (1,), dtype=flips.dtype), flips[..., :-1]], axis=-1)
+    blocked = np.empty(candidates.shape, dtype=bool)
+    blocked[..., order] = (flips - before_group[..., group_start]) > 0
+    return blocked
+
+
+def annual_edge_saturations(run_mode, county_sat: np.ndarray, neighbor_sat: np.ndarray,
+                            neighbor_popdense: np.ndarray, probability: np.ndarray, ToH_modifier: np.ndarray,
+                            dst: np.ndarray, quarantined: np.ndarray, rng=None) -> np.ndarray:
+    """
+    Vectorized counterpart of assign_mode: computes the saturation every neighbor passes on to its county with the
+    annual_vectorized kernel of the run mode.
+    :param run_mode: name of a registered run mode, or a RunMode
+    :param county_sat: saturation of the county each edge belongs to
+    :param neighbor_sat: saturation of the neighbor on each edge
+    :param neighbor_popdense: population density of the neighbor on each edge
+    :param probability: probability of transmission for each edge
+    :param ToH_modifier: ToH modifier for each edge
+    :param dst: neighbor index of every edge, used to track quarantines
+    :param quarantined: boolean array of counties quarantined so far this year, updated in place
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+    :return: array of new saturations for each edge
+
+    >>> import run_simulation  # registers the built-in run modes
+    >>> sat, nowhere = np.array([0.5]), np.zeros(1, dtype=bool)
+    >>> annual_edge_saturations('Baseline', sat, sat, np.array([100.0]), np.array([0.7]), np.array([0.0]),
+    ...                         np.array([0]), nowhere).round(4).tolist()
+    [0.525]
+    >>> annual_edge_saturations('Quarantine', sat, sat, sat, sat, sat, np.array([0]), np.ones(1, dtype=bool))
+    array([0.])
+    >>> annual_edge_saturations('Parasitic Wasps', sat, sat, sat, sat, sat, np.array([0]), nowhere)
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid run mode.
+    """
+    run_mode = get_run_mode(run_mode, vectorized=True)
+    return run_mode.annual_vectorized(county_sat, neighbor_sat, neighbor_popdense, probability, ToH_modifier, dst,
+                                      quarantined, rng)
+
+
+def baseline_edges(county_sat: np.ndarray, neighbor_sat: np.ndarray, neighbor_popdense: np.ndarray,
+                   probability: np.ndarray, ToH_modifier: np.ndarray, dst: np.ndarray, quarantined: np.ndarray,
+                   rng=None) -> np.ndarray:
+    """
+    Vectorized baseline_calc, the annual_vectorized kernel of 'Baseline'. Arguments as in annual_edge_saturations.
+    :return: array of new saturations for each edge
+    """
+    return ((neighbor_sat * probability) * 3 + (ToH_modifier * neighbor_sat)) / 2
+
+
+def toh_edges(county_sat: np.ndarray, neighbor_sat: np.ndarray, neighbor_popdense: np.ndarray,
+              probability: np.ndarray, ToH_modifier: np.ndarray, dst: np.ndarray, quarantined: np.ndarray,
+              rng=None) -> np.ndarray:
+    """
+    Vectorized ToH_calc, the annual_vectorized kernel of 'Poison ToH'. Arguments as in annual_edge_saturations.
+    :return: array of new saturations for each edge
+    """
+    return neighbor_sat * probability - ToH_modifier * neighbor_sat
+
+
+def population_edges(county_sat: np.ndarray, neighbor_sat: np.ndarray, neighbor_popdense: np.ndarray,
+                     probability: np.ndarray, ToH_modifier: np.ndarray, dst: np.ndarray, quarantined: np.ndarray,
+                     rng=None) -> np.ndarray:
+    """
+    Vectorized population_calc, the annual_vectorized kernel of 'Population-Based Countermeasures'.
+    Arguments as in annual_edge_saturations.
+    :return: array of new saturations for each edge
+    """
+    rng = random if rng is None else rng
+    bug_smash = rng.normal(MODEL_CONSTANTS['bug_smash_mean'], MODEL_CONSTANTS['bug_smash_std'],
+                           size=neighbor_sat.shape) * 0.01
+    return (neighbor_sat * probability + ToH_modifier * neighbor_sat
+            - (county_sat * neighbor_popdense * bug_smash))
+
+
+def quarantine_edges(county_sat: np.ndarray, neighbor_sat: np.ndarray, neighbor_popdense: np.ndarray,
+                     probability: np.ndarray, ToH_modifier: np.ndarray, dst: np.ndarray, quarantined: np.ndarray,
+                     rng=None) -> np.ndarray:
+    """
+    Vectorized quarantine_calc, the annual_vectorized kernel of 'Quarantine'. Arguments as in annual_edge_saturations.
+    :return: array of new saturations for each edge
+    """
+    blocked = quarantine_neighbors(neighbor_sat, dst, quarantined, rng=rng)
+    return np.where(blocked, 0.0, neighbor_sat * probability + ToH_modifier * neighbor_sat)
+
+
+def all_modes_edges(county_sat: np.ndarray, neighbor_sat: np.ndarray, neighbor_popdense: np.ndarray,
+                    probability: np.ndarray, ToH_modifier: np.ndarray, dst: np.ndarray, quarantined: np.ndarray,
+                    rng=None) -> np.ndarray:
+    """
+    Vectorized all_modes, the annual_vectorized kernel of 'All'. Arguments as in annual_edge_saturations.
+    :return: array of new saturations for each edge
+    """
+    rng = random if rng is None else rng
+    blocked = quarantine_neighbors(neighbor_sat, dst, quarantined, rng=rng)
+    bug_smash = rng.normal(MODEL_CONSTANTS['bug_smash_mean'], MODEL_CONSTANTS['bug_smash_std'],
+                           size=neighbor_sat.shape) * 0.01
+    new_saturation = (neighbor_sat * probability - ToH_modifier * neighbor_sat
+                      - (county_sat * neighbor_popdense * bug_smash))
+    return np.where(blocked, 0.0, new_saturation)
+
+
+def quarantine_neighbors(neighbor_sat: np.ndarray, dst: np.ndarray, quarantined: np.ndarray, rng=None) -> np.ndarray:
+    """
+    Flips the coin of quarantine_calc for every neighbor above the quarantine threshold and records new quarantines.
+    :param neighbor_sat: saturation of the neighbor on each edge
+    :param dst: neighbor index of every edge
+    :param quarantined: boolean array of counties quarantined so far this year, updated in place
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+    :return: boolean array, True where the neighbor is quarantined and passes nothing on
+
+    >>> quarantined = np.array([False, True, False])
+    >>> quarantine_neighbors(np.array([0.9, 0.1, 0.2]), np.array([0, 1, 2]), quarantined, rng=np.random.default_rng(0)
+    ...                      )[1:].tolist()
+    [True, False]
+    """
+    rng = random if rng is None else rng
+    flips = rng.random(size=neighbor_sat.shape) < 0.5
+    blocked = quarantined[..., dst] | first_quarantine_mask((neighbor_sat > MODEL_CONSTANTS['quarantine_threshold'])
+                                                            & flips, dst)
+    np.logical_or.at(quarantined, (Ellipsis, dst), blocked)
+    return blocked
+
+
+def annual_step(saturation: np.ndarray, toh_density: np.ndarray, popdense_sqmi: np.ndarray,
+                dst: np.ndarray, plan: list, run_mode, rng=None) -> np.ndarray:
+    """
+    Computes one year of the annual model, one batch of the update plan at a time.
+    Mirrors calculate_changes: intrinsic growth, then the averaged influence of every neighbor, clamped to [0, 1].
+    :param saturation: saturation of every county at the start of the year
+    :param toh_density: ToH density of every county
+    :param popdense_sqmi: population density of every county
+    :param dst: neighbor index of every edge
+    :param plan: batches from build_update_plan
+    :param run_mode: name of a registered run mode, or a RunMode
+    :param rng: numpy Generator to draw from, defaults to the global numpy.random state
+    :return: saturation of every county at the end of the year
+
+    >>> dst, offsets = np.array([1, 0]), np.array([0, 1, 2])
+    >>> annual_step(np.zeros(2), np.array([0.5, 0.5]), np.array([10.0, 10.0]), dst, build_update_plan(dst, offsets),
+    ...             'Baseline').tolist()
+    [0.0, 0.0]
+    """
+    rng = random if rng is None else rng
+    kernel = get_run_mode(run_mode, vectorized=True).annual_vectorized
+    saturation = saturation.copy()
+    quarantined = np.zeros(saturation.shape, dtype=bool)
+    growth_mean, growth_std = MODEL_CONSTANTS['growth_mean'], MODEL_CONSTANTS['growth_std']
+    transmission_mean, transmission_std = MODEL_CONSTANTS['transmission_mean'], MODEL_CONSTANTS['transmission_std']
+    for counties, edges, edge_county, local_offsets in plan:
+        current = saturation[..., counties]
+        grown = current + rng.normal(growth_mean, growth_std, size=current.shape) * (current * toh_density[counties])
+
+        neighbors = dst[edges]
+        neighbor_sat = saturation[..., neighbors]
+        probability = rng.normal(transmission_mean, transmission_std, size=neighbor_sat.shape)
+        ToH_modifier = (neighbor_sat * toh_density[neighbors] * 100
+                        * rng.exponential(MODEL_CONSTANTS['toh_scale'], size=neighbor_sat.shape))
+        new_saturations = kernel(grown[..., edge_county], neighbor_sat, popdense_sqmi[neighbors], probability,
+                                 ToH_modifier, neighbors, quarantined, rng)
+
+        degree = np.diff(local_offsets)
+        averaged = np.divide(sum_by_county(new_saturations, local_offsets), degree,
+                             out=np.zeros(grown.shape), where=degree > 0)
+        saturation[..., counties] = np.clip(np.round(averaged, 8) + grown, 0, 1)
+    return saturation
+
+
+def life_cycle_step(state: CountyTable, current_month: dict, rng=None):
+    """
+    Vectorized handle_life_cycle_for_county: runs the month's hatch, mate/lay or die-off step for every county,
+    then recomputes saturation from the adult and egg populations. Counties do not interact here, so this follows
+    the object model's rules exactly, only with the random draws taken in batches.
+    :param state: CountyTable of the counties, updated in place
+    :param current_month: month from MonthQueue
+    :param rng: numpy Generator to draw from, defaults to the global numpy.random state
+
+    >>> from my_classes import County
+    >>> state = CountyTable.from_counties([County('Cook', slf_pop=0.5, egg_pop=0.1)])
+    >>> life_cycle_step(state, {'month': 'January', 'traffic_level': 0.9})
+    >>> bool(state['slf_pop'][0] < 0.1), state['saturation'].round(2).tolist()
+    (True, [0.3])
+    """
+    rng = random if rng is None else rng
+    month = current_month['month']
+    if month in ['May', 'June']:
+        state.hatch_eggs(rng=rng)
+    elif month in ['August', 'September', 'October', 'November', 'December']:
+        state.mate(rng=rng)
+        if month in ['September', 'October', 'November']:
+            state.lay_eggs(rng=rng)
+    elif month in ['January', 'February']:
+        state.die_off(rng=rng)
+    slf_pop, egg_pop = state['slf_pop'], state['egg_pop']
+    state['saturation'][...] = np.maximum.reduce([(slf_pop + egg_pop * 3.0) / 2, egg_pop * 3.0, slf_pop])
+    state.stabilize_levels()
+
+
+def die_off_counties(state: CountyTable, counties: np.ndarray, mortality_rate: np.ndarray, mask: np.ndarray):
+    """
+    Vectorized County.die_off for the masked counties of a batch. Counties may appear only once in a batch.
+    :param state: CountyTable of the counties, updated in place
+    :param counties: county index of every entry
+    :param mortality_rate: percent of flies killed off for every entry
+    :param mask: boolean array, False where the entry should be left alone
+
+    >>> from my_classes import County
+    >>> state = CountyTable.from_counties([County('Cook', slf_pop=0.5, mated=1.0, laid_eggs=1.0)] * 2)
+    >>> die_off_counties(state, np.array([0, 1]), np.array([0.5, 0.5]), np.array([True, False]))
+    >>> state['slf_pop'].tolist(), state['mated'].tolist()
+    ([0.25, 0.5], [0.0, 1.0])
+    """
+    slf_pop = state['slf_pop'][..., counties]
+    state['slf_pop'][..., counties] = np.clip(np.where(mask, slf_pop - slf_pop * mortality_rate, slf_pop), 0.0, 1.0)
+    for atr in ('mated', 'laid_eggs'):
+        state[atr][..., counties] = np.where(mask, 0.0, state[atr][..., counties])
+
+
+def infest_edges(state: CountyTable, weights: np.ndarray, edges: np.ndarray, src: np.ndarray, dst: np.ndarray,
+                 edge_id: np.ndarray, interstate: np.ndarray, current_month: dict, run_mode, rng=None):
+    """
+    Vectorized spread and countermeasures of calc_infest for a batch of edges holding at most one edge per county.
+    Mirrors calculate_spread_prob and spread_infest, then runs the countermeasures_vectorized kernels of the mode.
+    :param state: CountyTable of the counties, updated in place
+    :param weights: weight of every undirected edge, updated in place by quarantines
+    :param edges: edge numbers of the batch
+    :param src: county index of every edge
+    :param dst: neighbor index of every edge
+    :param edge_id: undirected edge number of every edge
+    :param interstate: boolean array, True where the undirected edge is an interstate
+    :param current_month: month from MonthQueue
+    :param run_mode: name of a registered run mode, or a RunMode
+    :param rng: numpy Generator to draw from, defaults to the global numpy.random state
+    """
+    rng = random if rng is None else rng
+    county, neighbor, edge = src[edges], dst[edges], edge_id[edges]
+    shape = state['slf_pop'][..., county].shape
+
+    # calculate_spread_prob and spread_infest
+    slf_pop = state['slf_pop'][..., county]
+    # uniform(high, high - range) as the legacy sampler computes it, Generator.uniform refuses a high below low
+    base_prob = ((MODEL_CONSTANTS['spread_high'] - MODEL_CONSTANTS['spread_range'] * rng.random(size=shape)) * slf_pop
+                 / (state['toh_density'][..., neighbor] + state['tree_density'][..., neighbor]))
+    spread_prob = np.clip(base_prob / weights[..., edge] / state['traffic_level'][..., county], 0.0, 1.0)
+    transfer_amount = slf_pop * spread_prob * rng.uniform(MODEL_CONSTANTS['transfer_low'],
+                                                          MODEL_CONSTANTS['transfer_high'], size=shape)
+    for atr in (('slf_pop', 'egg_pop') if current_month['month'] in ['September', 'October', 'November']
+                else ('slf_pop',)):
+        np.add.at(state[atr], (Ellipsis, neighbor), transfer_amount)
+        np.clip(state[atr], 0.0, 1.0, out=state[atr])
+
+    for countermeasure in get_run_mode(run_mode, life_cycle=True, vectorized=True).countermeasures_vectorized:
+        countermeasure(state, weights, county, neighbor, edge, interstate, rng)
+
+
+def implement_poison_edges(state: CountyTable, weights: np.ndarray, county: np.ndarray, neighbor: np.ndarray,
+                           edge: np.ndarray, interstate: np.ndarray, rng=None):
+    """
+    Vectorized implement_poison_toh, a countermeasures_vectorized kernel. Counties may appear only once in a batch.
+    :param state: CountyTable of the counties, updated in place
+    :param weights: weight of every undirected edge
+    :param county: county index of every edge in the batch
+    :param neighbor: neighbor index of every edge in the batch
+    :param edge: undirected edge number of every edge in the batch
+    :param interstate: boolean array, True where the undirected edge is an interstate
+    :param rng: numpy Generator or BlockSampler to draw from, defaults to the global numpy.random state
+    """
+    rng = random if rng is None else rng
+    trigger = state['toh_trigger'][..., county] | state['public_awareness'][..., county]
+    state['toh_trigger'][..., county] = trigger
+    variance = rng.normal(MODEL_CONSTANTS['poison_mean'], MODEL_CONSTANTS['poison_std'], size=trigger.shape)
+    die_off_counties(state, county, state['toh_density'][..., county] / variance, trigger)
+
+
+def implement_pop_kill_edges(state: CountyTable, weights: np.ndarray, county: np.ndarray, neighbor: np.ndarray,
+                             edge: np.ndarray, interstate: np.ndarray, rng=None):
+    """
+    Vectorized implement_pop_kill, a countermeasures_vectorized kernel. Arguments as in implement_poison_edges.
+    """
+    rng = random if rng is None else rng
+    saturation, aware = state['saturation'], state['public_awareness']
+    county_sat, neighbor_sat = saturation[..., county], saturation[..., neighbor]
+    mortality_rate = (rng.normal(MODEL_CONSTANTS['pop_kill_mean'], MODEL_CONSTANTS['pop_kill_std'],
+                                 size=county_sat.shape)
+                      * state['popdense_sqmi'][..., county] / MODEL_CONSTANTS['pop_kill_divisor'])
+    county_aware = aware[..., county] & (county_sat > MODEL_CONSTANTS['awareness_threshold'])
+    county_aware |= state['quarantine'][..., neighbor] & (county_sat >= neighbor_sat / 2)
+    aware[..., county] = county_aware
+    np.logical_or.at(aware, (Ellipsis, neighbor), county_aware & (neighbor_sat >= county_sat / 2))
+    die_off_counties(state, county, mortality_rate, county_aware)
+    egg_pop = state['egg_pop'][..., county]
+    state['egg_pop'][..., county] = np.clip(np.where(county_aware, egg_pop - mortality_rate * 3.0, egg_pop),
+                                            0.0, 1.0)
+
+
+def implement_quarantine_edges(state: CountyTable, weights: np.ndarray, county: np.ndarray, neighbor: np.ndarray,
+                               edge: np.ndarray, interstate: np.ndarray, rng=None):
+    """
+    Vectorized implement_quarantine, a countermeasures_vectorized kernel. Arguments as in implement_poison_edges,
+    the weights of quarantined edges are updated in place.
+    """
+    rng = random if rng is None else rng
+    quarantine, county_sat = state['quarantine'], state['saturation'][..., county]
+    county_quarantine = ((quarantine[..., county] | (county_sat >= MODEL_CONSTANTS['lockdown_threshold']))
+                         & (county_sat > MODEL_CONSTANTS['release_threshold']))
+    quarantine[..., county] = county_quarantine
+    np.logical_or.at(state['public_awareness'], (Ellipsis, neighbor), county_quarantine)
+    weight_low, weight_high = MODEL_CONSTANTS['quarantine_weight_low'], MODEL_CONSTANTS['quarantine_weight_high']
+    new_weights = np.where(county_quarantine, rng.uniform(weight_low, weight_high, size=county_sat.shape),
+                           np.where(quarantine[..., neighbor], weights[..., edge],
+                                    np.where(interstate[edge], .25, 1.0)))
+    for direction in (county < neighbor, county > neighbor):  # keeps each undirected edge unique per write
+        weights[..., edge[direction]] = new_weights[..., direction]
+
+
+def infest_step(state: CountyTable, weights: np.ndarray, plan: list, src: np.ndarray, dst: np.ndarray,
+                offsets: np.ndarray, edge_id: np.ndarray, interstate: np.ndarray, current_month: dict, run_mode,
+                rng=None):
+    """
+    Vectorized calc_infest: raises public awareness and ToH density for every county as its turn comes,
+    then applies the spread and countermeasures of its edges one rank at a time.
+    :param state: CountyTable of the counties, updated in place
+    :param weights: weight of every undirected edge, updated in place
+    :param plan: batches from build_update_plan
+    :param src: county index of every edge
+    :param dst: neighbor index of every edge
+    :param offsets: position where each county's edges begin
+    :param edge_id: undirected edge number of every edge
+    :param interstate: boolean array, True where the undirected edge is an interstate
+    :param current_month: month from MonthQueue
+    :param run_mode: name of a registered run mode, or a RunMode
+    :param rng: numpy Generator to draw from, defaults to the global numpy.random state
+    """
+    rng = random if rng is None else rng
+    awareness_threshold, toh_growth = MODEL_CONSTANTS['awareness_threshold'], MODEL_CONSTANTS['toh_growth']
+    for counties, edges, edge_county, local_offsets in plan:
+        state['public_awareness'][..., counties] |= state['saturation'][..., counties] > awareness_threshold
+        state['toh_density'][..., counties] += toh_growth  # shows slow growth of ToH, might delete
+        for rank_edges in split_by_rank(edges, src, offsets):
+            infest_edges(state, weights, rank_edges, src, dst, edge_id, interstate, current_month, run_mode, rng=rng)
+
+
+def run_vectorized(CG: nx.Graph, schema: dict, iterations: int, run_mode='Baseline', life_cycle=False,
+                   update='sequential', replicates=None, rng=None, sink=None, patience=None, checkpoint=None,
+                   resume_from=None) -> (np.ndarray, CountyTable):
+    """
+    Runs the array engine on a graph and schema and returns the raw saturation history, see run_arrays.
+    With replicates set, every state array gets a leading replicate axis and all replicates advance in lockstep,
+    so one batched operation serves every replicate.
+    :param CG: graph of Illinois network
+    :param schema: handler dictionary for graph with name of nodes for keys and County object for values
+    :param iterations: number of years or months
+    :param run_mode: name of a registered run mode, or a RunMode
+    :param life_cycle: runs the monthly life cycle model instead of the annual one
+    :param update: 'sequential' to match the object model's update order, 'synchronous' for a single batch per step
+    :param replicates: number of Monte Carlo replicates to run at once, defaults to a single run without the axis
+    :param rng: numpy Generator to draw from, defaults to the global numpy.random state
+    :param sink: SaturationSink to stream the saturation history to instead of keeping it in memory
+    :param patience: number of steps without any change in saturation (and in the life cycle model, in slf_pop,
+    egg_pop and mated) after which the run stops early, see SteadyState. The remaining timesteps repeat the last
+    saturations, and the run always stops once it has died out.
+    :param checkpoint: file or Checkpoint the full state of the run is saved to every few timesteps
+    :param resume_from: checkpoint file of the same run to continue from, with an rng of the same kind as the one it
+    was saved with. The resumed run finishes exactly as the original one would have.
+    :return results: saturation history, shaped (county, time) or (replicate, county, time). The closed sink when
+    one is given.
+    :return state: CountyTable of the counties at the end of the run
+
+    >>> import run_simulation  # registers the built-in run modes
+    >>> from my_classes import County
+    >>> CG = nx.Graph()
+    >>> schema = {name: County(name, saturation=0.5, toh_density=0.5, popdense_sqmi=10.0) for name in 'ABC'}
+    >>> CG.add_edge(schema['A'], schema['B'], weight=1.0)
+    >>> CG.add_edge(schema['B'], schema['C'], weight=1.0)
+    >>> results, state = run_vectorized(CG, schema, 4, 'All', replicates=6)
+    >>> results.shape, state['saturation'].shape
+    ((6, 3, 5), (6, 3))
+    >>> empty = {name: County(name, slf_pop=0.0, toh_density=0.5, popdense_sqmi=10.0) for name in 'ABC'}
+    >>> CG = nx.Graph([(empty['A'], empty['B'], {'weight': 1.0}), (empty['B'], empty['C'], {'weight': 1.0})])
+    >>> results, state = run_vectorized(CG, empty, 12, 'All', life_cycle=True, replicates=2)
+    >>> results.shape, float(results.max())
+    ((2, 3, 13), 0.0)
+    >>> import tempfile
+    >>> results, state = run_vectorized(CG, schema, 12, 'All', life_cycle=True, replicates=2,
+    ...                                 rng=np.random.default_rng(6))
+    >>> with tempfile.TemporaryDirectory() as folder:
+    ...     part = run_vectorized(CG, schema, 12, 'All', life_cycle=True, replicates=2, rng=np.random.default_rng(6),
+    ...                           checkpoint=Checkpoint(f'{folder}/run.npz', every=5))
+    ...     resumed, state = run_vectorized(CG, schema, 12, 'All', life_cycle=True, replicates=2,
+    ...                                     rng=np.random.default_rng(0), resume_from=f'{folder}/run.npz')
+    >>> bool((resumed == results).all())
+    True
+    >>> results, state = run_vectorized(CG, schema, 4, 'All')
+    >>> results.shape
+    (3, 5)
+    >>> run_vectorized(CG, schema, 3, 'Flamethrower')
+    Traceback (most recent call last):
+    ...
+    ValueError: This is not a valid run mode.
+    """
+    table, edges = build_network_table(CG, schema, weights=life_cycle)
+    return run_arrays(table, edges, iterations, run_mode, life_cycle=life_cycle, update=update,
+                      replicates=replicates, rng=rng, sink=sink, patience=patience, checkpoint=checkpoint,
+                      resume_from=resume_from)
+
+
+def run_arrays(table: CountyTable, edges: dict, iterations: int, run_mode='Baseline', life_cycle=False,
+               update='sequential', replicates=None, rng=None, sink=None, patience=None, checkpoint=None,
+               resume_from=None) -> (np.ndarray, CountyTable):
+    """
+    Runs the array engine straight on the arrays of a network, from build_network_table or, without any graph or
+    County objects, from network_format.read_network_table. Memory mapped arrays are only read.
+    :param table: CountyTable of the counties, with at least the columns of LIFE_CYCLE_ATTRIBUTES
+    :param edges: dict of edge arrays as build_network_table returns them. The annual model only needs the CSR
+    'offsets' and 'neighbors'.
+    :param iterations: number of years or months
+    :param run_mode: name of a registered run mode, or a RunMode
+    :param life_cycle: runs the monthly life cycle model instead of the annual one
+    :param update: 'sequential' to match the object model's update order, 'synchronous' for a single batch per step
+    :param replicates: number of Monte Carlo replicates to run at once, defaults to a single run without the axis
+    :param rng: numpy Generator to draw from, defaults to the global numpy.random state
+    :param sink: SaturationSink to stream the saturation history to instead of keeping it in memory
+    :param patience: number of steps without any change after which the run stops early, as in run_vectorized
+    :param checkpoint: file or Checkpoint the full state of the run is saved to every few timesteps
+    :param resume_from: checkpoint file of the same run to continue from
+    :return results: saturation history, shaped (county, time) or (replicate, county, time). The closed sink when
+    one is given.
+    :return state: CountyTable of the counties at the end of the run
+
+    >>> import run_simulation  # registers the built-in run modes
+    >>> from network_format import read_network_table
+    >>> table, edges = read_network_table(prefix='fast_')
+    >>> results, state = run_arrays(table, edges, 3, 'All', life_cycle=True, replicates=2)
+    >>> results.shape, isinstance(table['slf_pop'], np.memmap), isinstance(state['slf_pop'], np.memmap)
+    ((2, 102, 4), True, False)
+    """
+    rng = random if rng is None else rng
+    run_mode = get_run_mode(run_mode, life_cycle=life_cycle, vectorized=True)
+    checkpoint = Checkpoint(checkpoint) if isinstance(checkpoint, str) else checkpoint
+    if sink is not None and (checkpoint is not None or resume_from is not None):
+        raise ValueError('Checkpoints are not supported when streaming to a sink.')
+    names = table.names
+    run = {'engine': 'vectorized', 'run_mode': run_mode.name, 'life_cycle': life_cycle, 'iterations': iterations,
+           'update': update, 'replicates': replicates, 'counties': names}
+    offsets, dst = np.asarray(edges['offsets'], dtype=np.intp), np.asarray(edges['neighbors'], dtype=np.intp)
+    src = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets)).astype(np.intp)
+    plan = build_update_plan(dst, offsets, update=update)
+    lead = () if replicates is None else (replicates,)
+
+    # every column a run writes gets its own copy, the table itself is never written
+    if life_cycle:
+        state = CountyTable(names, {atr: table[atr] for atr in LIFE_CYCLE_ATTRIBUTES})
+        edge_id, interstate = np.asarray(edges['edge_ids'], dtype=np.intp), np.asarray(edges['interstate'])
+        weights = np.broadcast_to(edges['weights'], lead + edges['weights'].shape).astype(float)
+        months_queue = MonthQueue()
+        traffic_levels = months_queue.get_atr_schedule('traffic_level', iterations)
+    else:  # ToH and population density stay constant in the annual model, so they are shared by all replicates
+        state = CountyTable(names, {atr: np.asarray(table[atr]) for atr in ('toh_density', 'popdense_sqmi')})
+        state['saturation'] = table['saturation']
+    for atr in (list(state.columns) if life_cycle else ['saturation']):
+        state[atr] = np.broadcast_to(state[atr], lead + state[atr].shape).astype(state[atr].dtype)
+
+    if sink is None:
+        results = np.empty(lead + (len(names), iterations + 1))
+        results[..., 0] = state['saturation']
+    else:
+        results = sink.open(names, time_frame='month' if life_cycle else 'year', replicates=replicates)
+        sink.record(1, state['saturation'])
+    steady_state = SteadyState(patience=patience)
+    populations = ('slf_pop', 'egg_pop', 'mated') if life_cycle else ()
+    start = 1
+    if resume_from is not None:
+        saved = Checkpoint.load(resume_from, run=run)
+        state.columns.update(saved['columns'])
+        if life_cycle:
+            weights, months_queue.position = saved['weights'].copy(), saved['month_position']
+        start = saved['time_tracker']
+        results[..., :start] = saved['results']
+        steady_state.unchanged, steady_state.previous = saved['unchanged'], saved['previous']
+        Checkpoint.set_rng_state(rng, saved['rng'], saved['arrays'])
+    for step in range(start, iterations + 1):
+        if life_cycle:
+            current_month = months_queue.rotate()
+            state['traffic_level'][...] = traffic_levels[step - 1]  # as handle_life_cycle_for_county sets it
+            life_cycle_step(state, current_month, rng=rng)
+            infest_step(state, weights, plan, src, dst, offsets, edge_id, interstate, current_month, run_mode,
+                        rng=rng)
+        else:
+            state['saturation'] = annual_step(state['saturation'], state['toh_density'], state['popdense_sqmi'],
+                                              dst, plan, run_mode, rng=rng)
+        if sink is None:
+            results[..., step] = state['saturation']
+        else:
+            sink.record(step + 1, state['saturation'])
+        if steady_state.update(state['saturation'], *(state[atr] for atr in populations)):
+            if sink is None:
+                results[..., step + 1:] = state['saturation'][..., np.newaxis]
+            else:
+                SteadyState.fill(sink, step + 1, iterations + 1, state['saturation'])
+            break
+        if checkpoint is not None and checkpoint.due(step + 1):
+            checkpoint.save(run, step + 1, state.columns, results, rng, weights=weights if life_cycle else None,
+                            month_position=months_queue.position if life_cycle else 0, steady_state=steady_state)
+    if sink is not None:
+        sink.close()
+    return results, state
+
+
+def iterate_vectorized(CG: nx.Graph, schema: dict, iterations: int, run_mode='Baseline', life_cycle=False,
+                       update='sequential', rng=None, sink=None, patience=None, checkpoint=None,
+                       resume_from=None) -> pd.DataFrame:
+    """
+    Array based replacement for iterate_through_timeframe. Produces the same cumulative_df layout:
+    a 'County' column followed by one column per year or month.
+    The final county attributes are written back into the schema.
+    :param CG: graph of Illinois network
+    :param schema: handler dictionary for graph with name of nodes for keys and County object for values
+    :param iterations: number of years or months
+    :param run_mode: name of a registered run mode, or a RunMode
+    :param life_cycle: runs the monthly life cycle model instead of the annual one
+    :param update: 'sequential' to match the object model's update order, 'synchronous' for a single batch per step
+    :param rng: numpy Generator to draw from, defaults to the global numpy.random state
+    :param sink: SaturationSink to stream the saturations to, returned closed in place of the df
+    :param patience: number of steps without any change in saturation or populations after which the run stops early
+    :param checkpoint: file or Checkpoint the full state of the run is saved to every few timesteps
+    :param resume_from: checkpoint file of the same run to continue from
+    :return cumulative_df: a df that contains the full data for all counties in a run simulation
+
+    >>> import run_simulation  # registers the built-in run modes
+    >>> from my_classes import County
+    >>> CG = nx.Graph()
+    >>> schema = {name: County(name, saturation=0.5, slf_pop=0.5, toh_density=0.5, tree_density=0.2,
+    ...                        popdense_sqmi=10.0) for name in ['A', 'B']}
+    >>> CG.add_edge(schema['A'], schema['B'], weight=1.0, rel='adjacent')
+    >>> df = iterate_vectorized(CG, schema, 3, 'Quarantine')
+    >>> df.columns.tolist()
+    ['County', 'year 1', 'year 2', 'year 3', 'year 4']
+    >>> bool(df.iloc[:, 1:].stack().between(0, 1).all())
+    True
+    >>> df = iterate_vectorized(CG, schema, 13, 'All', life_cycle=True)
+    >>> df.columns.tolist()[-1]
+    'month 14'
+    """
+    results, state = run_vectorized(CG, schema, iterations, run_mode, life_cycle=life_cycle, update=update, rng=rng,
+                                    sink=sink, patience=patience, checkpoint=checkpoint, resume_from=resume_from)
+    state.to_counties(schema.values())
+    if sink is not None:
+        return sink
+    return make_results_df(schema, results, time_frame='month' if life_cycle else 'year')
+
+
+def make_results_df(schema: dict, results: np.ndarray, time_frame=None) -> pd.DataFrame:
+    """
+    Builds the cumulative_df layout used by run_simulation.py from a (county, time) array of saturations.
+    :param schema: a dict of county names and their objects, in the same order as the rows of results
+    :param results: saturation history of one run
+    :param time_frame: changes if the df column names are years or months
+    :return: dataframe with a 'County' column followed by one column per timestep
+
+    >>> from my_classes import County
+    >>> make_results_df({'Cook': County('Cook')}, np.array([[0.2, 0.4]]), time_frame='month')
+      County  month 1  month 2
+    0   Cook      0.2      0.4
+    """
+    names = [county.name for county in schema.values()]
+    return SaturationRecord(names, results.shape[1], time_frame=time_frame, values=results).to_dataframe()
@@ -7,7 +7,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib
 import networkx as nx
-from run_simulation import saturation_main
+from run_simulation import saturation_main, saturation_ensemble
+from parallel_simulation import adaptive_ensemble, parallel_aggregate, parallel_ensemble
 
 
 def make_visual_df(simulation_df: pd.DataFrame) -> pd.DataFrame:
@@ -128,17 +129,59 @@ def make_average_graphs(df: pd.DataFrame, sim_iterations: int, time_frame=None,
     ...
     AttributeError: 'dict' object has no attribute 'T'
     """
-    time_frame = 'Years' if time_frame is None else time_frame
     vis_df = make_visual_df(df)
     avg_df = vis_df.mean(axis=1)
+    plot_average_line(avg_df, sim_iterations, time_frame, tick_steps)
+
+
+def plot_average_line(avg_line, sim_iterations: int, time_frame=None, tick_steps=1):
+    """
+    Plots one statewide average saturation line against its timesteps.
+    Shared by make_average_graphs and the ensemble engines so every engine labels the axes the same way.
+    :param avg_line: series or array of average saturations, one per timestep
+    :param sim_iterations: number of iterations in sim runs
+    :param time_frame: Sets whether model displays Years or Months, defaults to Years
+    :param tick_steps: Sets the step for x ticks in visualization, defaults to 1
+
+    >>> plot_average_line(np.array([0.2, 0.5, 0.8, 0.9]), sim_iterations=3, tick_steps=2)
+
+    # this returns nothing, but passes when given proper input
+    """
+    time_frame = 'Years' if time_frame is None else time_frame
+    avg_line = pd.Series(avg_line)
     plt.xticks(ticks=range(0, sim_iterations + 1, tick_steps),
                labels=range(0, sim_iterations + 1, tick_steps))
     plt.xlabel(time_frame)
     plt.ylabel('Saturation Percentage')
-    plt.plot(avg_df.index, avg_df, linewidth=0.5)
+    plt.plot(avg_line.index, avg_line, linewidth=0.5)
+
 
+def get_ensemble_avg_lines(run_mode: str, sims_run: int, sim_iterations: int, life_cycle=False, prefix=None,
+                           engine=None) -> np.ndarray:
+    """
+    Utility function.
+    Runs all simulations with saturation_ensemble, or across worker processes with parallel_ensemble,
+    and averages each replicate over the state.
+    :param run_mode: type of mode the simulation runs in
+    :param sims_run: number of runs
+    :param sim_iterations: number of iterations per run
+    :param life_cycle: a boolean which determine if the annual or monthly simulation runs.
+    :param prefix: alter this to change which network and handlers handled by the system
+    :param engine: 'parallel' spreads the simulations over worker processes with parallel_ensemble, any other
+    value runs them at once with saturation_ensemble. Defaults to None, a single process
+    :return: array of statewide average saturations shaped (run, time)
 
-def model_variables(run_mode: str, sims_run: int, sim_iterations: int, life_cycle=False, prefix=None):
+    >>> get_ensemble_avg_lines('Baseline', 5, 3).shape
+    (5, 4)
+    """
+    if engine == 'parallel':
+        results = parallel_ensemble(run_mode, sim_iterations, sims_run, life_cycle=life_cycle, prefix=prefix)
+    else:
+        results = saturation_ensemble(run_mode, sim_iterations, sims_run, life_cycle=life_cycle, prefix=prefix)
+    return results.mean(axis=1)
+
+
+def model_variables(run_mode: str, sims_run: int, sim_iterations: int, life_cycle=False, prefix=None, engine=None):
     """
     Loops through the number of simulations run
     Passes the resulting df to make_average_graphs()
@@ -148,11 +191,15 @@ def model_variables(run_mode: str, sims_run: int, sim_iterations: int, life_cycl
     :param sim_iterations: number of iterations in each run
     :param life_cycle: Toggles whether the model runs on the annual or month simulation.
     :param prefix: parameter allowing for different graphs/handlers to be loaded in.
+    :param engine: 'vectorized' runs every simulation at once with saturation_ensemble, 'parallel' spreads them over
+    worker processes with parallel_ensemble. Defaults to None, one saturation_main run at a time
 
     >>> model_variables('Baseline', 5, 3)
 
     # this returns nothing, but passes when given proper input
 
+    >>> model_variables('Baseline', 5, 3, engine='vectorized')
+
     >>> model_variables('Poison ToH', 'SLF', 3)
     Traceback (most recent call last):
     ...
@@ -170,16 +217,20 @@ def model_variables(run_mode: str, sims_run: int, sim_iterations: int, life_cycl
 
     prefix = '' if prefix is None else prefix
 
-    for i in range(0, sims_run):
-        df = saturation_main(run_mode, sim_iterations, life_cycle=life_cycle, prefix=prefix)
-        make_average_graphs(df,
-                            sim_iterations)  # putting inside the loop will allow the code to forget the df
+    if engine in ('vectorized', 'parallel'):
+        for avg_line in get_ensemble_avg_lines(run_mode, sims_run, sim_iterations, life_cycle, prefix, engine):
+            plot_average_line(avg_line, sim_iterations)
+    else:
+        for i in range(0, sims_run):
+            df = saturation_main(run_mode, sim_iterations, life_cycle=life_cycle, prefix=prefix)
+            make_average_graphs(df,
+                                sim_iterations)  # putting inside the loop will allow the code to forget the df
 
     plt.show()
 
 
 def model_variables_avg(run_mode: str, sims_run: int, sim_iterations: int, all_trends: dict,
-                        life_cycle=False, prefix=None, time_frame=None, tick_steps=1) -> dict:
+                        life_cycle=False, prefix=None, time_frame=None, tick_steps=1, engine=None) -> dict:
     """
     A modified version of model_variables
     includes a trend line that averages all the simulations graphed
@@ -192,6 +243,8 @@ def model_variables_avg(run_mode: str, sims_run: int, sim_iterations: int, all_t
     :param prefix: alter this to change which network and handlers handled by the system
     :param time_frame: Whether label is set to Years or Months
     :param tick_steps: the step for x-ticks.
+    :param engine: 'vectorized' runs every simulation at once with saturation_ensemble, 'parallel' spreads them over
+    worker processes with parallel_ensemble. Defaults to None, one saturation_main run at a time
     :return all_trends: output dict that gets passed to the next run mode simulation.
 
     >>> all_trends = {}
@@ -199,6 +252,10 @@ def model_variables_avg(run_mode: str, sims_run: int, sim_iterations: int, all_t
     >>> isinstance(result, dict)
     True
 
+    >>> result = model_variables_avg('Quarantine', 5, 3, all_trends, engine='vectorized')
+    >>> list(result)
+    ['Baseline', 'Quarantine']
+
     >>> all_trends = {}
     >>> result = model_variables_avg('Flamethrower', 5, 3, all_trends)
     Traceback (most recent call last):
@@ -219,13 +276,18 @@ def model_variables_avg(run_mode: str, sims_run: int, sim_iterations: int, all_t
     plt.tick_params(labelsize=8)
     all_avg_lines = []
 
-    for i in range(sims_run):
-        df = saturation_main(run_mode, sim_iterations, life_cycle=life_cycle, prefix=prefix)
-        make_average_graphs(df, sim_iterations, tick_steps)
-
-        vis_df = make_visual_df(df)
-        avg_df = vis_df.mean(axis=1)
-        all_avg_lines.append(avg_df.values)
+    if engine in ('vectorized', 'parallel'):
+        all_avg_lines = list(get_ensemble_avg_lines(run_mode, sims_run, sim_iterations, life_cycle, prefix, engine))
+        for avg_line in all_avg_lines:
+            plot_average_line(avg_line, sim_iterations, time_frame, tick_steps)
+    else:
+        for i in range(sims_run):
+            df = saturation_main(run_mode, sim_iterations, life_cycle=life_cycle, prefix=prefix)
+            make_average_graphs(df, sim_iterations, time_frame, tick_steps)
+
+            vis_df = make_visual_df(df)
+            avg_df = vis_df.mean(axis=1)
+            all_avg_lines.append(avg_df.values)
     plt.grid()
     if all_avg_lines:
         overall_avg = pd.DataFrame(all_avg_lines).mean()
@@ -237,3 +299,58 @@ def model_variables_avg(run_mode: str, sims_run: int, sim_iterations: int, all_t
     plt.ylabel('Saturation Percentage')
     plt.show()
     return all_trends
+
+
+def model_variables_band(run_mode: str, sims_run: int, sim_iterations: int, all_trends: dict, life_cycle=False,
+                         prefix=None, time_frame=None, tick_steps=1, workers=None, seed=None, tolerance=None) -> dict:
+    """
+    A version of model_variables_avg for very large ensembles. Instead of a line per simulation, plots the average
+    trend with its 5-95% quantile band and the 95% confidence interval of the mean. The simulations are summarized
+    by parallel_aggregate as they finish, so memory does not grow with sims_run.
+    :param run_mode: type of mode the simulation runs in
+    :param sims_run: number of runs
+    :param sim_iterations: number of iterations per run
+    :param all_trends: a dictionary that accumulates trends for each of the simulations run in different modes.
+    :param life_cycle: a boolean which determine if the annual or monthly simulation runs.
+    :param prefix: alter this to change which network and handlers handled by the system
+    :param time_frame: Whether label is set to Years or Months
+    :param tick_steps: the step for x-ticks.
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param seed: int or SeedSequence to spawn from, defaults to fresh entropy from the OS
+    :param tolerance: runs batches of simulations until the 95% confidence interval of the trend is narrower than
+    tolerance at every timestep, with sims_run as the most runs, see adaptive_ensemble. Defaults to exactly sims_run.
+    :return all_trends: output dict that gets passed to the next run mode simulation.
+
+    >>> result = model_variables_band('Quarantine', 20, 3, {}, workers=1, seed=3)
+    >>> list(result), len(result['Quarantine'])
+    (['Quarantine'], 4)
+    >>> result = model_variables_band('Baseline', 500, 3, result, workers=1, seed=3, tolerance=0.05)
+    >>> list(result)
+    ['Quarantine', 'Baseline']
+    """
+    time_frame = 'Years' if time_frame is None else time_frame
+    if tolerance is None:
+        aggregator = parallel_aggregate(run_mode, sim_iterations, sims_run, life_cycle=life_cycle, prefix=prefix,
+                                        seed=seed, workers=workers, county_quantiles=False)
+    else:
+        aggregator, converged = adaptive_ensemble(run_mode, sim_iterations, tolerance, life_cycle=life_cycle,
+                                                  prefix=prefix, seed=seed, max_replicates=sims_run,
+                                                  workers=workers, county_quantiles=False)
+    summary_df = aggregator.to_dataframe()
+
+    plt.figure(figsize=(12, 8))
+    plt.title(f'{run_mode} Saturation Model')
+    plt.tick_params(labelsize=8)
+    plt.fill_between(summary_df.index, summary_df['q5'], summary_df['q95'], alpha=0.2, label='5-95% of runs')
+    plt.fill_between(summary_df.index, summary_df['ci_low'], summary_df['ci_high'], alpha=0.5,
+                     label='95% CI of the mean')
+    plt.plot(summary_df.index, summary_df['mean'], 'k-', linewidth=3)  # Plotting the overall trend line
+    all_trends[run_mode] = summary_df['mean']
+    plt.grid()
+    plt.legend()
+    plt.xticks(ticks=range(0, sim_iterations + 1, tick_steps),
+               labels=range(0, sim_iterations + 1, tick_steps))
+    plt.xlabel(time_frame)
+    plt.ylabel('Saturation Percentage')
+    plt.show()
+    return all_trends